@@ -0,0 +1,102 @@
+"""
+Measure lookup throughput of reader threads while a writer keeps replacing the
+configuration, with a lock around the current frozen configuration and with
+AtomicConf.
+
+Run from the source tree::
+
+    python benchmarks/bench_atomic.py [--readers N] [--duration S]
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import confloader  # NOQA
+
+
+KEYS = ['section{}.option{}'.format(i, j) for i in range(50) for j in range(20)]
+
+
+def make_conf(generation):
+    return confloader.ConfDict((key, generation) for key in KEYS)
+
+
+class LockedHolder(object):
+    """ Reference to the current frozen configuration guarded by a lock """
+
+    def __init__(self, conf):
+        self.conf = conf.freeze()
+        self.lock = threading.Lock()
+
+    def read(self, keys):
+        with self.lock:
+            conf = self.conf
+            return [conf[key] for key in keys]
+
+    def publish(self, conf):
+        frozen = conf.freeze()
+        with self.lock:
+            self.conf = frozen
+
+
+class AtomicHolder(object):
+    def __init__(self, conf):
+        self.holder = confloader.AtomicConf(conf)
+
+    def read(self, keys):
+        conf = self.holder.current
+        return [conf[key] for key in keys]
+
+    def publish(self, conf):
+        self.holder.publish(conf)
+
+
+def measure(holder, readers, duration):
+    stop = threading.Event()
+    counts = []
+    keys = KEYS[::50]
+
+    def read():
+        count = 0
+        while not stop.is_set():
+            values = holder.read(keys)
+            assert len(set(values)) == 1
+            count += 1
+        counts.append(count * len(keys))
+
+    def write():
+        generation = 0
+        while not stop.wait(0.01):
+            generation += 1
+            holder.publish(make_conf(generation))
+
+    threads = [threading.Thread(target=read) for _ in range(readers)]
+    threads.append(threading.Thread(target=write))
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--readers', type=int, default=16,
+                        help='number of reader threads')
+    parser.add_argument('--duration', type=float, default=2,
+                        help='measured time in seconds')
+    args = parser.parse_args()
+    print('{} readers, {} keys'.format(args.readers, len(KEYS)))
+    for label, cls in (('lock', LockedHolder), ('atomic', AtomicHolder)):
+        rate = measure(cls(make_conf(0)), args.readers, args.duration)
+        print('{:7} {:12.0f} lookups/s'.format(label + ':', rate))
+
+
+if __name__ == '__main__':
+    main()
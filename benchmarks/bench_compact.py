@@ -0,0 +1,85 @@
+"""
+Compare loading time and retained memory of long numeric list values stored
+as lists and as compact lists.
+
+Run from the source tree::
+
+    python benchmarks/bench_compact.py [--lists N] [--items N]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import confloader  # NOQA
+
+
+def generate(root, lists, items):
+    path = os.path.join(root, 'main.ini')
+    with open(path, 'w') as f:
+        f.write('[tables]\n')
+        for i in range(lists):
+            f.write('ports{} =\n'.format(i))
+            f.write(''.join('    {}\n'.format(1024 + j)
+                            for j in range(items)))
+            f.write('freqs{} =\n'.format(i))
+            f.write(''.join('    {}.{}\n'.format(j, j % 10)
+                            for j in range(items)))
+            f.write('sizes{} =\n'.format(i))
+            f.write(''.join('    {} KB\n'.format(j) for j in range(items)))
+    with open(os.path.join(root, 'extra.ini'), 'w') as f:
+        f.write('[tables]\n')
+        for i in range(lists):
+            f.write('+ports{} =\n    80\n    443\n'.format(i))
+    return path
+
+
+def load(path, compact):
+    conf = confloader.ConfDict.from_file(path, compact=compact,
+                                         engine='stream')
+    conf.import_from_file(os.path.join(os.path.dirname(path), 'extra.ini'))
+    return conf
+
+
+def measure(path, compact):
+    start = time.time()
+    load(path, compact)
+    elapsed = time.time() - start
+    tracemalloc.start()
+    conf = load(path, compact)
+    # Only the values are compared, not the raw text held by the index
+    conf.parser = None
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return elapsed, size, conf
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--lists', type=int, default=10,
+                        help='number of lists of each type')
+    parser.add_argument('--items', type=int, default=20000,
+                        help='number of items in each list')
+    args = parser.parse_args()
+    root = tempfile.mkdtemp()
+    try:
+        path = generate(root, args.lists, args.items)
+        print('{} lists of {} items'.format(args.lists * 3, args.items))
+        results = []
+        for label, compact in (('lists', False), ('compact', True)):
+            elapsed, size, conf = measure(path, compact)
+            results.append(conf)
+            print('{:8} {:8.3f} s {:10.1f} KB retained'.format(
+                label + ':', elapsed, size / 1024.0))
+        assert dict(results[0]) == dict(results[1])
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Compare the time and peak memory of loading a large configuration file with
+the ``parser`` and ``stream`` engines.
+
+Run from the source tree (memory is only reported on Python 3)::
+
+    python benchmarks/bench_engine.py [--sections N] [--options N]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import confloader  # NOQA
+
+
+def generate(root, sections, options):
+    path = os.path.join(root, 'large.ini')
+    with open(path, 'w') as f:
+        for i in range(sections):
+            f.write('[section{}]\n'.format(i))
+            for j in range(options):
+                f.write('name{0} = value {0} of section {1}\n'.format(j, i))
+                f.write('port{} = {}\n'.format(j, 8000 + j))
+            f.write('hosts =\n    alpha.example.com\n    beta.example.com\n'
+                    '\n')
+    return path
+
+
+def measure(path, engine):
+    start = time.time()
+    conf = confloader.ConfDict.from_file(path, engine=engine)
+    elapsed = time.time() - start
+    peak = None
+    if tracemalloc is not None:
+        # Tracing slows loading down, so memory is measured separately
+        del conf
+        tracemalloc.start()
+        conf = confloader.ConfDict.from_file(path, engine=engine)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, peak, conf
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--sections', type=int, default=2000,
+                        help='number of sections')
+    parser.add_argument('--options', type=int, default=20,
+                        help='number of option pairs per section')
+    args = parser.parse_args()
+    root = tempfile.mkdtemp()
+    try:
+        path = generate(root, args.sections, args.options)
+        size = os.path.getsize(path) / 1024.0 / 1024.0
+        print('{:.1f} MB, {} sections'.format(size, args.sections))
+        results = {}
+        for engine in ('parser', 'stream'):
+            elapsed, peak, conf = measure(path, engine)
+            results[engine] = conf
+            line = '{:7} {:8.3f} s'.format(engine + ':', elapsed)
+            if peak is not None:
+                line += ' {:8.1f} MB peak'.format(peak / 1024.0 / 1024.0)
+            print(line)
+        assert results['parser'] == results['stream']
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
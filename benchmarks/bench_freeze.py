@@ -0,0 +1,45 @@
+"""
+Compare the lookup throughput of ConfDict, its frozen copy and a plain dict.
+
+Run from the source tree::
+
+    python benchmarks/bench_freeze.py [--keys N] [--number N]
+"""
+import os
+import sys
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import confloader  # NOQA
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--keys', type=int, default=1000,
+                        help='number of keys')
+    parser.add_argument('--number', type=int, default=200,
+                        help='passes over the keys per timing run')
+    args = parser.parse_args()
+    conf = confloader.ConfDict(
+        ('section{}.option{}'.format(i // 10, i % 10), i)
+        for i in range(args.keys))
+    candidates = (
+        ('ConfDict', conf),
+        ('frozen', conf.freeze()),
+        ('dict', dict(conf)),
+    )
+    keys = list(conf)
+    lookups = args.number * len(keys)
+    print('{} keys, {} lookups per run'.format(len(keys), lookups))
+    for label, mapping in candidates:
+        # A comprehension keeps the loop overhead the same for all of them
+        elapsed = min(timeit.repeat(lambda: [mapping[k] for k in keys],
+                                    number=args.number, repeat=5))
+        print('{:9} {:8.1f} ns/lookup {:8.1f} M lookups/s'.format(
+            label + ':', elapsed / lookups * 1e9, lookups / elapsed / 1e6))
+
+
+if __name__ == '__main__':
+    main()
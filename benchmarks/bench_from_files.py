@@ -0,0 +1,71 @@
+"""
+Measure loading of many independent per-device configurations that share a
+base file, serially and in a pool of processes.
+
+Run from the source tree::
+
+    python benchmarks/bench_from_files.py [--devices N] [--keys N]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import confloader  # NOQA
+
+
+def generate(root, devices, keys):
+    with open(os.path.join(root, 'base.ini'), 'w') as f:
+        f.write('[global]\nallowed_hosts =\n    localhost\n\n')
+        for i in range(keys // 10):
+            f.write('[section{}]\n'.format(i))
+            for j in range(10):
+                f.write('option{} = {}\n'.format(j, j * 100))
+    paths = []
+    for i in range(devices):
+        path = os.path.join(root, 'device{}.ini'.format(i))
+        with open(path, 'w') as f:
+            f.write('[config]\ndefaults = base.ini\n\n[device]\n'
+                    'name = device{0}\nport = {1}\n\n[global]\n'
+                    '+allowed_hosts =\n    device{0}.example.com\n'.format(
+                        i, 8000 + i))
+        paths.append(path)
+    return paths
+
+
+def measure(paths, workers):
+    start = time.time()
+    results = list(confloader.ConfDict.from_files(paths, workers=workers,
+                                                  cache=True))
+    assert not any(r.error for r in results)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--devices', type=int, default=2000,
+                        help='number of device configurations')
+    parser.add_argument('--keys', type=int, default=500,
+                        help='number of options in the shared base file')
+    args = parser.parse_args()
+    root = tempfile.mkdtemp()
+    try:
+        paths = generate(root, args.devices, args.keys)
+        print('{} devices, {} shared keys, {} CPUs'.format(
+            args.devices, args.keys, os.cpu_count()))
+        baseline = measure(paths, None)
+        print('serial:     {:8.3f} s'.format(baseline))
+        for workers in (2, 4, 8):
+            elapsed = measure(paths, workers)
+            print('{:2} workers: {:8.3f} s ({:.1f}x)'.format(
+                workers, elapsed, baseline / elapsed))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
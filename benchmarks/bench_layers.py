@@ -0,0 +1,81 @@
+"""
+Compare the memory held by many per-tenant configurations that share a large
+base file, loaded as ConfDict objects and as LayeredConf objects with shared
+layers.
+
+Run from the source tree::
+
+    python benchmarks/bench_layers.py [--tenants N] [--keys N]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import confloader  # NOQA
+
+
+def generate(root, tenants, keys):
+    with open(os.path.join(root, 'base.ini'), 'w') as f:
+        for i in range(keys // 10):
+            f.write('[section{}]\n'.format(i))
+            for j in range(10):
+                f.write('option{} = value{}\n'.format(j, j))
+    paths = []
+    for i in range(tenants):
+        path = os.path.join(root, 'tenant{}.ini'.format(i))
+        with open(path, 'w') as f:
+            f.write('[config]\ndefaults = base.ini\n\n[tenant]\n'
+                    'name = tenant{0}\nport = {1}\n'.format(i, 8000 + i))
+        paths.append(path)
+    return paths
+
+
+def measure(load, paths):
+    tracemalloc.start()
+    start = time.time()
+    confs = [load(path) for path in paths]
+    elapsed = time.time() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return elapsed, size, confs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--tenants', type=int, default=200,
+                        help='number of tenant configurations')
+    parser.add_argument('--keys', type=int, default=2000,
+                        help='number of options in the shared base file')
+    args = parser.parse_args()
+    root = tempfile.mkdtemp()
+    try:
+        paths = generate(root, args.tenants, args.keys)
+        shared = {}
+        candidates = (
+            ('ConfDict', lambda p: confloader.ConfDict.from_file(
+                p, cache=True)),
+            ('LayeredConf', lambda p: confloader.LayeredConf.from_file(
+                p, shared=shared)),
+        )
+        print('{} tenants, {} shared keys'.format(args.tenants, args.keys))
+        results = []
+        for label, load in candidates:
+            confloader.parse_cache.clear()
+            elapsed, size, confs = measure(load, paths)
+            results.append(confs)
+            print('{:12} {:8.3f} s {:10.1f} KB retained'.format(
+                label + ':', elapsed, size / 1024.0))
+        for conf, layered in zip(*results):
+            assert dict(conf.items()) == dict(layered.items())
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
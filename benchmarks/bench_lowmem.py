@@ -0,0 +1,128 @@
+"""
+Compare the memory retained by a loaded configuration with and without the
+low-memory mode, for a file that overrides a defaults file, and for a file
+that includes many small files.
+
+Run from the source tree::
+
+    python benchmarks/bench_lowmem.py [--sections N] [--options N]
+    python benchmarks/bench_lowmem.py --baseline old_confloader.py
+
+With ``--baseline``, the configurations are also loaded with the module at
+that path, such as a release made before the low-memory mode was added
+(``git show <rev>:confloader.py > old_confloader.py``), which loads them
+without any flags.
+"""
+import gc
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import importlib.util
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import confloader  # NOQA
+
+
+VALUES = ('/var/lib/app/data', '8080', 'yes', '0.75', '64 KB', 'null',
+          'admin@example.com', '30')
+
+
+def write_sections(f, sections, options, start=0):
+    for i in range(start, start + sections):
+        f.write('[section{}]\n'.format(i))
+        for j in range(options):
+            f.write('option{} = {}\n'.format(j, VALUES[j % len(VALUES)]))
+
+
+def generate_defaults(root, sections, options):
+    # The main file overrides all the options of the defaults file
+    for name in ('base', 'main'):
+        with open(os.path.join(root, name + '.ini'), 'w') as f:
+            if name == 'main':
+                f.write('[config]\ndefaults = base.ini\n\n')
+            write_sections(f, sections, options)
+    return os.path.join(root, 'main.ini')
+
+
+def generate_includes(root, sections, options):
+    # Each included file holds sections of its own
+    os.mkdir(os.path.join(root, 'conf.d'))
+    files = 100
+    per_file = max(1, sections // files)
+    for i in range(files):
+        path = os.path.join(root, 'conf.d', '{:03}.ini'.format(i))
+        with open(path, 'w') as f:
+            write_sections(f, per_file, options, start=i * per_file)
+    path = os.path.join(root, 'include.ini')
+    with open(path, 'w') as f:
+        f.write('[config]\ninclude = conf.d/*.ini\n\n[global]\nname = x\n')
+    return path
+
+
+def load_module(path):
+    spec = importlib.util.spec_from_file_location('baseline', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def measure(load):
+    start = time.time()
+    load()
+    elapsed = time.time() - start
+    gc.collect()
+    tracemalloc.start()
+    conf = load()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return elapsed, size, conf
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--sections', type=int, default=500,
+                        help='number of sections in each file')
+    parser.add_argument('--options', type=int, default=20,
+                        help='number of options in each section')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='path of a confloader module to compare with')
+    args = parser.parse_args()
+    loaders = [
+        ('default', lambda path: confloader.ConfDict.from_file(path)),
+        ('lowmem', lambda path: confloader.ConfDict.from_file(path,
+                                                              lowmem=True)),
+    ]
+    if args.baseline:
+        baseline = load_module(args.baseline)
+        loaders.insert(0, ('baseline',
+                           lambda path: baseline.ConfDict.from_file(path)))
+    root = tempfile.mkdtemp()
+    try:
+        scenarios = [
+            ('2 files of {} keys'.format(args.sections * args.options),
+             generate_defaults(root, args.sections, args.options)),
+            ('100 includes of {} keys in total'.format(
+                args.sections * args.options),
+             generate_includes(root, args.sections, args.options)),
+        ]
+        for title, path in scenarios:
+            print(title)
+            results = []
+            for label, load in loaders:
+                elapsed, size, conf = measure(lambda: load(path))
+                results.append(dict(conf))
+                print('  {:9} {:8.3f} s {:10.1f} KB retained'.format(
+                    label + ':', elapsed, size / 1024.0))
+            assert all(result == results[-1] for result in results)
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
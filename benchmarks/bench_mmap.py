@@ -0,0 +1,90 @@
+"""
+Compare loading a very large configuration file in full with loading it with
+the ``mmap`` engine and using only a few of its sections.
+
+Run from the source tree (memory is only reported on Python 3)::
+
+    python benchmarks/bench_mmap.py [--sections N] [--used N]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import confloader  # NOQA
+
+
+def generate(root, sections):
+    path = os.path.join(root, 'devices.ini')
+    with open(path, 'w') as f:
+        f.write('[global]\nname = devices\n\n')
+        for i in range(sections):
+            f.write('[device{}]\n'.format(i))
+            for j in range(32):
+                f.write('channel{0} = {1} MHz on antenna {0}\n'.format(
+                    j, 400 + j))
+                f.write('gain{} = {}\n'.format(j, j * 0.5))
+            f.write('\n')
+    return path
+
+
+def use(path, engine, used):
+    conf = confloader.ConfDict.from_file(path, engine=engine)
+    for i in range(used):
+        conf['device{}.gain3'.format(i * 97)]
+    return conf
+
+
+def measure(path, engine, used):
+    start = time.time()
+    conf = use(path, engine, used)
+    elapsed = time.time() - start
+    peak = None
+    if tracemalloc is not None:
+        # Tracing slows loading down, so memory is measured separately
+        del conf
+        tracemalloc.start()
+        conf = use(path, engine, used)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, peak, conf
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--sections', type=int, default=5000,
+                        help='number of sections')
+    parser.add_argument('--used', type=int, default=3,
+                        help='number of sections used')
+    args = parser.parse_args()
+    root = tempfile.mkdtemp()
+    try:
+        path = generate(root, args.sections)
+        size = os.path.getsize(path) / 1024.0 / 1024.0
+        print('{:.1f} MB, {} sections, {} used'.format(
+            size, args.sections, args.used))
+        results = {}
+        for engine in ('parser', 'stream', 'mmap'):
+            elapsed, peak, conf = measure(path, engine, args.used)
+            results[engine] = conf
+            line = '{:7} {:8.3f} s'.format(engine + ':', elapsed)
+            if peak is not None:
+                line += ' {:8.1f} MB peak'.format(peak / 1024.0 / 1024.0)
+            print(line)
+        results['mmap'].resolve()
+        assert results['mmap'] == results['parser']
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Measure loading of a configuration with many include fragments on a simulated
+high-latency filesystem, with and without concurrent loading.
+
+Run from the source tree::
+
+    python benchmarks/bench_parallel_include.py [--fragments N] [--latency MS]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import confloader  # NOQA
+
+
+class SlowConfDict(confloader.ConfDict):
+    """ ConfDict whose file reads take at least ``latency`` seconds """
+
+    latency = 0.005
+
+    def _init_parser(self):
+        # Sleeping releases the GIL the same way a blocking read does
+        time.sleep(self.latency)
+        super(SlowConfDict, self)._init_parser()
+
+
+def generate(root, fragments):
+    os.mkdir(os.path.join(root, 'conf.d'))
+    with open(os.path.join(root, 'main.ini'), 'w') as f:
+        f.write('[config]\ninclude = conf.d/*.ini\n\n[global]\n'
+                'allowed_hosts =\n    localhost\n')
+    for i in range(fragments):
+        name = os.path.join(root, 'conf.d', 'frag{:04}.ini'.format(i))
+        with open(name, 'w') as f:
+            f.write('[component{0}]\nenabled = yes\nport = {1}\n'
+                    'timeout = 2.5\nbuffer = 64 KB\n\n[global]\n'
+                    '+allowed_hosts =\n    host{0}.example.com\n'.format(
+                        i, 8000 + i))
+    return os.path.join(root, 'main.ini')
+
+
+def measure(path, workers):
+    start = time.time()
+    conf = SlowConfDict.from_file(path, workers=workers)
+    return time.time() - start, conf
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--fragments', type=int, default=300,
+                        help='number of include fragments')
+    parser.add_argument('--latency', type=float, default=5,
+                        help='simulated latency of each file read in ms')
+    args = parser.parse_args()
+    SlowConfDict.latency = args.latency / 1000.0
+    root = tempfile.mkdtemp()
+    try:
+        path = generate(root, args.fragments)
+        print('{} fragments, {} ms per read'.format(args.fragments,
+                                                   args.latency))
+        baseline, expected = measure(path, None)
+        print('serial:     {:8.3f} s'.format(baseline))
+        for workers in (4, 8, 16, 32):
+            elapsed, conf = measure(path, workers)
+            assert conf == expected
+            print('{:2} workers: {:8.3f} s ({:.1f}x)'.format(
+                workers, elapsed, baseline / elapsed))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
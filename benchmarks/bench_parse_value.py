@@ -0,0 +1,88 @@
+"""
+Compare the single-pass ``parse_value`` with the original regex cascade.
+
+Run from the source tree::
+
+    python benchmarks/bench_parse_value.py [--number N]
+"""
+import os
+import re
+import sys
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import confloader  # NOQA
+
+
+FLOAT_RE = re.compile(r'^-?\d+\.\d+$')
+INT_RE = re.compile(r'^-?\d+$')
+SIZE_RE = re.compile(r'^-?\d+(\.\d{1,3})? ?[KMG]B$', re.I)
+
+
+def legacy_parse_value(val):
+    """ The type detection cascade used before the single-pass classifier """
+    if val.lower() in ('yes', 'true'):
+        return True
+    if val.lower() in ('no', 'false'):
+        return False
+    if val.lower() in ('null', 'none'):
+        return None
+    if FLOAT_RE.match(val):
+        return float(val)
+    if INT_RE.match(val):
+        return int(val)
+    if SIZE_RE.match(val):
+        return confloader.parse_size(val)
+    if val.startswith('\n'):
+        return [legacy_parse_value(v) for v in val[1:].split('\n')]
+    return val
+
+
+# Roughly the mix found in generated application configs: mostly strings
+# (paths, hosts, names), followed by integers and booleans, with a sprinkle of
+# floats, sizes, nulls and lists.
+SAMPLE = (
+    ['/var/lib/app/data', 'localhost', 'INFO', 'utf-8', 'admin@example.com',
+     'sqlite:///db.sqlite', '%(asctime)s %(message)s', 'eth0', ''] * 4 +
+    ['8080', '30', '0', '-1', '65535', '1024'] * 3 +
+    ['yes', 'no', 'True', 'false'] * 3 +
+    ['0.5', '12.25', '-3.0'] +
+    ['200 KB', '5MB', '1.5 GB'] +
+    ['null', 'None'] +
+    ['\nfoo\nbar\nbaz', '\n1\n2\n3\n4', '\n10KB\n12 mB\n5 gb']
+)
+
+
+def check():
+    for val in SAMPLE:
+        expected = legacy_parse_value(val)
+        actual = confloader.parse_value(val)
+        assert actual == expected and type(actual) is type(expected), val
+
+
+def bench(func, number):
+    def run():
+        for val in SAMPLE:
+            func(val)
+    return min(timeit.repeat(run, number=number, repeat=5))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--number', type=int, default=2000,
+                        help='passes over the sample per timing run')
+    args = parser.parse_args()
+    check()
+    calls = args.number * len(SAMPLE)
+    legacy = bench(legacy_parse_value, args.number)
+    current = bench(confloader.parse_value, args.number)
+    print('{} values, {} calls per run'.format(len(SAMPLE), calls))
+    print('legacy cascade:   {:8.1f} ns/value'.format(legacy / calls * 1e9))
+    print('single pass:      {:8.1f} ns/value'.format(current / calls * 1e9))
+    print('speedup:          {:8.2f}x'.format(legacy / current))
+
+
+if __name__ == '__main__':
+    main()
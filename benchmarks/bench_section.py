@@ -0,0 +1,56 @@
+"""
+Compare reading all options of one section by scanning the keys with reading
+them through a section view.
+
+Run from the source tree::
+
+    python benchmarks/bench_section.py [--sections N] [--number N]
+"""
+import os
+import sys
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import confloader  # NOQA
+
+
+def generate(sections):
+    conf = confloader.ConfDict()
+    for i in range(sections):
+        for j in range(10):
+            conf['handler{}.option{}'.format(i, j)] = j
+    return conf
+
+
+def scan(conf, name):
+    prefix = name + '.'
+    return dict((key[len(prefix):], value) for key, value in conf.items()
+                if key.startswith(prefix))
+
+
+def view(conf, name):
+    return dict(conf.section(name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--sections', type=int, default=1000,
+                        help='number of sections')
+    parser.add_argument('--number', type=int, default=200,
+                        help='section reads per timing run')
+    args = parser.parse_args()
+    conf = generate(args.sections)
+    name = 'handler{}'.format(args.sections // 2)
+    assert scan(conf, name) == view(conf, name)
+    print('{} sections, {} keys'.format(args.sections, len(conf)))
+    for func in (scan, view):
+        elapsed = min(timeit.repeat(lambda: func(conf, name),
+                                    number=args.number, repeat=5))
+        print('{:5} {:10.1f} us/section'.format(
+            func.__name__ + ':', elapsed / args.number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+"""
+Measure the whole load pipeline on synthetic configurations: import time,
+``from_file`` latency, peak memory, and ``__getitem__`` throughput.
+
+Run from the source tree::
+
+    python benchmarks/bench_suite.py [--scale F] [--output results.json]
+    python benchmarks/bench_suite.py --compare baseline.json
+
+The results are printed and, with ``--output``, saved as JSON. With
+``--compare``, each measurement is compared with the one stored in the
+baseline file, and the exit status is 1 if any of them is slower (or larger)
+by more than ``--threshold`` percent.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import timeit
+import argparse
+import platform
+import tempfile
+import subprocess
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import confloader  # NOQA
+
+
+clock = getattr(time, 'perf_counter', time.time)
+
+# Mix of values found in generated application configs
+VALUES = ('/var/lib/app/data', '8080', 'yes', '0.75', '64 KB', 'null',
+          'admin@example.com', '30')
+
+
+def write(path, content):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def sections(count, options, prefix='section'):
+    """ Return ``count`` sections of ``options`` options each """
+    lines = []
+    for i in range(count):
+        lines.append('[{}{}]'.format(prefix, i))
+        for j in range(options):
+            lines.append('option{} = {}'.format(j, VALUES[j % len(VALUES)]))
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def make_flat(root, scale):
+    """ One file with 10k keys """
+    path = os.path.join(root, 'main.ini')
+    write(path, sections(int(500 * scale), 20))
+    return path
+
+
+def make_lists(root, scale):
+    """ Long list values """
+    items = int(1000 * scale)
+    lines = ['[lists]']
+    for i in range(50):
+        lines.append('list{} ='.format(i))
+        lines.extend('    item{}'.format(j) for j in range(items))
+    path = os.path.join(root, 'main.ini')
+    write(path, '\n'.join(lines) + '\n')
+    return path
+
+
+def make_extensions(root, scale):
+    """ Hundreds of fragments extending the same keys """
+    count = int(500 * scale)
+    write(os.path.join(root, 'main.ini'),
+          '[config]\ninclude = conf.d/*.ini\n\n[global]\n'
+          'allowed_hosts =\n    localhost\nplugins =\n    core\n')
+    for i in range(count):
+        write(os.path.join(root, 'conf.d', 'frag{:05}.ini'.format(i)),
+              '[global]\n+allowed_hosts =\n    host{0}.example.com\n'
+              '    alt{0}.example.com\n+plugins =\n    plugin{0}\n'.format(i))
+    return os.path.join(root, 'main.ini')
+
+
+def make_deep(root, scale):
+    """ A long chain of defaults and include files """
+    depth = int(100 * scale)
+    for i in range(depth):
+        config = ''
+        if i + 1 < depth:
+            config = '[config]\ndefaults = d{0}.ini\ninclude = i{0}.ini\n\n'
+            config = config.format(i + 1)
+        body = sections(2, 10, 'level{}_'.format(i))
+        write(os.path.join(root, 'd{}.ini'.format(i)), config + body)
+        write(os.path.join(root, 'i{}.ini'.format(i)),
+              sections(2, 10, 'inc{}_'.format(i)))
+    return os.path.join(root, 'd0.ini')
+
+
+def make_wide(root, scale):
+    """ Many explicitly listed defaults and include files """
+    count = int(200 * scale)
+    names = ['wide/f{}.ini'.format(i) for i in range(count)]
+    half = count // 2
+    write(os.path.join(root, 'main.ini'),
+          '[config]\ndefaults =\n    {}\ninclude =\n    {}\n\n{}'.format(
+              '\n    '.join(names[:half]), '\n    '.join(names[half:]),
+              sections(5, 10)))
+    for i, name in enumerate(names):
+        write(os.path.join(root, name), sections(5, 10, 'w{}_'.format(i)))
+    return os.path.join(root, 'main.ini')
+
+
+def make_glob(root, scale):
+    """ A glob pattern matching thousands of small files """
+    count = int(2000 * scale)
+    write(os.path.join(root, 'main.ini'),
+          '[config]\ninclude = fanout/*/*.ini\n')
+    for i in range(count):
+        write(os.path.join(root, 'fanout', 'd{}'.format(i % 20),
+                           'f{}.ini'.format(i)),
+              '[glob{}]\nenabled = yes\nport = {}\n'.format(i, 8000 + i))
+    return os.path.join(root, 'main.ini')
+
+
+SCENARIOS = (
+    ('flat', make_flat),
+    ('lists', make_lists),
+    ('extensions', make_extensions),
+    ('deep', make_deep),
+    ('wide', make_wide),
+    ('glob', make_glob),
+)
+
+
+def measure_import(repeat):
+    """ Time a fresh import of the module in a new interpreter """
+    code = ('import sys, time; sys.path.insert(0, {!r}); '
+            'clock = getattr(time, "perf_counter", time.time); '
+            's = clock(); import confloader; print(clock() - s)').format(ROOT)
+    times = []
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', code])
+        times.append(float(out.decode('ascii')))
+    return min(times)
+
+
+def measure_load(path, repeat):
+    best = None
+    for _ in range(repeat):
+        start = clock()
+        conf = confloader.ConfDict.from_file(path)
+        elapsed = clock() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, conf
+
+
+def measure_memory(path):
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        conf = confloader.ConfDict.from_file(path)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    del conf
+    return peak
+
+
+def measure_lookups(conf, number):
+    keys = list(conf)
+    elapsed = min(timeit.repeat(lambda: [conf[k] for k in keys],
+                                number=number, repeat=5))
+    return elapsed / (number * len(keys)) * 1e9
+
+
+def run(args):
+    results = {
+        'python': platform.python_version(),
+        'version': confloader.__version__,
+        'import_s': measure_import(args.repeat),
+        'scenarios': {},
+    }
+    for name, make in SCENARIOS:
+        if args.scenarios and name not in args.scenarios:
+            continue
+        root = tempfile.mkdtemp()
+        try:
+            path = make(root, args.scale)
+            load, conf = measure_load(path, args.repeat)
+            results['scenarios'][name] = {
+                'keys': len(conf),
+                'files': len(conf.sources),
+                'load_s': load,
+                'peak_bytes': measure_memory(path),
+                'getitem_ns': measure_lookups(conf, args.number),
+            }
+        finally:
+            shutil.rmtree(root)
+    return results
+
+
+# Compared measurements; all of them are better when lower
+METRICS = ('load_s', 'peak_bytes', 'getitem_ns')
+
+
+def report(results):
+    print('Python {python}, confloader {version}'.format(**results))
+    print('import: {:10.2f} ms'.format(results['import_s'] * 1000))
+    print('{:12} {:>7} {:>6} {:>10} {:>10} {:>11}'.format(
+        'scenario', 'keys', 'files', 'load ms', 'peak KB', 'getitem ns'))
+    for name, r in sorted(results['scenarios'].items()):
+        peak = r['peak_bytes']
+        print('{:12} {:7} {:6} {:10.2f} {:>10} {:11.1f}'.format(
+            name, r['keys'], r['files'], r['load_s'] * 1000,
+            '-' if peak is None else peak // 1024, r['getitem_ns']))
+
+
+def compare(results, baseline, threshold):
+    """ Print the change against the baseline and return the regressions """
+    regressions = []
+    rows = [('import', 'import_s', results, baseline)]
+    for name, r in sorted(results['scenarios'].items()):
+        if name not in baseline['scenarios']:
+            continue
+        for metric in METRICS:
+            rows.append((name, metric, r, baseline['scenarios'][name]))
+    print('{:12} {:11} {:>8}'.format('scenario', 'metric', 'change'))
+    for name, metric, current, base in rows:
+        if not current.get(metric) or not base.get(metric):
+            continue
+        change = (current[metric] / float(base[metric]) - 1) * 100
+        flag = ''
+        if change > threshold:
+            flag = ' REGRESSION'
+            regressions.append((name, metric))
+        print('{:12} {:11} {:+7.1f}%{}'.format(name, metric, change, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='size factor for the generated configurations')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='timing runs per measurement (best is kept)')
+    parser.add_argument('--number', type=int, default=20,
+                        help='passes over all keys per lookup timing run')
+    parser.add_argument('--scenario', dest='scenarios', action='append',
+                        choices=[name for name, _ in SCENARIOS],
+                        help='run only this scenario (may be repeated)')
+    parser.add_argument('--output', help='save the results as JSON')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='compare with results saved with --output')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='allowed slowdown in percent for --compare')
+    args = parser.parse_args()
+    results = run(args)
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
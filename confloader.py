@@ -2,11 +2,41 @@ import os
 import re
 import sys
 import glob
+import copy
+import time
+import mmap
+import array
+import zlib
+import errno
+import select
+import struct
+import locale
+import fnmatch
+import hashlib
+import marshal
+import weakref
+import threading
+import functools
+from collections import OrderedDict, namedtuple
 
 try:
-    from configparser import RawConfigParser as ConfigParser, NoOptionError
+    from configparser import (RawConfigParser as ConfigParser, NoOptionError,
+                              NoSectionError, ParsingError,
+                              MissingSectionHeaderError,
+                              DuplicateSectionError, DuplicateOptionError,
+                              Error as ParserError)
 except ImportError:
-    from ConfigParser import RawConfigParser as ConfigParser, NoOptionError
+    from ConfigParser import (RawConfigParser as ConfigParser, NoOptionError,
+                              NoSectionError, ParsingError,
+                              MissingSectionHeaderError,
+                              Error as ParserError)
+    # The Python 2 parser is not strict about duplicates
+    DuplicateSectionError = DuplicateOptionError = None
+
+try:
+    from collections.abc import Mapping, MutableMapping
+except ImportError:
+    from collections import Mapping, MutableMapping
 
 
 __version__ = '1.1'
@@ -14,9 +44,28 @@ __author__ = 'Outernet Inc <apps@outernet.is>'
 
 
 DEFAULT_SECTIONS = ('global')
+DEFAULT_SECTION = 'DEFAULT'
+ENGINES = ('parser', 'stream', 'mmap')
+SECTION_RE = re.compile(r'\[(?P<header>.+)\]')
 FLOAT_RE = re.compile(r'^-?\d+\.\d+$')
 INT_RE = re.compile(r'^-?\d+$')
 SIZE_RE = re.compile(r'^-?\d+(\.\d{1,3})? ?[KMG]B$', re.I)
+NUMBER_RE = re.compile(r'^(?P<int>-?\d+)(?:(?P<float>\.\d+)|'
+                       r'(?:\.\d{1,3})? ?(?P<size>[KMG])B)?$', re.I)
+# Bodies of list values whose items are all integers, floats, or byte sizes
+INT_LIST_RE = re.compile(r'-?\d+(?:\n-?\d+)*\Z')
+FLOAT_LIST_RE = re.compile(r'-?\d+\.\d+(?:\n-?\d+\.\d+)*\Z')
+SIZE_LIST_RE = re.compile(r'-?\d+(?:\.\d{1,3})? ?[KMG]B'
+                          r'(?:\n-?\d+(?:\.\d{1,3})? ?[KMG]B)*\Z', re.I)
+KEYWORDS = {
+    'yes': True,
+    'true': True,
+    'no': False,
+    'false': False,
+    'null': None,
+    'none': None,
+}
+KEYWORD_INITIALS = frozenset('yYtTnNfF')
 FACTORS = {
     'b': 1,
     'k': 1024,
@@ -24,6 +73,65 @@ FACTORS = {
     'g': 1024 * 1024 * 1024,
 }
 
+SNAPSHOT_MAGIC = b'CLSNAP\x00\x01'
+SNAPSHOT_DIGEST_SIZE = 20
+
+# Shared encoding: header, hash table slots, entries, then keys and values
+SHARED_MAGIC = b'CLSHARE\x01'
+SHARED_HEADER = struct.Struct('<8sQII')
+SHARED_SLOT = struct.Struct('<I')
+SHARED_ENTRY = struct.Struct('<IIIII')
+
+# Concurrent file loads used by asynchronous loading
+ASYNC_WORKERS = 8
+
+# Maximum number of files loaded by a single task of ConfDict.from_files()
+FROM_FILES_BATCH = 32
+
+# Suffixes of the files included from a [config] path naming a directory
+INCLUDE_SUFFIXES = ('.ini',)
+
+# Load phases in the order they are recorded in LoadStats.phases
+PHASES = ('init_parser', 'check', 'preprocess', 'glob', 'process',
+          'postprocess')
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+LoadResult = namedtuple('LoadResult', ['path', 'conf', 'error'])
+
+# Typecode of the arrays of integers ('q' is not available on Python 2)
+INT_TYPECODE = 'q' if sys.version_info >= (3, 3) else 'l'
+
+try:
+    _intern = sys.intern
+except AttributeError:
+    _intern = intern  # NOQA
+
+# Matches exactly the characters matched by ``\d`` on both Python versions
+_is_decimal = getattr(str, 'isdecimal', str.isdigit)
+# Atomic rename that also overwrites existing files on Windows (Python 3.3+)
+_replace = getattr(os, 'replace', os.rename)
+_monotonic = getattr(time, 'monotonic', time.time)
+_clock = getattr(time, 'perf_counter', time.time)
+# Directory iterator that avoids a stat() call per entry (Python 3.5+)
+_scandir = getattr(os, 'scandir', None)
+
 
 def get_config_path(default=None):
     """
@@ -42,9 +150,12 @@ def make_list(val):
     If the value is not a list, it is converted to a list. Iterables like tuple
     and list itself are converted to lists, whereas strings, integers, and
     other values are converted to a list whose sole item is the original value.
+    A :py:class:`~CompactList` is copied as is.
     """
     if type(val) in [list, tuple]:
         return list(val)
+    if type(val) is CompactList:
+        return CompactList(val.typecode, val)
     if val == '':
         return []
     return [val]
@@ -58,8 +169,19 @@ def extend_key(d, key, val):
     extended.
     """
     d.setdefault(key, [])
-    d[key] = make_list(d[key])
-    d[key].extend(val)
+    d[key] = extend_list(make_list(d[key]), val)
+
+
+def extend_list(items, values):
+    """
+    Extend the ``items`` list with ``values`` and return it. A
+    :py:class:`~CompactList` is extended in place if all the values are of
+    its item type, and is converted to a list first otherwise.
+    """
+    if type(items) is CompactList and not items.fits(values):
+        items = list(items)
+    items.extend(values)
+    return items
 
 
 def parse_size(size):
@@ -81,6 +203,27 @@ def parse_size(size):
     return size * FACTORS[suffix]
 
 
+def parse_bool(val):
+    """
+    Parse a boolean keyword such as 'yes' or 'false', and raise
+    ``ValueError`` for any other value.
+    """
+    value = KEYWORDS.get(val.lower())
+    if not isinstance(value, bool):
+        raise ValueError(val)
+    return value
+
+
+def parse_size_strict(val):
+    """
+    Same as :py:func:`~parse_size`, but raises ``ValueError`` for values
+    that are not sizes instead of returning 0.
+    """
+    if not SIZE_RE.match(val):
+        raise ValueError(val)
+    return parse_size(val)
+
+
 def parse_value(val):
     """
     Detect value type and coerce to appropriate Python type. The input must be
@@ -95,37 +238,120 @@ def parse_value(val):
     - lists (any value that sarts with a newline)
 
     Other values are returned as is.
+
+    The value is classified in a single pass: the first character selects the
+    only type the value can possibly have, and numbers and byte sizes are
+    recognized by one combined regular expression.
     """
-    # True values: 'yes', 'Yes', 'true', 'True'
-    if val.lower() in ('yes', 'true'):
-        return True
+    first = val[:1]
+
+    # Lists: one item per line, indented
+    if first == '\n':
+        return [parse_value(v) for v in val[1:].split('\n')]
+
+    # Booleans and nulls: 'yes', 'No', 'TRUE', 'false', 'null', 'None'. None
+    # of the keywords is longer than 5 characters.
+    if first in KEYWORD_INITIALS:
+        if len(val) < 6:
+            return KEYWORDS.get(val.lower(), val)
+        return val
+
+    # Numbers and data sizes: 1, -30, 12.443, 10B, 12.3MB, 5.6 GB
+    if first == '-' or first.isdigit():
+        if _is_decimal(val):
+            return int(val)
+        match = NUMBER_RE.match(val)
+        if match is None:
+            return val
+        kind = match.lastgroup
+        if kind == 'int':
+            return int(val)
+        if kind == 'float':
+            return float(val)
+        if match.end() != len(val):
+            # '$' also matches before a trailing newline, which the unit
+            # lookup below does not account for, so use the generic parser
+            return parse_size(val)
+        unit = match.start(kind)
+        return float(val[:unit]) * FACTORS[val[unit].lower()]
+
+    # Everything else is returned as is
+    return val
+
+
+def parse_compact(val):
+    """
+    Same as :py:func:`~parse_value`, but lists whose items are all integers,
+    all floats, or all byte sizes are returned as a :py:class:`~CompactList`.
+    The items of such lists are matched by a single regular expression and
+    converted in one pass, instead of being classified one by one.
+    """
+    if val[:1] != '\n':
+        return parse_value(val)
+    body = val[1:]
+    try:
+        if INT_LIST_RE.match(body):
+            return CompactList(INT_TYPECODE, map(int, body.split('\n')))
+        if FLOAT_LIST_RE.match(body):
+            return CompactList('d', map(float, body.split('\n')))
+        if SIZE_LIST_RE.match(body):
+            return CompactList('d', map(parse_size, body.split('\n')))
+    except OverflowError:
+        # Integers that do not fit in the array are stored in a list
+        pass
+    return parse_value(val)
 
-    # False values: 'no', 'No', 'false', 'False'
-    if val.lower() in ('no', 'false'):
-        return False
 
-    # Null values: 'null', 'NULL', 'none', 'None'
-    if val.lower() in ('null', 'none'):
+def file_stamp(path):
+    """
+    Return a ``(mtime, size)`` tuple describing the current state of the file
+    at specified path, or ``None`` if the file cannot be accessed. Two stamps
+    of the same file compare equal as long as the file has not been modified.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
         return None
+    return getattr(st, 'st_mtime_ns', st.st_mtime), st.st_size
+
 
-    # Floating point numbers: 1.0, 12.443, 1002.3
-    if FLOAT_RE.match(val):
-        return float(val)
+def file_digest(path):
+    """
+    Return the SHA1 hex digest of the contents of the file at specified path.
+    """
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
 
-    # Integer values: 1, 30, 445
-    if INT_RE.match(val):
-        return int(val)
 
-    # Data sizes: 10B, 12.3MB, 5.6 GB
-    if SIZE_RE.match(val):
-        return parse_size(val)
+def _futures():
+    """
+    Return the ``concurrent.futures`` module, or ``None`` if it is not
+    available.
+    """
+    # Imported here, as it is only needed for concurrent loading, and takes
+    # longer to import than the rest of this module
+    try:
+        from concurrent import futures
+    except ImportError:
+        return None
+    return futures
 
-    # Lists: one item per line, indented
-    if val.startswith('\n'):
-        return [parse_value(v) for v in val[1:].split('\n')]
 
-    # Everything else is returned as is
-    return val
+def _get_loop():
+    """
+    Return the running asyncio event loop, or the current one when called
+    outside of a coroutine.
+    """
+    # Imported here, as asyncio alone takes longer to import than the rest
+    # of the dependencies of this module
+    try:
+        import asyncio
+    except ImportError:
+        raise ConfigurationError('Asynchronous loading requires asyncio')
+    try:
+        return asyncio.get_running_loop()
+    except (AttributeError, RuntimeError):
+        return asyncio.get_event_loop()
 
 
 def get_compound_key(section, key):
@@ -148,6 +374,286 @@ def parse_key(section, key):
     return get_compound_key(section, key), is_ext
 
 
+def tokenize(lines, name='<???>'):
+    """
+    Read configuration file lines one by one, and yield a ``(section, key,
+    raw_value)`` tuple for each option as soon as its value is complete. The
+    ``lines`` argument is any iterable of lines, such as an open file, and
+    ``name`` is the file name used in error messages. Whenever a section
+    starts, a ``(section, None, None)`` tuple is yielded, so sections without
+    options are reported as well.
+
+    The accepted syntax is that of the Python 3 ``RawConfigParser``: ``#``
+    and ``;`` comment lines, ``=`` and ``:`` delimiters, option names
+    converted to lower case, and multiline values whose lines are indented
+    deeper than the option name. Malformed lines are reported with a
+    ``ParsingError`` once the whole file has been read.
+    """
+    # Option names seen in each section, for detecting duplicates
+    options = {}
+    seen = None
+    section = None
+    key = None
+    value = None
+    level = 0
+    error = None
+    for lineno, line in enumerate(lines, 1):
+        stripped = line.strip()
+        if not stripped:
+            # Blank lines are part of multiline values
+            if value is not None:
+                value.append('')
+            continue
+        if stripped[0] in '#;':
+            continue
+        if line[0] == stripped[0]:
+            indent = 0
+        else:
+            indent = len(line) - len(line.lstrip())
+        if value is not None and indent > level:
+            value.append(stripped)
+            continue
+        level = indent
+        header = stripped[0] == '[' and SECTION_RE.match(stripped)
+        if header:
+            if value is not None:
+                yield section, key, '\n'.join(value).rstrip()
+            key = value = None
+            section = header.group('header')
+            if DuplicateSectionError is not None and section in options:
+                if section != DEFAULT_SECTION:
+                    raise DuplicateSectionError(section, name, lineno)
+            seen = options.setdefault(section, set())
+            yield section, None, None
+            continue
+        if section is None:
+            raise MissingSectionHeaderError(name, lineno, line)
+        pos = stripped.find('=')
+        colon = stripped.find(':')
+        if colon >= 0 and (pos < 0 or colon < pos):
+            pos = colon
+        if pos < 0:
+            if error is None:
+                error = ParsingError(name)
+            error.append(lineno, line)
+            continue
+        if value is not None:
+            yield section, key, '\n'.join(value).rstrip()
+        key = stripped[:pos].rstrip().lower()
+        if DuplicateOptionError is not None:
+            if key in seen:
+                raise DuplicateOptionError(section, key, name, lineno)
+            seen.add(key)
+        value = [stripped[pos + 1:].lstrip()]
+        if not key:
+            # Options without a name are reported, and take no value
+            if error is None:
+                error = ParsingError(name)
+            error.append(lineno, line)
+            value = None
+    if value is not None:
+        yield section, key, '\n'.join(value).rstrip()
+    if error is not None:
+        raise error
+
+
+class RawValue(str):
+    """
+    String holding an option value whose type coercion was deferred by lazy
+    loading. :py:class:`~ConfDict` coerces such values the first time they are
+    accessed and stores the result in place of the raw value.
+    """
+    __slots__ = ()
+
+    def parse(self, compact=False):
+        """
+        Return the coerced value. Values that are not coerced to any other
+        type are returned as plain strings. The ``compact`` flag selects
+        :py:func:`~parse_compact` instead of :py:func:`~parse_value`.
+        """
+        value = parse_compact(self) if compact else parse_value(self)
+        if value is self:
+            return str(self)
+        return value
+
+
+class CompactList(array.array):
+    """
+    List of numbers of the same type, stored as an ``array.array`` rather
+    than as a list of number objects. Lists of integers, floats, and byte
+    sizes are stored this way when loading with the ``compact`` flag of
+    :py:meth:`ConfDict.from_file`, which makes long lists take several times
+    less memory.
+
+    Compact lists compare equal to lists and tuples with equal items.
+    """
+    __slots__ = ()
+
+    def __eq__(self, other):
+        if isinstance(other, (list, tuple, array.array)):
+            return len(self) == len(other) and self.tolist() == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __copy__(self):
+        return CompactList(self.typecode, self)
+
+    def fits(self, values):
+        """
+        Return whether all the ``values`` can be added to this list without
+        changing their types.
+        """
+        if isinstance(values, array.array):
+            return values.typecode == self.typecode
+        kind = float if self.typecode == 'd' else int
+        for value in values:
+            if type(value) is not kind:
+                return False
+        if kind is int:
+            try:
+                array.array(self.typecode, values)
+            except OverflowError:
+                return False
+        return True
+
+
+class ConfDiff(namedtuple('ConfDiff', ['added', 'removed', 'changed'])):
+    """
+    Named tuple describing the difference between two versions of a
+    configuration, as returned by :py:meth:`ConfDict.reload`. Each field is a
+    sorted list of keys that were added, removed, or whose values changed.
+    The diff is false if there are no differences.
+    """
+    __slots__ = ()
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    __nonzero__ = __bool__
+
+    @staticmethod
+    def _same(old, new):
+        if old is new:
+            return True
+        if type(old) is RawValue:
+            old = old.parse()
+        if type(new) is RawValue:
+            new = new.parse()
+        # Raw values are parsed into lists even where the other side has
+        # been compacted
+        if type(old) is CompactList:
+            old = old.tolist()
+        if type(new) is CompactList:
+            new = new.tolist()
+        return type(old) is type(new) and old == new
+
+    @classmethod
+    def between(cls, old, new):
+        """
+        Return the difference between ``old`` and ``new`` dicts. Values that
+        are still awaiting lazy coercion are compared by their coerced values
+        without storing them. Only the stored keys are compared, so sections
+        deferred by :py:class:`~MappedConfDict` are not loaded.
+        """
+        present = dict.__contains__
+        added = sorted(key for key in dict.keys(new)
+                       if not present(old, key))
+        removed = sorted(key for key in dict.keys(old)
+                         if not present(new, key))
+        changed = sorted(key for key, value in dict.items(old)
+                         if present(new, key) and
+                         not cls._same(value, dict.__getitem__(new, key)))
+        return cls(added, removed, changed)
+
+
+class LoadStats(object):
+    """
+    Measurements of loading a single configuration file, as found in the
+    :py:attr:`~ConfDict.load_stats` attribute. The ``children`` list holds
+    the stats of the defaults and include files in the order they were
+    loaded, so the whole file graph forms a tree.
+
+    The ``phases`` dict maps the names of the load phases (see
+    :py:data:`~PHASES`) to their wall time in seconds. The ``preprocess`` and
+    ``postprocess`` phases include loading the defaults and include files
+    respectively, and ``preprocess`` also includes the ``glob`` expansion of
+    the ``[config]`` paths. ``total`` is the wall time of the whole load.
+
+    ``role`` is ``'main'``, ``'defaults'`` or ``'include'``. ``bytes`` is the
+    size of the file, and ``options`` is the number of options that were
+    parsed from it (sections deferred by the ``mmap`` engine are not
+    counted). Files that were not loaded again, because they were already
+    loaded through another file, found in the :py:data:`~parse_cache`, or
+    unchanged on reload, are marked as ``reused``, and have no measurements.
+    """
+
+    __slots__ = ('path', 'role', 'reused', 'total', 'phases', 'bytes',
+                 'options', 'children')
+
+    def __init__(self, path, role='main', reused=False):
+        self.path = path
+        self.role = role
+        self.reused = reused
+        self.total = 0.0
+        self.phases = OrderedDict((name, 0.0) for name in PHASES)
+        self.bytes = 0
+        self.options = 0
+        self.children = []
+
+    def walk(self):
+        """
+        Iterate over the stats of this file and all its descendants, depth
+        first, in load order.
+        """
+        yield self
+        for child in self.children:
+            for stats in child.walk():
+                yield stats
+
+    @property
+    def files(self):
+        """ Number of files in the tree, including reused ones """
+        return sum(1 for _ in self.walk())
+
+    @property
+    def total_bytes(self):
+        """ Size of all files that were read in the tree """
+        return sum(stats.bytes for stats in self.walk())
+
+    @property
+    def total_options(self):
+        """ Number of options parsed from all files in the tree """
+        return sum(stats.options for stats in self.walk())
+
+    def as_dict(self):
+        """
+        Return the tree as nested dicts and lists, for example to be dumped
+        as JSON.
+        """
+        path = self.path if isinstance(self.path, str) else repr(self.path)
+        return {
+            'path': path,
+            'role': self.role,
+            'reused': self.reused,
+            'total': self.total,
+            'phases': dict(self.phases),
+            'bytes': self.bytes,
+            'options': self.options,
+            'children': [child.as_dict() for child in self.children],
+        }
+
+    def __repr__(self):
+        return '<LoadStats {!r} {:.3f} ms, {} files>'.format(
+            self.path, self.total * 1000, self.files)
+
+
 class ConfigurationError(Exception):
     """
     Raised when application is not configured correctly.
@@ -161,6 +667,7 @@ class ConfigurationFormatError(ConfigurationError):
     """
     def __init__(self, keyerr):
         key = keyerr.args[0]
+        self.key = key
         if '.' in key:
             self.section, self.subsection = key.split('.')
         else:
@@ -170,224 +677,2199 @@ class ConfigurationFormatError(ConfigurationError):
             "Configuration error in section [{}]: missing '{}' setting".format(
                 self.section, self.subsection))
 
+    def __reduce__(self):
+        return self.__class__, (KeyError(self.key),)
 
-class ConfDict(dict):
+
+class SchemaError(ConfigurationError):
     """
-    Dictionary subclass that is used to hold the parsed configuration options.
+    Raised when the loaded configuration does not conform to its
+    :py:class:`~Schema`. The ``errors`` attribute holds the list of all
+    problems that were found.
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        super(SchemaError, self).__init__(
+            'Invalid configuration:\n' + '\n'.join(
+                '  ' + error for error in errors))
 
-    :py:class:`~ConfDict` is instantiated the same way as dicts. For this
-    reason, the paths to configuation files and similar are not passed to the
-    constructor. Instead, you should use the :py:meth:`~ConfDict.from_file`
-    classmethod.
+    def __reduce__(self):
+        return self.__class__, (self.errors,)
 
-    Because this class is a dictionary, you can use the standard ``dict`` API
-    to access and modify the keys. There is a minor difference when accessing
-    key values, though. When using the subscript notation,
-    :py:class:`~ConfigurationFormatError` is raised instead of ``KeyError``
-    when the key is missing.
-    """
 
-    ConfigurationError = ConfigurationError
-    ConfigurationFormatError = ConfigurationFormatError
+class Option(object):
+    """
+    Declaration of a single option in a :py:class:`~Schema`.
 
-    def __init__(self, *args, **kwargs):
-        self.path = None
-        self.parser = None
-        self.base_path = '.'
-        self.defaults = []
-        self.include = []
-        self._extensions = []
-        self.skip_clean = False
-        self.noextend = False
-        super(ConfDict, self).__init__(*args, **kwargs)
+    The ``type`` is a callable that converts the raw string value from the
+    configuration file. The built-in ``str``, ``int``, ``float`` and ``bool``
+    types parse the value as such, and :py:func:`~parse_size` can be used for
+    sizes. ``list`` makes a list of the lines of the value, each converted by
+    the ``item`` callable if one is given. When ``type`` is ``None``, the
+    type is guessed as usual. ``default`` is the value used when the option
+    is missing, and ``required`` options must be present in the
+    configuration.
+    """
+    CONVERTERS = {
+        bool: parse_bool,
+        parse_size: parse_size_strict,
+    }
+    NAMES = {
+        parse_size: 'size',
+    }
 
-    def __getitem__(self, key):
-        try:
-            return super(ConfDict, self).__getitem__(key)
-        except KeyError as err:
-            raise ConfigurationFormatError(err)
+    def __init__(self, type=None, default=None, required=False, item=None):
+        if required and default is not None:
+            raise ValueError('Required options cannot have a default')
+        self.type = type
+        self.default = default
+        self.required = required
+        self.item = item
 
-    def get_section(self, name):
+    def compile(self):
         """
-        Returns an iterable containing options for a given section. This method
-        does *not* return the dict values, but instead uses the underlying
-        parser object to retrieve the values from the parsed configuration
-        file.
+        Return a function that converts a raw value to this option's type.
         """
-        return self.parser.items(name)
+        if self.type is None:
+            return parse_value
+        if self.type is list:
+            convert = self.CONVERTERS.get(self.item, self.item or str)
 
-    def get_option(self, section, name, default=None):
+            def convert_list(val):
+                items = val.split('\n')
+                if not items[0]:
+                    items = items[1:]
+                return [convert(item) for item in items]
+            return convert_list
+        return self.CONVERTERS.get(self.type, self.type)
+
+    def describe(self):
         """
-        Returns a single configuration option that matches the given section
-        and option names. Optional default value can be specified using the
-        ``default`` parameter, and this value is returned when the option is
-        not found.
+        Return the name of the type for error messages.
+        """
+        if self.type is list and self.item is not None:
+            return 'list of {}'.format(self._name(self.item))
+        return self._name(self.type)
 
-        As with :py:meth:`~ConfDict.get_section` method, this method operates
-        on the parsed configuration file rather than dictionary data.
+    def _name(self, type):
+        if type in self.NAMES:
+            return self.NAMES[type]
+        return getattr(type, '__name__', repr(type))
+
+
+class Schema(object):
+    """
+    Declaration of the options of a configuration, which is passed to
+    :py:meth:`ConfDict.from_file`. The ``options`` argument maps compound
+    keys to :py:class:`~Option` objects, or simply to types.
+
+    The declarations are compiled once, when the schema is created, into a
+    converter per key, a dict of defaults and a set of required keys. While
+    loading, the declared options are converted directly by their converters
+    instead of having their type guessed, and all conversion errors and
+    missing required options are reported at once by
+    :py:class:`~SchemaError` when loading finishes.
+    """
+
+    def __init__(self, options):
+        self.options = {}
+        for key, option in options.items():
+            if not isinstance(option, Option):
+                option = Option(option)
+            self.options[key] = option
+        self.converters = dict((key, option.compile())
+                               for key, option in self.options.items())
+        self.defaults = dict((key, option.default)
+                             for key, option in self.options.items()
+                             if option.default is not None)
+        self.required = frozenset(key for key, option in self.options.items()
+                                  if option.required)
+        self.lists = frozenset(key for key, option in self.options.items()
+                               if option.type is list)
+        # Dotted prefixes of the keys, which may be the names of sections
+        self.sections = frozenset(key[:pos] for key in self.options
+                                  for pos in range(len(key))
+                                  if key[pos] == '.')
+
+    def convert(self, key, value, errors):
+        """
+        Convert the raw value of a declared key. If the value is invalid, the
+        error is added to the ``errors`` list and the raw value is returned.
         """
         try:
-            return self.parser.get(section, name)
-        except NoOptionError:
-            return default
+            return self.converters[key](value)
+        except (ValueError, TypeError, KeyError):
+            errors.append("'{}': invalid {} value '{}'".format(
+                key, self.options[key].describe(), value))
+            return value
+
+    def check(self, conf):
+        """
+        Return a list of error messages about the required options that are
+        missing from the configuration.
+        """
+        return ["'{}': required option is missing".format(key)
+                for key in sorted(self.required)
+                if key not in conf]
 
     @property
-    def sections(self):
+    def signature(self):
         """
-        Returns an iterable containing the names of sections. This method uses
-        the underlying parser object and does not work with the dict values.
+        A string that identifies the declarations of the schema, which is
+        used to tell whether a snapshot was made with the same schema.
         """
-        return self.parser.sections()
+        return repr(sorted(
+            (key, option.describe(), repr(option.default), option.required)
+            for key, option in self.options.items()))
 
-    def _parse_section(self, section):
+
+class SectionIndex(object):
+    """
+    Compact read-only index of the sections and raw option values of a
+    configuration file, used in place of the ``RawConfigParser`` object by
+    the ``stream`` engine. It provides the part of the parser API that
+    :py:class:`~ConfDict` relies on: :py:meth:`~SectionIndex.sections`,
+    :py:meth:`~SectionIndex.has_section`, :py:meth:`~SectionIndex.items` and
+    :py:meth:`~SectionIndex.get`.
+
+    The index is built from the tuples yielded by :py:func:`~tokenize`. Each
+    section is stored as a pair of tuples holding the option names and the
+    values, instead of a dict per section. As with the parser, options of the
+    ``DEFAULT`` section are visible in all other sections.
+    """
+    __slots__ = ('_sections', '_defaults')
+
+    def __init__(self, tokens=()):
+        self._sections = OrderedDict()
+        self._defaults = ((), ())
+        self._add(tokens)
+
+    def _add(self, tokens):
         """
-        Given a section name, parses the section and returns a list of
-        extension keys (keys prefixed with '+' character) with their values.
+        Add the sections and options from an iterable of tokens.
         """
-        extensions = []
-        for key, value in self.get_section(section):
-            compound_key, extends = parse_key(section, key)
-            if not self.skip_clean:
-                value = parse_value(value)
-            if extends:
-                extensions.append((compound_key, value))
+        section = None
+        keys = values = None
+        for name, key, value in tokens:
+            if key is None:
+                self._store(section, keys, values)
+                section = name
+                keys = []
+                values = []
                 continue
-            self[compound_key] = value
-        return extensions
+            keys.append(key)
+            values.append(value)
+        self._store(section, keys, values)
 
-    def _get_config_paths(self, key):
+    def _store(self, section, keys, values):
         """
-        Return a list of paths in the special config keys.
+        Store the option names and values collected for a section. Sections
+        that appear more than once are merged the way the parser merges them.
         """
-        paths = []
-        parsed_paths = make_list(parse_value(
-            self.get_option('config', key, '')))
-        for p in parsed_paths:
-            path = os.path.normpath(os.path.join(self.base_path, p))
-            paths.extend(glob.glob(path))
-        return paths
+        if section is None:
+            return
+        if section == DEFAULT_SECTION:
+            old = self._defaults
+        else:
+            old = self._sections.get(section) or ((), ())
+        if old[0] or len(set(keys)) < len(keys):
+            merged = OrderedDict(zip(*old))
+            merged.update(zip(keys, values))
+            keys, values = merged.keys(), merged.values()
+        entry = (tuple(keys), tuple(values))
+        if section == DEFAULT_SECTION:
+            self._defaults = entry
+        else:
+            self._sections[section] = entry
 
-    def _preprocess(self):
+    @classmethod
+    def read(cls, source):
         """
-        Prepares for config loading by parsing the special config section and
-        setting up defaults and include lists. The defaults are also loaded
-        immediately to ensure they are successfully overwritten during
-        subsequent parsing.
+        Build the index of a path or a file-like object. A file that cannot
+        be opened results in an empty index, just like it results in an empty
+        parser.
         """
-        if not self.parser.has_section('config'):
-            return
-        self.defaults = self._get_config_paths('defaults')
-        self.include = self._get_config_paths('include')
-        for path in self.defaults:
-            defl = self.__class__.from_file(path, self.skip_clean)
-            self.setdefaults(defl)
+        if hasattr(source, 'read'):
+            return cls(tokenize(source, getattr(source, 'name', '<???>')))
+        try:
+            f = open(source)
+        except (IOError, OSError):
+            return cls()
+        with f:
+            return cls(tokenize(f, source))
 
-    def _process(self):
+    @classmethod
+    def from_sections(cls, sections):
         """
-        Processes all sections one by one. The special section named 'config'
-        is skipped'.
+        Build the index from an iterable of ``(section, items)`` pairs, where
+        ``items`` is a list of ``(key, value)`` pairs.
+        """
+        index = cls()
+        for section, items in sections:
+            index._sections[section] = (tuple(k for k, _ in items),
+                                        tuple(v for _, v in items))
+        return index
 
-        While the sections are parsed, the extensions dictionary is updated.
+    @classmethod
+    def from_parser(cls, parser):
         """
-        self._extensions = []
-        for section in self.sections:
-            exts = self._parse_section(section)
-            self._extensions.extend(exts)
+        Build the index of a ``RawConfigParser`` object, or of another index,
+        with interned section and option names. Options that sections inherit
+        from the ``DEFAULT`` section are only stored once.
+        """
+        index = cls()
+        defaults = parser.defaults()
+        index._defaults = (tuple(_intern(k) for k in defaults),
+                           tuple(defaults.values()))
+        for section in parser.sections():
+            keys = []
+            values = []
+            for key, value in parser.items(section):
+                if key in defaults and defaults[key] == value:
+                    continue
+                keys.append(_intern(key))
+                values.append(value)
+            index._sections[_intern(section)] = (tuple(keys), tuple(values))
+        return index
 
-    def _extend(self, extensions=None):
+    def _lookup(self, section):
+        if section == DEFAULT_SECTION:
+            return self._defaults
+        try:
+            return self._sections[section]
+        except KeyError:
+            raise NoSectionError(section)
+
+    def sections(self):
         """
-        Extends the dictionary data using either the specified iterable
-        containing the extensions, or the extensions stored in the
-        :py:attr:`~ConfDict._extensions` property.
+        Return a list of section names, excluding ``DEFAULT``.
+        """
+        return list(self._sections)
 
-        The extensions are two-tuples containing the key name and a list of
-        values.
+    def defaults(self):
         """
-        if self.noextend:
-            return
-        using_self = extensions is None
-        if using_self:
-            # We're using our own extensions, not the supplied one
-            extensions = self._extensions
-        for k, v in extensions:
-            if self.skip_clean:
-                self.setdefault(k, '')
-                self[k] += v
-            else:
-                extend_key(self, k, v)
+        Return a dict of the options in the ``DEFAULT`` section.
+        """
+        return OrderedDict(zip(*self._defaults))
+
+    def has_section(self, section):
+        """
+        Return ``True`` if the named section is present.
+        """
+        return section in self._sections
+
+    def items(self, section):
+        """
+        Return a list of ``(key, value)`` pairs of the options in a section,
+        including the ``DEFAULT`` options it does not override.
+        """
+        keys, values = self._lookup(section)
+        if not self._defaults[0] or section == DEFAULT_SECTION:
+            return list(zip(keys, values))
+        merged = OrderedDict(zip(*self._defaults))
+        merged.update(zip(keys, values))
+        return list(merged.items())
+
+    def get(self, section, option):
+        """
+        Return the raw value of an option. ``NoSectionError`` or
+        ``NoOptionError`` is raised when the section or the option is missing.
+        """
+        option = option.lower()
+        for keys, values in (self._lookup(section), self._defaults):
+            if option in keys:
+                return values[keys.index(option)]
+        raise NoOptionError(option, section)
+
+
+class MappedSectionIndex(SectionIndex):
+    """
+    :py:class:`~SectionIndex` of a file whose sections are read and parsed
+    one at a time, used by the ``mmap`` engine. Building the index only
+    collects the byte offsets of the section headers that start at the
+    beginning of a line, by scanning a memory map of the file. The options of
+    a section are read and parsed the first time the section is looked up.
+    ``DEFAULT`` sections are parsed right away, since their options are
+    visible in all other sections.
+
+    Sections are read from the file as it was when the index was built. If
+    the file has been modified since, looking up an unparsed section raises
+    :py:class:`~ConfigurationError`.
+    """
+    __slots__ = ('path', 'stamp', '_offsets')
+
+    def __init__(self, path):
+        super(MappedSectionIndex, self).__init__()
+        self.path = path
+        self.stamp = file_stamp(path)
+        self._offsets = {}
+        try:
+            f = open(path, 'rb')
+        except (IOError, OSError):
+            return
+        with f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped
+                return
+            try:
+                self._scan(data)
+            finally:
+                data.close()
+
+    @staticmethod
+    def _decode(data):
+        if str is bytes:
+            return data
+        return data.decode(locale.getpreferredencoding(False))
+
+    def _scan(self, data):
+        """
+        Record the offsets of the sections in the mapped file data, and parse
+        the text before the first section and the ``DEFAULT`` sections.
+        """
+        headers = []
+        # Offset of the next line starting with '[', or None if there is none
+        pos = 0 if data[:1] == b'[' else data.find(b'\n[') + 1 or None
+        while pos is not None:
+            end = data.find(b'\n', pos)
+            if end < 0:
+                end = len(data)
+            match = SECTION_RE.match(self._decode(data[pos:end]).strip())
+            if match:
+                headers.append((pos, match.group('header')))
+            pos = data.find(b'\n[', end) + 1 or None
+        ends = [pos for pos, _ in headers[1:]] + [len(data)]
+        # Anything other than comments before the first section is an error
+        first = headers[0][0] if headers else len(data)
+        self._add(tokenize(self._decode(data[:first]).split('\n'),
+                           self.path))
+        for (start, section), end in zip(headers, ends):
+            if section == DEFAULT_SECTION:
+                self._add(tokenize(
+                    self._decode(data[start:end]).split('\n'), self.path))
+                continue
+            if section in self._offsets and DuplicateSectionError is not None:
+                raise DuplicateSectionError(section, self.path,
+                                            data[:start].count(b'\n') + 1)
+            self._offsets.setdefault(section, []).append((start, end))
+            self._sections[section] = None
+
+    def _lookup(self, section):
+        entry = super(MappedSectionIndex, self)._lookup(section)
+        if entry is None:
+            self._load(section)
+            entry = self._sections[section]
+        return entry
+
+    def _load(self, section):
+        """
+        Read and parse the options of a section.
+        """
+        chunks = []
+        with open(self.path, 'rb') as f:
+            for start, end in self._offsets[section]:
+                f.seek(start)
+                chunks.append(f.read(end - start))
+        if file_stamp(self.path) != self.stamp:
+            raise ConfigurationError("Configuration file at '{}' has changed "
+                                     "since it was loaded".format(self.path))
+        tokens = list(tokenize(self._decode(b'\n'.join(chunks)).split('\n'),
+                               self.path))
+        for name, _, _ in tokens:
+            if name != section:
+                raise ConfigurationError(
+                    "Section [{}] in '{}' must start at the beginning of a "
+                    "line".format(name, self.path))
+        self._add(tokens)
+        del self._offsets[section]
+
+
+class KeyIndex(object):
+    """
+    Index of the compound keys of a :py:class:`~ConfDict` by prefix and by
+    option name. Each key is listed under all of its dotted prefixes, so
+    ``'a.b.c'`` is listed under ``'a'`` and ``'a.b'``, and keys without a dot
+    are listed under the empty prefix. Each key is also listed under its last
+    component, ``'c'``.
+    """
+    __slots__ = ('prefixes', 'names')
+
+    def __init__(self, keys=()):
+        # Dicts with ``None`` values serve as sets that keep the order
+        self.prefixes = {}
+        self.names = {}
+        for key in keys:
+            self.add(key)
+
+    def add(self, key):
+        try:
+            parts = key.split('.')
+        except AttributeError:
+            return
+        self.names.setdefault(parts[-1], {})[key] = None
+        if len(parts) == 1:
+            self.prefixes.setdefault('', {})[key] = None
+            return
+        prefix = parts[0]
+        for part in parts[1:]:
+            self.prefixes.setdefault(prefix, {})[key] = None
+            prefix += '.' + part
+
+    def discard(self, key):
+        try:
+            parts = key.split('.')
+        except AttributeError:
+            return
+        self._discard(self.names, parts[-1], key)
+        if len(parts) == 1:
+            self._discard(self.prefixes, '', key)
+            return
+        prefix = parts[0]
+        for part in parts[1:]:
+            self._discard(self.prefixes, prefix, key)
+            prefix += '.' + part
+
+    @staticmethod
+    def _discard(index, name, key):
+        keys = index.get(name)
+        if keys is not None:
+            keys.pop(key, None)
+            if not keys:
+                del index[name]
+
+    def prefixed(self, prefix):
+        """
+        Return the keys listed under the prefix.
+        """
+        return self.prefixes.get(prefix, {})
+
+    def candidates(self, pattern):
+        """
+        Return the keys that may match a glob pattern. The keys are narrowed
+        down using the dotted prefix and the option name that the pattern
+        spells out literally. If it spells out neither, all keys are returned.
+        """
+        found = None
+        literal = re.split(r'[*?[]', pattern, 1)[0]
+        if '.' in literal:
+            found = self.prefixed(literal.rsplit('.', 1)[0])
+        name = pattern.rsplit('.', 1)[-1]
+        if not re.search(r'[*?[]', name):
+            keys = self.names.get(name, {})
+            if found is None or len(keys) < len(found):
+                found = keys
+        if found is None:
+            return [key for keys in self.names.values() for key in keys]
+        return found
+
+
+class SectionView(Mapping):
+    """
+    Live read-only mapping of the options of a section (or any dotted prefix
+    of the keys) of a :py:class:`~ConfDict`, as returned by
+    :py:meth:`ConfDict.section`. The keys are the parts of the compound keys
+    that follow the section name, and the values are those of the
+    configuration, including the values from defaults, includes and
+    extensions. Changes to the configuration are visible immediately.
+    """
+
+    def __init__(self, conf, name):
+        self.conf = conf
+        self.name = name
+        prefix = get_compound_key(name, '')
+        self._prefix = prefix[:-1]
+        self._start = len(prefix)
+
+    def _keys(self):
+        return self.conf._indexed(self._prefix)
+
+    def __getitem__(self, key):
+        compound_key = get_compound_key(self.name, key)
+        if compound_key not in self._keys():
+            raise KeyError(key)
+        return self.conf[compound_key]
+
+    def __contains__(self, key):
+        return get_compound_key(self.name, key) in self._keys()
+
+    def __iter__(self):
+        start = self._start
+        return iter([key[start:] for key in self._keys()])
+
+    def __len__(self):
+        return len(self._keys())
+
+    def __repr__(self):
+        return '<{} [{}] {}>'.format(self.__class__.__name__, self.name,
+                                     dict(self.items()))
+
+
+def _encode_key(key):
+    if isinstance(key, bytes):
+        return key
+    return key.encode('utf-8')
+
+
+def _decode_key(data):
+    if str is bytes:
+        return data
+    return data.decode('utf-8')
+
+
+class SharedConf(Mapping):
+    """
+    Read-only mapping over a configuration encoded by
+    :py:meth:`SharedConf.encode`, such as the file written by
+    :py:meth:`ConfDict.publish`. The encoding is a hash table of the keys
+    followed by the keys and the marshalled values, so the mapping can be
+    used without decoding it as a whole. Each lookup decodes only the value
+    it returns.
+
+    The ``buf`` argument is any buffer holding the encoded configuration,
+    such as ``bytes``, a memory map, or the ``buf`` of a
+    ``multiprocessing.shared_memory.SharedMemory`` block. Use
+    :py:meth:`SharedConf.open` to map a published file, which lets all
+    processes share the same pages of memory.
+
+    As with :py:class:`~ConfDict`, subscript lookups of missing keys raise
+    :py:class:`~ConfigurationFormatError`.
+    """
+
+    def __init__(self, buf, path=None):
+        self.path = path
+        self._ident = None
+        self._load(buf)
+
+    @classmethod
+    def encode(cls, mapping, generation=1):
+        """
+        Encode the keys and values of a mapping, and return the resulting
+        bytes. The values must be of built-in types that can be marshalled.
+        """
+        pairs = []
+        for key, value in mapping.items():
+            if type(value) is CompactList:
+                value = value.tolist()
+            try:
+                pairs.append((_encode_key(key), marshal.dumps(value, 2)))
+            except ValueError:
+                raise ValueError("Value of '{}' cannot be encoded".format(key))
+        slots = 8
+        while slots < len(pairs) * 2:
+            slots *= 2
+        table = [0] * slots
+        entries = []
+        chunks = []
+        offset = (SHARED_HEADER.size + SHARED_SLOT.size * slots +
+                  SHARED_ENTRY.size * len(pairs))
+        for index, (key, value) in enumerate(pairs):
+            digest = zlib.crc32(key) & 0xffffffff
+            slot = digest & (slots - 1)
+            while table[slot]:
+                slot = (slot + 1) & (slots - 1)
+            table[slot] = index + 1
+            entries.append(SHARED_ENTRY.pack(digest, offset, len(key),
+                                             offset + len(key), len(value)))
+            chunks.append(key)
+            chunks.append(value)
+            offset += len(key) + len(value)
+        header = SHARED_HEADER.pack(SHARED_MAGIC, generation, len(pairs),
+                                    slots)
+        table = struct.pack('<{}I'.format(slots), *table)
+        return b''.join([header, table] + entries + chunks)
+
+    @classmethod
+    def open(cls, path):
+        """
+        Map the file at ``path`` written by :py:meth:`ConfDict.publish`, and
+        return the mapping.
+        """
+        buf, ident = cls._map(path)
+        shared = cls(buf, path)
+        shared._ident = ident
+        return shared
+
+    @staticmethod
+    def _map(path):
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return buf, (st.st_dev, st.st_ino, st.st_size)
+
+    def _load(self, buf):
+        magic, generation, count, slots = SHARED_HEADER.unpack_from(buf, 0)
+        if magic != SHARED_MAGIC:
+            raise ValueError('Not an encoded configuration')
+        # Swapped as a whole, so refreshing is safe while other threads read
+        self._state = (buf, generation, count, slots)
+
+    def refresh(self):
+        """
+        Map the file again if a new generation has been published since it
+        was mapped, and return ``True`` if it was. This method only works
+        with the mappings returned by :py:meth:`SharedConf.open`.
+        """
+        st = os.stat(self.path)
+        if (st.st_dev, st.st_ino, st.st_size) == self._ident:
+            return False
+        buf, ident = self._map(self.path)
+        self._load(buf)
+        self._ident = ident
+        return True
+
+    @property
+    def generation(self):
+        """
+        Generation number of the encoded configuration.
+        """
+        return self._state[1]
+
+    def _find(self, key):
+        """
+        Return the entry of the key, or ``None`` if there is no such key.
+        """
+        buf, _, _, slots = self._state
+        try:
+            data = _encode_key(key)
+        except AttributeError:
+            return None
+        digest = zlib.crc32(data) & 0xffffffff
+        mask = slots - 1
+        slot = digest & mask
+        entries = SHARED_HEADER.size + SHARED_SLOT.size * slots
+        while True:
+            index = SHARED_SLOT.unpack_from(
+                buf, SHARED_HEADER.size + SHARED_SLOT.size * slot)[0]
+            if not index:
+                return None
+            entry = SHARED_ENTRY.unpack_from(
+                buf, entries + SHARED_ENTRY.size * (index - 1))
+            start = entry[1]
+            if entry[0] == digest and buf[start:start + entry[2]] == data:
+                return buf, entry
+            slot = (slot + 1) & mask
+
+    def __getitem__(self, key):
+        found = self._find(key)
+        if found is None:
+            raise ConfigurationFormatError(KeyError(key))
+        buf, entry = found
+        return marshal.loads(buf[entry[3]:entry[3] + entry[4]])
+
+    def get(self, key, default=None):
+        found = self._find(key)
+        if found is None:
+            return default
+        buf, entry = found
+        return marshal.loads(buf[entry[3]:entry[3] + entry[4]])
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __iter__(self):
+        buf, _, count, slots = self._state
+        entries = SHARED_HEADER.size + SHARED_SLOT.size * slots
+        for index in range(count):
+            entry = SHARED_ENTRY.unpack_from(
+                buf, entries + SHARED_ENTRY.size * index)
+            yield _decode_key(bytes(buf[entry[1]:entry[1] + entry[2]]))
+
+    def __len__(self):
+        return self._state[2]
+
+    def __repr__(self):
+        return '<{} generation {}, {} keys>'.format(
+            self.__class__.__name__, self.generation, len(self))
+
+
+class FrozenConf(dict):
+    """
+    Read-only copy of a configuration, as returned by
+    :py:meth:`ConfDict.freeze`. Lookups are performed by the built-in dict
+    code, so they are as fast as with a plain dict. Missing keys still raise
+    :py:class:`~ConfigurationFormatError`, from the ``__missing__`` hook that
+    is only called when a lookup fails.
+
+    All methods that modify the dict raise ``TypeError``, and list values are
+    stored as tuples so that they cannot be modified either.
+    """
+
+    def __missing__(self, key):
+        raise ConfigurationFormatError(KeyError(key))
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("'{}' object is read-only".format(
+            self.__class__.__name__))
+
+    __setitem__ = __delitem__ = _readonly
+    update = setdefault = pop = popitem = clear = _readonly
+    __ior__ = _readonly
+
+    def copy(self):
+        return self.__class__(self)
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__,
+                               super(FrozenConf, self).__repr__())
+
+
+def freeze_value(value):
+    """
+    Return an immutable equivalent of a value, converting lists (including
+    nested ones) and compact lists to tuples.
+    """
+    if type(value) is CompactList:
+        return tuple(value)
+    if isinstance(value, list):
+        return tuple(freeze_value(v) for v in value)
+    return value
+
+
+class LayeredConf(MutableMapping):
+    """
+    Configuration that keeps the files it is made of as separate layers, in
+    the style of ``collections.ChainMap``, instead of copying all values into
+    a single dict. It is normally created with
+    :py:meth:`~LayeredConf.from_file`.
+
+    The ``maps`` attribute lists the layers in the order in which they are
+    searched: the ``overrides`` dict, which holds the values set at runtime,
+    followed by the ``layers``. Lookups return the value from the first layer
+    that has the key, and missing keys raise
+    :py:class:`~ConfigurationFormatError`. Setting and deleting keys only
+    affects the ``overrides``, so the lower layers are never modified and can
+    be shared between several objects.
+
+    The ``conf`` attribute is the :py:class:`~ConfDict` of the file itself
+    (or the object the configuration was derived from).
+    :py:meth:`~LayeredConf.section` and :py:meth:`~LayeredConf.match` look
+    up the keys of all layers, while :py:meth:`~LayeredConf.get_section`,
+    :py:meth:`~LayeredConf.get_option` and :py:attr:`~LayeredConf.sections`
+    return the raw options of ``conf``.
+    """
+
+    def __init__(self, layers=(), overrides=None):
+        self.overrides = {} if overrides is None else overrides
+        self.layers = list(layers)
+        self.conf = None
+
+    @property
+    def maps(self):
+        return [self.overrides] + self.layers
+
+    def __getitem__(self, key):
+        for layer in self.maps:
+            if key in layer:
+                return layer[key]
+        raise ConfigurationFormatError(KeyError(key))
+
+    def get(self, key, default=None):
+        for layer in self.maps:
+            if key in layer:
+                return layer[key]
+        return default
+
+    def __contains__(self, key):
+        return any(key in layer for layer in self.maps)
+
+    def __setitem__(self, key, value):
+        self.overrides[key] = value
+
+    def __delitem__(self, key):
+        try:
+            del self.overrides[key]
+        except KeyError:
+            raise KeyError('Only runtime overrides can be deleted: '
+                           '{!r}'.format(key))
+
+    def __iter__(self):
+        keys = OrderedDict()
+        for layer in reversed(self.maps):
+            keys.update(dict.fromkeys(layer))
+        return iter(keys)
+
+    def __len__(self):
+        return len(set().union(*self.maps))
+
+    def __repr__(self):
+        return '<{} {} layers, {} keys>'.format(
+            self.__class__.__name__, len(self.layers), len(self))
+
+    def _indexed(self, prefix):
+        """
+        Return the keys of all layers that start with the dotted prefix,
+        using the key index of the layers that have one.
+        """
+        keys = OrderedDict()
+        for layer in reversed(self.maps):
+            if isinstance(layer, (ConfDict, LayeredConf)):
+                found = layer._indexed(prefix)
+            else:
+                found = KeyIndex(layer).prefixed(prefix)
+            keys.update(dict.fromkeys(found))
+        return keys
+
+    def section(self, name):
+        """
+        Return a :py:class:`~SectionView` of the options in the named section,
+        with the values found through the layers (see
+        :py:meth:`ConfDict.section`).
+        """
+        return SectionView(self, name)
+
+    def match(self, pattern):
+        """
+        Return a dict of the keys that match a glob pattern, and their values
+        found through the layers (see :py:meth:`ConfDict.match`).
+        """
+        keys = OrderedDict()
+        for layer in self.maps:
+            if isinstance(layer, LayeredConf):
+                found = layer.match(pattern)
+            elif isinstance(layer, ConfDict):
+                if layer._pending:
+                    layer._load_deferred()
+                found = layer._key_index().candidates(pattern)
+            else:
+                found = layer
+            keys.update(dict.fromkeys(found))
+        return dict((key, self[key]) for key in keys
+                    if fnmatch.fnmatchcase(key, pattern))
+
+    def get_section(self, name):
+        """
+        Return the raw options of the named section of ``conf`` (see
+        :py:meth:`ConfDict.get_section`).
+        """
+        return self.conf.get_section(name)
+
+    def get_option(self, section, name, default=None):
+        """
+        Return a raw option of ``conf``, or ``default`` if it is not found
+        (see :py:meth:`ConfDict.get_option`).
+        """
+        return self.conf.get_option(section, name, default)
+
+    @property
+    def sections(self):
+        """
+        The names of the sections of ``conf``.
+        """
+        return self.conf.sections
+
+    def is_stale(self):
+        """
+        Return ``True`` if any of the files the configuration was loaded from
+        has changed since (see :py:meth:`ConfDict.is_stale`).
+        """
+        return self.conf is not None and self.conf.is_stale()
+
+    def derive(self, overrides=None, **kwargs):
+        """
+        Return a :py:class:`~LayeredConf` whose layers are those of this one,
+        with the values from the ``overrides`` dict and keyword arguments in
+        its own ``overrides`` (see :py:meth:`ConfDict.derive`).
+        """
+        return self._derive(self.maps, self.conf, overrides, kwargs)
+
+    @classmethod
+    def _derive(cls, layers, conf, overrides, kwargs):
+        """
+        Return a new object on top of the ``layers``, whose overrides are set
+        from the ``overrides`` dict and ``kwargs``. Keys starting with ``+``
+        extend the value of the key as found in the layers. Only the values
+        of the extended keys are copied.
+        """
+        self = cls(layers)
+        self.conf = conf
+        extensions = []
+        items = list((overrides or {}).items()) + list(kwargs.items())
+        for key, value in items:
+            if key.startswith('+'):
+                extensions.append((key[1:], value))
+            else:
+                self.overrides[key] = value
+        for key, value in extensions:
+            merged = make_list(self[key]) if key in self else []
+            self.overrides[key] = extend_list(merged, make_list(value))
+        return self
+
+    def freeze(self):
+        """
+        Flatten the layers into a :py:class:`~FrozenConf`, for fast lookups
+        on hot code paths.
+        """
+        return FrozenConf((key, freeze_value(self[key])) for key in self)
+
+    @classmethod
+    def from_file(cls, path, skip_clean=False, noextend=False, defaults={},
+                  lazy=False, cache=False, workers=None, engine='parser',
+                  schema=None, shared=None, compact=False, lowmem=False):
+        """
+        Load the configuration from the specified file, with the same options
+        and the same resulting values as :py:meth:`ConfDict.from_file`.
+
+        The options of the file itself (including the values of the keys it
+        extends) are stored in a :py:class:`~ConfDict` layer, and each of its
+        defaults and include files is loaded into a layer of its own. The
+        include files come first, in reverse order, followed by the file
+        itself, the ``defaults`` dict, the defaults files in order, and the
+        defaults of the schema. The values of the keys extended by the include
+        files are stored in a layer above all of these.
+
+        The ``shared`` argument is a dict in which the layers of the
+        referenced files are kept, so that configurations loaded with the
+        same dict use the same layer objects for the files they have in
+        common, rather than each holding a copy of their values. Layers are
+        loaded again if their files change.
+
+        With the ``'mmap'`` engine, all sections of the file itself are
+        loaded right away, since the keys they extend are merged across the
+        layers.
+        """
+        # The extensions of the file are merged below across all layers. The
+        # sections are all loaded, also with the mmap engine, because a
+        # section loaded later could only be extended within its own layer.
+        own = ConfDict()
+        own.configure(path, skip_clean, True, lazy=lazy, cache=cache,
+                      workers=workers, engine=engine, schema=schema,
+                      compact=compact, lowmem=lowmem)
+        own._init_parser()
+        own._check_conf()
+        if own.parser.has_section('config'):
+            own.defaults = own._get_config_paths('defaults')
+            own.include = own._get_config_paths('include')
+        initial = dict(defaults)
+        # The defaults dict is applied before the defaults files are loaded,
+        # so it takes precedence over them
+        bottom = [initial] + [cls._layer(own, p, False, shared)
+                              for p in own.defaults]
+        own._process()
+        includes = [cls._layer(own, p, True, shared) for p in own.include]
+        if lowmem:
+            own._release_parser()
+        layers = list(reversed(includes)) + [own] + bottom
+        extended = {}
+        self = cls([extended] + layers)
+        self.conf = own
+        if not noextend:
+            # Same grouping as in ConfDict._postprocess()
+            groups = OrderedDict()
+            for key, value in own._extensions:
+                groups.setdefault(key, []).append(value)
+            own._extensions = []
+            for include in includes:
+                for key in [key for key in groups if key in include]:
+                    del groups[key]
+                for key, value in include._extensions:
+                    groups.setdefault(key, []).append(value)
+            for key, values in groups.items():
+                if skip_clean:
+                    extended[key] = self.get(key, '') + ''.join(values)
+                    continue
+                merged = make_list(self[key]) if key in self else []
+                for value in values:
+                    merged = extend_list(merged, value)
+                extended[key] = merged
+        if schema is not None:
+            # The schema defaults only fill the options missing from all
+            # other layers, so they are not extended either
+            self.layers.append(dict(schema.defaults))
+            errors = own._errors + schema.check(self)
+            if errors:
+                raise SchemaError(errors)
+        return self
+
+    @staticmethod
+    def _layer(own, path, noextend, shared):
+        """
+        Return the layer of a file referenced by the ``own`` layer, taking it
+        from the ``shared`` dict if it is there and up to date.
+        """
+        if shared is None:
+            return own._load_child(path, noextend=noextend)
+        key = (os.path.realpath(path), noextend, own.skip_clean, own.lazy,
+               own.compact, own.lowmem, own.engine, own.schema)
+        layer = shared.get(key)
+        if layer is None or layer.is_stale():
+            layer = shared[key] = own._read_child(path, noextend)
+        own._track(layer)
+        return layer
+
+
+class ParseCache(object):
+    """
+    Bounded cache of loaded configuration files, shared by all loads in the
+    process that use the ``cache`` flag of :py:meth:`ConfDict.from_file`.
+    Defaults and include files referenced by several configuration files are
+    then read and parsed only once.
+
+    Entries are keyed by the real path of the file and the loading options,
+    and are evicted in least recently used order once there are more than
+    ``maxsize`` of them. An entry is only used while none of the files it was
+    loaded from has changed (see :py:meth:`ConfDict.is_stale`). The cache
+    stores and hands out copies, so modifying a loaded configuration never
+    affects the cache.
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return a copy of the configuration cached under the ``key``, or
+        ``None`` if there is no up-to-date entry.
+        """
+        with self._lock:
+            conf = self._entries.pop(key, None)
+            if conf is not None:
+                # Re-inserting moves the entry to the most recently used end
+                self._entries[key] = conf
+        if conf is not None and conf.is_stale():
+            with self._lock:
+                if self._entries.get(key) is conf:
+                    del self._entries[key]
+            conf = None
+        with self._lock:
+            if conf is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return conf._clone()
+
+    def put(self, key, conf):
+        """
+        Store a copy of the configuration under the ``key``, evicting the least
+        recently used entries if necessary.
+        """
+        conf = conf._clone()
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = conf
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def keys(self):
+        """
+        Return a list of cached keys, from least to most recently used.
+        """
+        with self._lock:
+            return list(self._entries)
+
+    def info(self):
+        """
+        Return a :py:class:`~CacheInfo` named tuple with hit and miss counts,
+        the maximum size, and the current number of entries.
+        """
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize,
+                             len(self._entries))
+
+    def clear(self):
+        """
+        Remove all entries and reset the hit and miss counts.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+parse_cache = ParseCache()
+
+
+class DirectoryCache(object):
+    """
+    Cache of the listings of include directories, used for the ``[config]``
+    paths that name a directory. A listing is the sorted list of paths of the
+    regular files in the directory whose names end with one of
+    :py:data:`~INCLUDE_SUFFIXES`, hidden files excluded.
+
+    Adding, removing, or renaming a file changes the modification time of
+    its directory, so a listing is reused as long as the directory's
+    :py:func:`~file_stamp` does not change, and the directory is only
+    scanned again once it does.
+    """
+
+    def __init__(self):
+        self.scans = 0
+        self._listings = {}
+
+    def list(self, path):
+        """
+        Return the listing of the directory at specified path, or an empty
+        list if the directory cannot be read.
+        """
+        stamp = file_stamp(path)
+        cached = self._listings.get(path)
+        if cached is not None and cached[0] == stamp:
+            return list(cached[1])
+        if stamp is None:
+            self._listings.pop(path, None)
+            return []
+        try:
+            paths = self._scan(path)
+        except OSError:
+            return []
+        self.scans += 1
+        self._listings[path] = stamp, paths
+        return list(paths)
+
+    @staticmethod
+    def _scan(path):
+        if _scandir is None:
+            names = (name for name in os.listdir(path)
+                     if os.path.isfile(os.path.join(path, name)))
+        else:
+            names = (entry.name for entry in _scandir(path)
+                     if entry.is_file())
+        return tuple(os.path.join(path, name) for name in sorted(names)
+                     if not name.startswith('.') and
+                     name.endswith(INCLUDE_SUFFIXES))
+
+    def clear(self):
+        """
+        Remove all listings.
+        """
+        self._listings.clear()
+        self.scans = 0
+
+
+directory_cache = DirectoryCache()
+
+
+def expand_path(path):
+    """
+    Return the list of files matched by a ``[config]`` path. Paths ending with
+    a path separator name a directory whose files are listed by the
+    :py:data:`~directory_cache`, and other paths are glob patterns.
+    """
+    if path.endswith(('/', os.sep)):
+        return directory_cache.list(path)
+    return glob.glob(path)
+
+
+class ConfDict(dict):
+    """
+    Dictionary subclass that is used to hold the parsed configuration options.
+
+    :py:class:`~ConfDict` is instantiated the same way as dicts. For this
+    reason, the paths to configuation files and similar are not passed to the
+    constructor. Instead, you should use the :py:meth:`~ConfDict.from_file`
+    classmethod.
+
+    Because this class is a dictionary, you can use the standard ``dict`` API
+    to access and modify the keys. There is a minor difference when accessing
+    key values, though. When using the subscript notation,
+    :py:class:`~ConfigurationFormatError` is raised instead of ``KeyError``
+    when the key is missing.
+
+    When loaded in lazy mode, values are stored as :py:class:`~RawValue`
+    strings and coerced the first time they are accessed using the subscript
+    notation, :py:meth:`~ConfDict.get`, or while iterating over items or
+    values. Copies made at C level, such as ``dict(conf)``, bypass the
+    coercion, so :py:meth:`~ConfDict.resolve` should be called first.
+
+    Once loaded, the ``sources`` attribute maps the real path of every file
+    that contributed to the configuration (the file itself, and all defaults
+    and includes, recursively) to its :py:func:`~file_stamp` taken at load
+    time. The ``patterns`` attribute lists the ``(pattern, matches)`` pairs
+    of the expanded ``[config]`` paths.
+    """
+
+    ConfigurationError = ConfigurationError
+    ConfigurationFormatError = ConfigurationFormatError
+
+    # Names of the sections whose loading was deferred by MappedConfDict
+    _pending = frozenset()
+    # Whether the loaded referenced files are kept for incremental reloads
+    _keep_children = False
+    # Index of the keys used by sections and matching, built on first use
+    _index = None
+    # Stats of the last load, and of its referenced files while loading
+    load_stats = None
+    _child_stats = None
+    # Files loaded so far by the current load, shared with referenced files
+    _graph = None
+    # Real paths of the files through which this file was referenced
+    _chain = ()
+
+    def __init__(self, *args, **kwargs):
+        self.path = None
+        self.parser = None
+        self.base_path = '.'
+        self.defaults = []
+        self.include = []
+        self._extensions = []
+        self.skip_clean = False
+        self.noextend = False
+        self.lazy = False
+        self.compact = False
+        self.lowmem = False
+        self.cache = False
+        self.workers = None
+        self.engine = 'parser'
+        self.schema = None
+        self.stats = False
+        self.sources = OrderedDict()
+        self.patterns = []
+        self._initial = {}
+        self._children = {}
+        self._previous = None
+        self._errors = []
+        super(ConfDict, self).__init__(*args, **kwargs)
+
+    def __getitem__(self, key):
+        try:
+            value = super(ConfDict, self).__getitem__(key)
+        except KeyError as err:
+            raise ConfigurationFormatError(err)
+        if type(value) is RawValue:
+            return self._coerce(key, value)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            value = super(ConfDict, self).__getitem__(key)
+        except KeyError:
+            return default
+        if type(value) is RawValue:
+            return self._coerce(key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        if self._index is not None:
+            self._index.add(key)
+        super(ConfDict, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        super(ConfDict, self).__delitem__(key)
+        if self._index is not None:
+            self._index.discard(key)
+
+    def update(self, *args, **kwargs):
+        if self._index is not None:
+            other = dict(*args, **kwargs)
+            for key in other:
+                self._index.add(key)
+            args, kwargs = (other,), {}
+        super(ConfDict, self).update(*args, **kwargs)
+
+    def __ior__(self, other):
+        # dict.__ior__ (Python 3.9+) would bypass update()
+        self.update(other)
+        return self
+
+    def setdefault(self, key, default=None):
+        if self._index is not None:
+            self._index.add(key)
+        value = super(ConfDict, self).setdefault(key, default)
+        if type(value) is RawValue:
+            return self._coerce(key, value)
+        return value
+
+    def pop(self, key, *args):
+        if self._index is not None:
+            self._index.discard(key)
+        value = super(ConfDict, self).pop(key, *args)
+        if type(value) is RawValue:
+            return value.parse(self.compact)
+        return value
+
+    def popitem(self):
+        key, value = super(ConfDict, self).popitem()
+        if self._index is not None:
+            self._index.discard(key)
+        if type(value) is RawValue:
+            return key, value.parse(self.compact)
+        return key, value
+
+    def clear(self):
+        super(ConfDict, self).clear()
+        if self._index is not None:
+            self._index = KeyIndex()
+
+    def items(self):
+        if self.lazy:
+            self.resolve()
+        return super(ConfDict, self).items()
+
+    def values(self):
+        if self.lazy:
+            self.resolve()
+        return super(ConfDict, self).values()
+
+    def copy(self):
+        if self.lazy:
+            self.resolve()
+        return super(ConfDict, self).copy()
+
+    def _coerce(self, key, value):
+        """
+        Coerce a raw value whose coercion was deferred, and store the result
+        in place of the raw value.
+        """
+        value = value.parse(self.compact)
+        super(ConfDict, self).__setitem__(key, value)
+        return value
+
+    def resolve(self):
+        """
+        Coerce all values whose coercion was deferred by lazy loading. After
+        this method returns, the dict holds the same values as it would have
+        if it were loaded without the ``lazy`` flag.
+        """
+        for key, value in list(super(ConfDict, self).items()):
+            if type(value) is RawValue:
+                self._coerce(key, value)
+
+    def _key_index(self):
+        """
+        Return the :py:class:`~KeyIndex` of the keys, building it if needed.
+        Once built, the index is kept up to date as keys are added and
+        removed.
+        """
+        if self._index is None:
+            self._index = KeyIndex(super(ConfDict, self).keys())
+        return self._index
+
+    def _indexed(self, prefix):
+        """
+        Return the keys that start with the dotted prefix.
+        """
+        return self._key_index().prefixed(prefix)
+
+    def section(self, name):
+        """
+        Return a :py:class:`~SectionView` of the options in the named section.
+        Unlike :py:meth:`~ConfDict.get_section`, the view holds the same values
+        as the dict, so they include defaults, includes and extensions, and
+        are coerced. Options of nested sections are included, so the view of
+        ``'foo'`` has a ``'bar.baz'`` key for the ``foo.bar.baz`` option. The
+        view of the global section holds the keys without a dot.
+
+        The views use an index of the keys by section, which is built on first
+        use and updated as keys are added and removed, so reading a section
+        does not scan all keys.
+        """
+        return SectionView(self, name)
+
+    def match(self, pattern):
+        """
+        Return a dict of the keys that match a glob pattern, such as
+        ``'*.timeout'`` or ``'db.*'``, and their values. Patterns that spell
+        out a section or an option name are matched only against the keys
+        with that section or option name, using the same index as
+        :py:meth:`~ConfDict.section`.
+        """
+        keys = list(self._key_index().candidates(pattern))
+        return dict((key, self[key]) for key in keys
+                    if fnmatch.fnmatchcase(key, pattern))
+
+    def get_section(self, name):
+        """
+        Returns an iterable containing options for a given section. This method
+        does *not* return the dict values, but instead uses the underlying
+        parser object to retrieve the values from the parsed configuration
+        file.
+        """
+        return self.parser.items(name)
+
+    def get_option(self, section, name, default=None):
+        """
+        Returns a single configuration option that matches the given section
+        and option names. Optional default value can be specified using the
+        ``default`` parameter, and this value is returned when the option is
+        not found.
+
+        As with :py:meth:`~ConfDict.get_section` method, this method operates
+        on the parsed configuration file rather than dictionary data.
+        """
+        try:
+            return self.parser.get(section, name)
+        except NoOptionError:
+            return default
+
+    @property
+    def sections(self):
+        """
+        Returns an iterable containing the names of sections. This method uses
+        the underlying parser object and does not work with the dict values.
+        """
+        return self.parser.sections()
+
+    def _parse_section(self, section):
+        """
+        Given a section name, parses the section and returns a list of
+        extension keys (keys prefixed with '+' character) with their values.
+        """
+        extensions = []
+        schema = self.schema
+        if schema is None or self.skip_clean:
+            converters = lists = ()
+        else:
+            converters = schema.converters
+            lists = schema.lists
+        for key, value in self.get_section(section):
+            compound_key, extends = parse_key(section, key)
+            if compound_key in converters and (not extends or
+                                               compound_key in lists):
+                value = schema.convert(compound_key, value, self._errors)
+            elif not self.skip_clean:
+                # Extension values are consumed during loading, so there is
+                # no point in deferring their coercion.
+                if self.lazy and not extends:
+                    value = RawValue(value)
+                elif self.compact:
+                    value = parse_compact(value)
+                else:
+                    value = parse_value(value)
+            if extends:
+                extensions.append((compound_key, value))
+                continue
+            self[compound_key] = value
+        return extensions
+
+    def _get_config_paths(self, key):
+        """
+        Return a list of paths in the special config keys.
+        """
+        paths = []
+        parsed_paths = make_list(parse_value(
+            self.get_option('config', key, '')))
+        start = _clock()
+        for p in parsed_paths:
+            path = os.path.normpath(os.path.join(self.base_path, p))
+            if p.endswith(('/', os.sep)):
+                path = os.path.join(path, '')
+            matches = expand_path(path)
+            self.patterns.append((path, matches))
+            paths.extend(matches)
+        if self.load_stats is not None:
+            self.load_stats.phases['glob'] += _clock() - start
+        return paths
+
+    def _preprocess(self):
+        """
+        Prepares for config loading by parsing the special config section and
+        setting up defaults and include lists. The defaults are also loaded
+        immediately to ensure they are successfully overwritten during
+        subsequent parsing.
+        """
+        if not self.parser.has_section('config'):
+            return
+        self.defaults = self._get_config_paths('defaults')
+        self.include = self._get_config_paths('include')
+        for defl in self._load_children(self.defaults):
+            self.setdefaults(defl)
+
+    def _process(self):
+        """
+        Processes all sections one by one. The special section named 'config'
+        is skipped'.
+
+        While the sections are parsed, the extensions dictionary is updated.
+        """
+        self._extensions = []
+        for section in self.sections:
+            exts = self._parse_section(section)
+            self._extensions.extend(exts)
+
+    def _extend(self, extensions=None):
+        """
+        Extends the dictionary data using either the specified iterable
+        containing the extensions, or the extensions stored in the
+        :py:attr:`~ConfDict._extensions` property.
+
+        The extensions are two-tuples containing the key name and a list of
+        values.
+        """
+        if self.noextend:
+            return
+        using_self = extensions is None
+        if using_self:
+            # We're using our own extensions, not the supplied one
+            extensions = self._extensions
+        groups = OrderedDict()
+        for k, v in extensions:
+            groups.setdefault(k, []).append(v)
+        self._apply_extensions(groups)
         # We only clear extensions if we are extending using the internal
         # extensions list.
         if using_self:
             self._extensions = []
 
+    def _apply_extensions(self, groups):
+        """
+        Extend the keys in the ``groups`` dict, which maps each key to the
+        list of values it is extended with, in order.
+
+        All values of a key are concatenated in a single step, so the time
+        taken is linear in the total length of the values, rather than
+        quadratic in the number of values as with :py:func:`~extend_key`.
+        The result is the same as extending the key with each value in turn.
+        """
+        for key, values in groups.items():
+            if self.skip_clean:
+                current = self[key] if key in self else ''
+                self[key] = current + ''.join(values)
+                continue
+            merged = make_list(self[key]) if key in self else []
+            for value in values:
+                merged = extend_list(merged, value)
+            self[key] = merged
+
     def _postprocess(self):
         """
         Finishes loading proces by processing all extensions and includes.
+
+        The extensions of all include files are collected and applied at the
+        end, except those that would have been overwritten by the value of a
+        later include file.
         """
         self._extend()
-        for path in self.include:
-            include = self.__class__.from_file(path, self.skip_clean,
-                                               noextend=True)
+        groups = OrderedDict()
+        for include in self._load_children(self.include, noextend=True):
+            if len(groups) < len(include):
+                replaced = [key for key in groups if key in include]
+            else:
+                replaced = [key for key in include if key in groups]
+            for key in replaced:
+                del groups[key]
             self.update(include)
-            self._extend(include._extensions)
+            for key, value in include._extensions:
+                groups.setdefault(key, []).append(value)
+        if not self.noextend:
+            self._apply_extensions(groups)
+
+    def _load_children(self, paths, noextend=False):
+        """
+        Load the configuration files at specified paths using
+        :py:meth:`~ConfDict._load_child`, and return an iterable of loaded
+        objects in the order of the paths. Files are loaded one at a time as
+        the iterable is consumed, so each of them can be merged and released
+        before the next one is loaded.
+
+        If the :py:attr:`~ConfDict.workers` attribute is set, the files are
+        read and parsed concurrently in a pool of at most that many threads.
+        The results are still tracked and returned in the original order, so
+        the outcome of merging them does not change. The files referenced by
+        the files loaded in the pool are loaded serially, so nested files do
+        not start pools of their own.
+        """
+        futures = None
+        if self.workers and len(paths) > 1:
+            futures = _futures()
+        if futures is None:
+            return (self._load_child(path, noextend=noextend)
+                    for path in paths)
+        read = functools.partial(self._read_child, noextend=noextend,
+                                 pooled=True)
+        workers = min(self.workers, len(paths))
+        with futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            children = list(pool.map(read, paths))
+        for child in children:
+            self._track(child)
+        return children
+
+    def _load_child(self, path, noextend=False):
+        """
+        Load a configuration file referenced by this one (defaults, includes
+        and imports) using the same loading options, and return the resulting
+        :py:class:`~ConfDict` object. The child's files are added to this
+        object's sources.
+        """
+        child = self._read_child(path, noextend)
+        self._track(child)
+        return child
+
+    def _read_child(self, path, noextend=False, pooled=False):
+        """
+        Load a configuration file referenced by this one without tracking its
+        sources. This method is safe to call from multiple threads. The
+        ``pooled`` flag is set when called from a pool, and makes the child
+        load its own referenced files serially.
+
+        Objects that have been reloaded keep the loaded object among their
+        children. When reloading again, an unchanged child from the previous
+        load is reused as is, and a changed one is loaded again reusing its
+        unchanged parts.
+        """
+        realpath = os.path.realpath(path)
+        chain = self._chain
+        if not chain and not hasattr(self.path, 'read') and self.path:
+            # This is the file at the top of the graph
+            chain = (os.path.realpath(self.path),)
+        if realpath in chain:
+            cycle = chain[chain.index(realpath):] + (realpath,)
+            raise ConfigurationError('Configuration files reference each '
+                                     'other: {}'.format(' -> '.join(cycle)))
+        child = None
+        previous = None
+        if self._previous is not None:
+            previous = self._previous._children.get((realpath, noextend))
+            if previous is not None and not previous.is_stale():
+                child = previous._clone()
+        key = None
+        if child is None and self.cache:
+            key = (realpath, self._eager(), self.skip_clean, noextend,
+                   self.lazy, self.compact, self.lowmem, self.engine,
+                   self.schema)
+            child = parse_cache.get(key)
+        if child is None and self._graph is not None:
+            loaded = self._graph.get((realpath, noextend))
+            if loaded is not None:
+                child = loaded._clone()
+        if child is None:
+            options = self._options()
+            if pooled:
+                options['workers'] = None
+            child = self._eager()()
+            child.configure(path, self.skip_clean, noextend, **options)
+            child._keep_children = self._keep_children
+            child._previous = previous
+            child._graph = self._graph
+            child._chain = chain + (realpath,)
+            try:
+                child.load()
+            finally:
+                child._previous = None
+                child._graph = None
+            if key is not None:
+                parse_cache.put(key, child)
+            if self._graph is not None:
+                self._graph[(realpath, noextend)] = child
+            stats = child.load_stats
+        else:
+            stats = LoadStats(path, reused=True)
+        if self._child_stats is not None:
+            stats.role = 'include' if noextend else 'defaults'
+            self._child_stats[(path, noextend)] = stats
+        if self._keep_children:
+            self._children[(realpath, noextend)] = child
+        return child
+
+    def _options(self):
+        """
+        Return the loading options that are passed on to the referenced files
+        as keyword arguments for :py:meth:`~ConfDict.configure`.
+        """
+        # Referenced files are loaded in full
+        engine = 'stream' if self.engine == 'mmap' else self.engine
+        return dict(lazy=self.lazy, compact=self.compact, lowmem=self.lowmem,
+                    cache=self.cache, workers=self.workers, engine=engine,
+                    schema=self.schema, stats=self.stats)
+
+    def _clone(self):
+        """
+        Return a copy of this object, including its attributes, which can be
+        modified without affecting the original. List values are copied, and
+        the parser object is shared.
+        """
+        clone = self.__class__()
+        # Copied at dict level, so that deferred sections are not loaded
+        super(ConfDict, clone).update(dict.items(self))
+        for key, value in super(ConfDict, self).items():
+            if type(value) is list:
+                super(ConfDict, clone).__setitem__(key, list(value))
+            elif type(value) is CompactList:
+                super(ConfDict, clone).__setitem__(key, copy.copy(value))
+        for name, value in self.__dict__.items():
+            if isinstance(value, (list, dict, set)):
+                value = copy.copy(value)
+            setattr(clone, name, value)
+        clone._index = None
+        return clone
+
+    def _track(self, child):
+        """
+        Add the source files and path patterns of a loaded child to this
+        object's :py:attr:`~ConfDict.sources` and
+        :py:attr:`~ConfDict.patterns`, and collect its schema errors.
+        """
+        for path, stamp in child.sources.items():
+            self.sources.setdefault(path, stamp)
+        self.patterns.extend(child.patterns)
+        self._errors.extend(child._errors)
 
     def _init_parser(self):
         """
         Initialize the ``ConfigParser`` object and read the path or file-like
         object stored in the :py:attr:`~ConfDict.path` property.
+
+        This also starts a new record of the files that make up the
+        configuration (see :py:attr:`~ConfDict.sources`). The file is stamped
+        before it is read, so that any modification made while loading is
+        detected as a change later. When reloading, the parser of the previous
+        load is reused if the file has not changed since.
         """
-        self.parser = ConfigParser()
+        self.sources = OrderedDict()
+        self.patterns = []
+        self._children = {}
+        self._errors = []
         if hasattr(self.path, 'read'):
-            self.parser.readfp(self.path)
+            self.parser = self._parse(self.path)
+            return
+        path = os.path.realpath(self.path)
+        stamp = self.sources[path] = file_stamp(path)
+        previous = self._previous
+        if (stamp is not None and previous is not None and
+                previous.sources.get(path) == stamp):
+            self.parser = previous.parser
+            return
+        self.parser = self._parse(self.path)
+
+    def _parse(self, source):
+        """
+        Read and parse a path or a file-like object using the configured
+        engine, and return the resulting parser object. The ``stream`` engine
+        returns a :py:class:`~SectionIndex`, and the ``mmap`` engine returns a
+        :py:class:`~MappedSectionIndex` for paths.
+        """
+        if self.engine == 'mmap' and not hasattr(source, 'read'):
+            return MappedSectionIndex(source)
+        if self.engine in ('stream', 'mmap'):
+            return SectionIndex.read(source)
+        parser = ConfigParser()
+        if hasattr(source, 'read'):
+            parser.readfp(source)
         else:
-            self.parser.read(self.path)
+            parser.read(source)
+        return parser
 
     def _check_conf(self):
         """
         Check whether there are any sections, and raise
         :py:class:`~ConfigurationError` excetpion if no sections are found.
         """
-        if not self.sections:
-            raise ConfigurationError("Missing or empty configuration file at "
-                                     "'{}'".format(self.path))
+        if not self.sections:
+            raise ConfigurationError("Missing or empty configuration file at "
+                                     "'{}'".format(self.path))
+
+    def load(self):
+        """
+        Parses and loads the configuration data. This method will trigger a
+        sequence of operations:
+
+        - initialize the parser, and load and parse the configuration file
+        - check the configuration file
+        - perform preprocessing (check for references to other files)
+        - process the sections
+        - process any includes or extensions
+
+        Any problems with the referenced defaults and includes will propagate
+        to this call. Each referenced file is loaded once, even if several
+        files reference it, and :py:class:`~ConfigurationError` is raised if
+        the files reference each other in a cycle.
+
+        When the :py:attr:`~ConfDict.stats` attribute is set, the load is
+        measured as described in :py:meth:`~ConfDict._load_measured`.
+        When the :py:attr:`~ConfDict.lowmem` attribute is set, the parser is
+        released once the file is loaded (see
+        :py:meth:`~ConfDict._release_parser`), and the loaded referenced
+        files are not kept for reloads.
+
+        .. note::
+            Using this method for reloading the configuration is not
+            recommended. Use :py:meth:`~ConfDict.reload` instead.
+        """
+        top = self._graph is None
+        if top:
+            self._graph = {}
+        try:
+            if self.stats:
+                self._load_measured()
+            else:
+                self.load_stats = None
+                self._init_parser()
+                self._check_conf()
+                self._preprocess()
+                self._process()
+                self._postprocess()
+            if self.lowmem:
+                self._release_parser()
+        finally:
+            if top:
+                self._graph = None
+            if self.lowmem:
+                self._children = {}
+                self._previous = None
+
+    def _release_parser(self):
+        """
+        Replace the parser with a :py:class:`~SectionIndex` of the raw values,
+        whose section and option names are interned, so that
+        :py:meth:`~ConfDict.get_section`, :py:meth:`~ConfDict.get_option` and
+        :py:attr:`~ConfDict.sections` keep working. The index of the ``mmap``
+        engine is kept as is, since it still has sections to read.
+        """
+        if self.parser is None or isinstance(self.parser, MappedSectionIndex):
+            return
+        self.parser = SectionIndex.from_parser(self.parser)
+
+    def _load_measured(self):
+        """
+        Load the configuration like :py:meth:`~ConfDict.load`, and record the
+        time taken by each phase, and the sizes of the files, in a
+        :py:class:`~LoadStats` tree stored in the
+        :py:attr:`~ConfDict.load_stats` attribute. If the
+        :py:attr:`~ConfDict.stats` attribute is a callable, it is called with
+        the stats once the file is loaded.
+        """
+        stats = self.load_stats = LoadStats(self.path)
+        phases = stats.phases
+        self._child_stats = {}
+        start = _clock()
+        try:
+            for name, phase in (('init_parser', self._init_parser),
+                                ('check', self._check_conf),
+                                ('preprocess', self._preprocess),
+                                ('process', self._process),
+                                ('postprocess', self._postprocess)):
+                began = _clock()
+                phase()
+                phases[name] = _clock() - began
+            stats.total = _clock() - start
+            stats.children = [
+                self._child_stats[(path, noextend)]
+                for paths, noextend in ((self.defaults, False),
+                                        (self.include, True))
+                for path in paths]
+        finally:
+            self._child_stats = None
+        if not hasattr(self.path, 'read'):
+            # The file itself is always the first of the sources
+            stamp = next(iter(self.sources.values()))
+            stats.bytes = stamp[1] if stamp else 0
+        stats.options = sum(len(self.get_section(section))
+                            for section in self.sections
+                            if section not in self._pending)
+        if callable(self.stats):
+            self.stats(stats)
+
+    def _set_schema_defaults(self):
+        """
+        Set the options declared in the schema that are still missing once
+        all the files are loaded to their declared defaults.
+        """
+        if self.schema is not None:
+            self.setdefaults(self.schema.defaults)
+
+    def _validate(self):
+        """
+        Raise :py:class:`~SchemaError` listing all the schema errors found
+        while loading, and the required options that are missing.
+        """
+        if self.schema is None:
+            return
+        errors = self._errors + self.schema.check(self)
+        if errors:
+            raise SchemaError(errors)
+
+    def reload(self):
+        """
+        Reload the configuration from the files it was loaded from, and return
+        a :py:class:`~ConfDiff` listing the keys that were added, removed, or
+        changed.
+
+        The first reload reads all files again. From then on, the object
+        keeps the objects loaded from its defaults and include files, so that
+        later reloads only read and parse the files that changed since the
+        last load. Files whose referenced files have changed are merged again
+        using their previously parsed contents, and the parts of the file
+        graph that have not changed at all are reused as they are. Objects
+        that are never reloaded do not hold on to their referenced files.
+
+        The defaults passed to :py:meth:`~ConfDict.from_file` are applied
+        again, while changes made to the object after loading (including
+        imported files) are discarded. If none of the files has changed,
+        nothing is done and an empty diff is returned.
+        """
+        if self.path is None or hasattr(self.path, 'read'):
+            raise ConfigurationError('Only configuration loaded from a path '
+                                     'can be reloaded')
+        return self._apply(self._load_fresh())
+
+    def reload_async(self, executor=None):
+        """
+        Reload the configuration like :py:meth:`~ConfDict.reload`, without
+        blocking the running asyncio event loop, and return a future whose
+        result is the :py:class:`~ConfDiff`.
+
+        The files are read and parsed in ``executor`` (the default executor of
+        the loop if omitted). The reloaded values replace the current ones in
+        a single step on the event loop, so coroutines never see a partially
+        reloaded configuration.
+        """
+        if self.path is None or hasattr(self.path, 'read'):
+            raise ConfigurationError('Only configuration loaded from a path '
+                                     'can be reloaded')
+        loop = _get_loop()
+        result = loop.create_future()
+
+        def done(future):
+            if result.cancelled():
+                return
+            try:
+                result.set_result(self._apply(future.result()))
+            except Exception as exc:
+                result.set_exception(exc)
+
+        loop.run_in_executor(executor, self._load_fresh).add_done_callback(
+            done)
+        return result
+
+    def _load_fresh(self):
+        """
+        Load the files again into a new object and return it, or return
+        ``None`` if none of the files has changed.
+        """
+        if not self.is_stale():
+            return None
+        fresh = self.__class__()
+        fresh.update(self._initial)
+        options = self._options()
+        # The file itself is loaded with its own engine
+        options['engine'] = self.engine
+        fresh.configure(self.path, self.skip_clean, self.noextend, **options)
+        fresh._initial = self._initial
+        fresh._keep_children = not self.lowmem
+        fresh._previous = self
+        try:
+            fresh.load()
+        finally:
+            fresh._previous = None
+        fresh._set_schema_defaults()
+        fresh._validate()
+        return fresh
+
+    def _apply(self, fresh):
+        """
+        Replace the contents of this object with those of ``fresh`` object
+        returned by :py:meth:`~ConfDict._load_fresh`, and return the diff.
+        """
+        if fresh is None:
+            return ConfDiff([], [], [])
+        diff = ConfDiff.between(self, fresh)
+        # Removed keys are deleted last, so that other threads never see a
+        # key go missing while the values are replaced. The values are copied
+        # at dict level, so that deferred sections are not loaded.
+        super(ConfDict, self).update(dict.items(fresh))
+        for key in diff.removed:
+            super(ConfDict, self).__delitem__(key)
+        self.__dict__.update(fresh.__dict__)
+        self._index = None
+        return diff
+
+    def is_stale(self):
+        """
+        Return ``True`` if any of the files that make up the configuration has
+        been modified or removed since it was loaded, or if a ``[config]``
+        pattern now matches a different set of files.
+        """
+        for path, stamp in self.sources.items():
+            if file_stamp(path) != stamp:
+                return True
+        for pattern, matches in self.patterns:
+            if expand_path(pattern) != matches:
+                return True
+        return False
+
+    def _snapshot_key(self, defaults):
+        """
+        Return the value that identifies the snapshots of this configuration
+        given the default options passed to :py:meth:`~ConfDict.from_file`.
+        """
+        schema = self.schema and self.schema.signature
+        return (os.path.realpath(self.path), self.skip_clean, self.noextend,
+                self.lazy, self.compact, tuple(sys.version_info[:2]), defaults,
+                schema)
 
-    def load(self):
+    def _load_snapshot(self, snapshot, defaults):
         """
-        Parses and loads the configuration data. This method will trigger a
-        sequence of operations:
+        Restore the configuration from the snapshot file at ``snapshot`` path
+        and return ``True``. If the snapshot is missing, damaged, was made
+        with different options, or any of the files it was made from has
+        changed since, ``False`` is returned and the object is left intact.
+        """
+        try:
+            with open(snapshot, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return False
+        start = len(SNAPSHOT_MAGIC)
+        end = start + SNAPSHOT_DIGEST_SIZE
+        if data[:start] != SNAPSHOT_MAGIC:
+            return False
+        if hashlib.sha1(data[end:]).digest() != data[start:end]:
+            return False
+        try:
+            state = marshal.loads(data[end:])
+        except (EOFError, ValueError, TypeError):
+            return False
+        if not isinstance(state, dict):
+            return False
+        if state.get('key') != self._snapshot_key(defaults):
+            return False
+        for path, stamp, digest in state['sources']:
+            if file_stamp(path) != stamp:
+                return False
+            try:
+                if file_digest(path) != digest:
+                    return False
+            except (IOError, OSError):
+                return False
+        for pattern, matches in state['patterns']:
+            if expand_path(pattern) != matches:
+                return False
+        self._restore_state(state)
+        self.sources = OrderedDict(
+            (path, stamp) for path, stamp, _ in state['sources'])
+        return True
 
-        - initialize the parser, and load and parse the configuration file
-        - check the configuration file
-        - perform preprocessing (check for references to other files)
-        - process the sections
-        - process any includes or extensions
+    def _dump_state(self):
+        """
+        Return a dict holding the loaded values, the raw sections, and the
+        ``[config]`` paths of this object, made of built-in types only (as
+        long as the values are), which can be restored using
+        :py:meth:`~ConfDict._restore_state`.
+        """
+        data = {}
+        pending = []
+        compact = []
+        for key, value in super(ConfDict, self).items():
+            if type(value) is RawValue:
+                pending.append(key)
+                value = str(value)
+            elif type(value) is CompactList:
+                compact.append((key, value.typecode))
+                value = value.tolist()
+            data[key] = value
+        return {
+            'patterns': self.patterns,
+            'sections': [(section, self.get_section(section))
+                         for section in self.sections],
+            'data': data,
+            'pending': pending,
+            'compact': compact,
+            'defaults': self.defaults,
+            'include': self.include,
+            'extensions': self._extensions,
+        }
 
-        Any problems with the referenced defaults and includes will propagate
-        to this call.
+    def _restore_state(self, state, index=False):
+        """
+        Replace the values, the parser, and the ``[config]`` paths of this
+        object with those in the ``state`` returned by
+        :py:meth:`~ConfDict._dump_state`. The parser is replaced with a
+        :py:class:`~SectionIndex` if the ``index`` flag is set or the engine
+        is not ``'parser'``.
+        """
+        if index or self.lowmem or self.engine in ('stream', 'mmap'):
+            parser = SectionIndex.from_sections(state['sections'])
+        else:
+            parser = ConfigParser()
+            for section, items in state['sections']:
+                parser.add_section(section)
+                for key, value in items:
+                    parser.set(section, key, value)
+        super(ConfDict, self).clear()
+        super(ConfDict, self).update(state['data'])
+        for key in state['pending']:
+            value = super(ConfDict, self).__getitem__(key)
+            super(ConfDict, self).__setitem__(key, RawValue(value))
+        for key, typecode in state.get('compact', ()):
+            value = super(ConfDict, self).__getitem__(key)
+            super(ConfDict, self).__setitem__(key,
+                                              CompactList(typecode, value))
+        self.parser = parser
+        if self.lowmem:
+            self._release_parser()
+        self.defaults = state['defaults']
+        self.include = state['include']
+        self._extensions = state['extensions']
+        self.patterns = state['patterns']
 
-        .. note::
-            Using this method for reloading the configuration is not
-            recommended. Instead, create a new instance using the
-            :py:meth:`~ConfDict.from_file` method.
+    def _save_snapshot(self, snapshot, defaults):
+        """
+        Write the loaded configuration to the snapshot file at ``snapshot``
+        path. The snapshot is not written if any of the source files was
+        modified while loading, or if some of the values cannot be stored.
+        Failure to write the file is silently ignored.
         """
-        self._init_parser()
-        self._check_conf()
-        self._preprocess()
-        self._process()
-        self._postprocess()
+        sources = []
+        for path, stamp in self.sources.items():
+            try:
+                digest = file_digest(path)
+            except (IOError, OSError):
+                return
+            if stamp is None or file_stamp(path) != stamp:
+                return
+            sources.append((path, stamp, digest))
+        state = self._dump_state()
+        state['key'] = self._snapshot_key(defaults)
+        state['sources'] = sources
+        try:
+            body = marshal.dumps(state, 2)
+        except ValueError:
+            # Some of the values (most likely the defaults passed by the
+            # caller) are not of a built-in type.
+            return
+        digest = hashlib.sha1(body).digest()
+        tmp = '{}.{}.tmp'.format(snapshot, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(SNAPSHOT_MAGIC + digest + body)
+            _replace(tmp, snapshot)
+        except (IOError, OSError):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
 
-    def configure(self, path, skip_clean=False, noextend=False):
+    def configure(self, path, skip_clean=False, noextend=False, lazy=False,
+                  cache=False, workers=None, engine='parser', schema=None,
+                  stats=False, compact=False, lowmem=False):
         """
         Configure the :py:class:`~ConfDict` instance for processing.
 
         The ``path`` is a path to the configuration file. ``skip_clean``
         parameter is a boolean flag that suppresses type conversion during
-        parsing. ``noextend`` flag suppresses list extension.
+        parsing. ``noextend`` flag suppresses list extension. ``lazy`` flag
+        defers type conversion of each value until it is first accessed.
+        ``cache`` flag enables the use of the process-wide
+        :py:data:`~parse_cache` for the referenced files. ``workers`` is the
+        maximum number of threads used for loading the referenced files
+        concurrently. ``engine`` selects the parser, one of ``'parser'``,
+        ``'stream'`` and ``'mmap'``. ``schema`` is the :py:class:`~Schema`
+        used for converting the declared options. ``stats`` enables load
+        measurements, and may be a callable that receives them. ``compact``
+        flag stores numeric lists as :py:class:`~CompactList` objects.
+        ``lowmem`` flag releases the parser once the file is loaded.
         """
+        if engine not in ENGINES:
+            raise ValueError("Unknown engine '{}'".format(engine))
         self.path = path
         self.base_path = os.path.dirname(os.path.abspath(path))
         self.skip_clean = skip_clean
         self.noextend = noextend
+        self.lazy = lazy
+        self.compact = compact
+        self.lowmem = lowmem
+        self.cache = cache
+        self.workers = workers
+        self.engine = engine
+        self.schema = schema
+        self.stats = stats
 
     def setdefaults(self, other):
         """
@@ -396,9 +2878,14 @@ class ConfDict(dict):
         dict or dict-like object, whose key-value pairs are added to the
         :py:class:`~ConfDict` object if the key does not exist already.
         """
-        for k in other:
-            if k not in self:
-                self[k] = other[k]
+        if isinstance(other, dict):
+            # Stored values are copied as is, so values that are still
+            # awaiting lazy coercion do not get coerced prematurely.
+            items = dict.items(other)
+        else:
+            items = ((k, other[k]) for k in other)
+        present = super(ConfDict, self).__contains__
+        self.update([(k, v) for k, v in items if not present(k)])
 
     def import_from_file(self, path, as_defaults=False, ignore_missing=False):
         """
@@ -409,8 +2896,7 @@ class ConfDict(dict):
         missing.
         """
         try:
-            incl = self.__class__.from_file(path, self.skip_clean,
-                                            noextend=True)
+            incl = self._load_child(path, noextend=True)
         except self.ConfigurationError:
             return {}
         if as_defaults:
@@ -425,7 +2911,10 @@ class ConfDict(dict):
         return incl
 
     @classmethod
-    def from_file(cls, path, skip_clean=False, noextend=False, defaults={}):
+    def from_file(cls, path, skip_clean=False, noextend=False, defaults={},
+                  lazy=False, snapshot=None, cache=False, workers=None,
+                  engine='parser', schema=None, stats=False, compact=False,
+                  lowmem=False):
         """
         Load the values from the specified file. The ``skip_clean`` flag is
         used to suppress type conversion. ``noextend`` flag suppresses list
@@ -434,10 +2923,1042 @@ class ConfDict(dict):
         You may also specify default options using the ``defaults`` argument.
         This argument should be a dict. Values specified in this dict are
         overridden by the values present in the configuration file.
+
+        The ``lazy`` flag defers type conversion: the raw values are stored
+        and each value is converted the first time it is accessed. This
+        makes the loading cost depend on the number of options that are
+        actually used rather than the size of the configuration. The
+        defaults and include files are loaded the same way.
+
+        The ``snapshot`` argument is a path to a snapshot file, in which the
+        fully loaded configuration is stored for subsequent loads. The
+        snapshot is used only if neither the files it was made from (their
+        modification time, size and contents) nor the arguments of this
+        method have changed. Otherwise, the configuration is loaded from the
+        files as usual and the snapshot is rewritten. Snapshots cannot be used
+        with file-like objects.
+
+        The ``cache`` flag makes the defaults and include files go through the
+        process-wide :py:data:`~parse_cache`, so that files shared by several
+        configurations are only parsed once per process.
+
+        The ``workers`` argument enables concurrent loading of the defaults
+        and include files. Files matched by the ``[config]`` paths are read
+        and parsed in a pool of at most ``workers`` threads, which helps when
+        there are many of them on high-latency storage. The files are merged
+        in the usual order, so the result is the same as with serial loading.
+
+        The ``engine`` argument selects how the files are parsed. The default
+        ``'parser'`` engine uses ``RawConfigParser``. The ``'stream'`` engine
+        reads the files line by line with :py:func:`~tokenize` and keeps only
+        a compact :py:class:`~SectionIndex` of the raw values, which takes
+        less time and memory on large files. It accepts the syntax of the
+        Python 3 parser regardless of the Python version.
+
+        The ``'mmap'`` engine goes further for very large files: it only
+        indexes the offsets of the sections, and each section is read and
+        parsed when one of its keys is first accessed, so the loading cost
+        depends on the sections actually used. Section headers must start at
+        the beginning of a line, and the defaults and include files are loaded
+        in full. Snapshots are not used with this engine. The returned object
+        is an instance of a :py:class:`~MappedConfDict` subclass of this
+        class.
+
+        The ``schema`` argument is a :py:class:`~Schema` that declares the
+        types, defaults, and required flags of options. Declared options are
+        converted to their types right away, also in lazy mode, and their
+        defaults are set for the options that are still missing once all the
+        files are loaded, so they never override the values from the
+        ``defaults`` argument or the defaults files. If any of the values
+        cannot be converted, or any of the required options is missing,
+        :py:class:`~SchemaError` listing all the problems is raised once the
+        configuration is loaded. With ``skip_clean``, the values are left
+        unconverted, and only the defaults and required options are applied.
+
+        The ``stats`` flag makes the load measure the wall time of each of
+        its phases, and the number of files, bytes and options read, and
+        store them as a :py:class:`~LoadStats` tree in the ``load_stats``
+        attribute. If ``stats`` is a callable, it is also called with the
+        stats of every file once that file is loaded. Nothing is measured
+        when the configuration is restored from a snapshot.
+
+        The ``compact`` flag makes lists whose items are all integers, all
+        floats, or all byte sizes be stored as :py:class:`~CompactList`
+        objects, which take several times less memory than lists and are
+        parsed faster. Lists that are extended with items of other types are
+        converted to lists.
+
+        The ``lowmem`` flag reduces the memory held by the configuration once
+        it is loaded. The parser of each file, which holds a copy of all the
+        raw values, is replaced with a compact :py:class:`~SectionIndex`, so
+        :py:meth:`~ConfDict.get_section`, :py:meth:`~ConfDict.get_option`
+        and :py:attr:`~ConfDict.sections` return the same results as before.
+        The section and option names are interned. The referenced files are
+        not kept for incremental reloads, so reloads read all the files.
         """
         # Instantiate the ConfDict class and configure it
+        self = (cls._mapped() if engine == 'mmap' else cls)()
+        initial = dict(defaults)
+        self.update(initial)
+        self._initial = initial
+        self.configure(path, skip_clean, noextend, lazy=lazy, cache=cache,
+                       workers=workers, engine=engine, schema=schema,
+                       stats=stats, compact=compact, lowmem=lowmem)
+        if hasattr(path, 'read') or engine == 'mmap':
+            snapshot = None
+        if snapshot is None or not self._load_snapshot(snapshot, defaults):
+            self.load()
+            self._set_schema_defaults()
+            self._validate()
+            if snapshot is not None:
+                self._save_snapshot(snapshot, defaults)
+        return self
+
+    @classmethod
+    def from_file_async(cls, path, executor=None, workers=ASYNC_WORKERS,
+                        **kwargs):
+        """
+        Load the configuration like :py:meth:`~ConfDict.from_file` without
+        blocking the running asyncio event loop, and return a future whose
+        result is the loaded object.
+
+        Reading, parsing, and type conversion all happen in ``executor`` (the
+        default executor of the loop if omitted), so the event loop keeps
+        serving other coroutines while a large configuration is loaded. The
+        defaults and include files are loaded concurrently in a pool of at
+        most ``workers`` threads. Other keyword arguments are passed to
+        :py:meth:`~ConfDict.from_file`, and the result is the same.
+        """
+        load = functools.partial(cls.from_file, path, workers=workers,
+                                 **kwargs)
+        return _get_loop().run_in_executor(executor, load)
+
+    @classmethod
+    def from_files(cls, paths, workers=None, defaults={}, **kwargs):
+        """
+        Load many independent configuration files, and yield a
+        :py:class:`~LoadResult` for each of them. Its ``conf`` field is the
+        loaded object, or ``None`` if loading the file failed with
+        :py:class:`~ConfigurationError` (or a parser or I/O error). The
+        exception is then stored in the ``error`` field. Other keyword
+        arguments are passed to :py:meth:`~ConfDict.from_file`, except
+        ``snapshot`` and ``stats``, which are not supported and raise
+        ``TypeError``.
+
+        With ``workers``, the files are loaded in a pool of that many
+        processes, and the results are yielded as soon as they are ready, in
+        no particular order. Each process keeps the files referenced by the
+        configurations it loads in its :py:data:`~parse_cache`, so common
+        defaults and include files are only parsed once per process. The
+        loaded values are sent back to this process in the compact
+        ``marshal`` format, and the raw options of the loaded objects are
+        held by a :py:class:`~SectionIndex` instead of a parser. Without
+        ``workers``, the files are loaded one by one in this process and the
+        results are yielded in order.
+        """
+        for name in ('snapshot', 'stats'):
+            if name in kwargs:
+                raise TypeError("from_files() does not support the '{}' "
+                                "argument".format(name))
+        kwargs['defaults'] = defaults
+        futures = _futures() if workers else None
+        if futures is None:
+            for path in paths:
+                try:
+                    yield LoadResult(path, cls.from_file(path, **kwargs),
+                                     None)
+                except LOAD_ERRORS as exc:
+                    yield LoadResult(path, None, exc)
+            return
+        paths = list(paths)
+        # Batches amortize the cost of a task while keeping all workers busy
+        size = max(1, min(FROM_FILES_BATCH, len(paths) // (workers * 4)))
+        pool = futures.ProcessPoolExecutor(max_workers=workers)
+        tasks = []
+        try:
+            tasks = [pool.submit(_load_states, cls, paths[i:i + size], kwargs)
+                     for i in range(0, len(paths), size)]
+            for future in futures.as_completed(tasks):
+                for path, state, error in future.result():
+                    if error is not None:
+                        yield LoadResult(path, None, error)
+                        continue
+                    yield LoadResult(
+                        path, cls._from_state(path, state, kwargs), None)
+        finally:
+            for future in tasks:
+                future.cancel()
+            pool.shutdown()
+
+    @classmethod
+    def _from_state(cls, path, state, options):
+        """
+        Return the object loaded in a worker process of
+        :py:meth:`~ConfDict.from_files` from its encoded state.
+        """
+        if isinstance(state, bytes):
+            state = marshal.loads(state)
+        options = dict(options)
+        defaults = options.pop('defaults')
         self = cls()
-        self.update(defaults)
-        self.configure(path, skip_clean, noextend)
-        self.load()
+        self._initial = dict(defaults)
+        self.configure(path, options.pop('skip_clean', False),
+                       options.pop('noextend', False), **options)
+        # The index is much faster to build than RawConfigParser
+        self._restore_state(state, index=True)
+        self.sources = OrderedDict(state['sources'])
+        return self
+
+    @classmethod
+    def _eager(cls):
+        """
+        Return the class of the referenced files, which are loaded in full.
+        """
+        return cls
+
+    @classmethod
+    def _mapped(cls):
+        """
+        Return the class of the objects loaded with the ``mmap`` engine,
+        which is a subclass of both :py:class:`~MappedConfDict` and this
+        class.
+        """
+        if issubclass(cls, MappedConfDict):
+            return cls
+        if cls is ConfDict:
+            return MappedConfDict
+        try:
+            return _mapped_classes[cls]
+        except KeyError:
+            mapped = _mapped_classes[cls] = type(
+                'Mapped' + cls.__name__, (MappedConfDict, cls), {})
+            return mapped
+
+    def watch(self, callback=None, **kwargs):
+        """
+        Start watching the files that make up the configuration, and return
+        the running :py:class:`~ConfigWatcher` object. The arguments are
+        passed on to the watcher.
+        """
+        watcher = ConfigWatcher(self, callback, **kwargs)
+        watcher.start()
+        return watcher
+
+    def derive(self, overrides=None, **kwargs):
+        """
+        Return a :py:class:`~LayeredConf` that looks keys up in its own
+        overrides first and in this object second, so the overrides are
+        applied without copying the configuration. The overrides are taken
+        from the ``overrides`` dict and the keyword arguments.
+
+        Keys prefixed with ``+`` extend the list value of the key, like the
+        ``+key`` options of configuration files::
+
+            tenant = conf.derive({'+allowed_hosts': ['tenant.example.com']})
+
+        The time and memory taken depend only on the number of overrides (and
+        the length of the extended lists). Changes to this object remain
+        visible in the derived one for keys it does not override, while
+        changes to the derived object are only stored in its overrides.
+        Derived objects can be derived from again. They also provide
+        :py:meth:`~LayeredConf.section`, :py:meth:`~LayeredConf.match`,
+        :py:meth:`~LayeredConf.get_section`, :py:meth:`~LayeredConf.get_option`
+        and :py:attr:`~LayeredConf.sections`.
+        """
+        return LayeredConf._derive([self], self, overrides, kwargs)
+
+    def freeze(self):
+        """
+        Return a :py:class:`~FrozenConf` holding the current values, with all
+        deferred coercion and section loading done. Lookups in the frozen
+        copy bypass the Python methods of this class, which makes them
+        several times faster, so it is well suited for hot code paths. Later
+        changes to this object, including reloads, are not reflected in the
+        frozen copy.
+        """
+        return FrozenConf((key, freeze_value(value))
+                          for key, value in self.items())
+
+    def publish(self, path):
+        """
+        Write the configuration to the file at ``path`` in the encoding read
+        by :py:class:`~SharedConf`, and return its generation number. Worker
+        processes can then map the file with :py:meth:`SharedConf.open`
+        instead of loading the configuration themselves, and all of them
+        share the same pages of memory. For the file to stay in memory, the
+        path should be on a RAM-backed file system such as ``/dev/shm``.
+
+        Publishing to a path that already holds an encoded configuration, for
+        example after a :py:meth:`~ConfDict.reload`, writes the next
+        generation. The file is replaced atomically, so readers keep using
+        the previous generation until they call :py:meth:`SharedConf.refresh`.
+        """
+        generation = 1
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(SHARED_HEADER.size)
+            magic, previous = SHARED_HEADER.unpack(header)[:2]
+            if magic == SHARED_MAGIC:
+                generation = previous + 1
+        except (IOError, OSError, struct.error):
+            pass
+        data = SharedConf.encode(self, generation)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            _replace(tmp, path)
+        except (IOError, OSError):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        return generation
+
+
+class MappedConfDict(ConfDict):
+    """
+    :py:class:`~ConfDict` loaded with the ``mmap`` engine. Only the special
+    section, the global sections, and the sections with options declared in
+    the schema are parsed while loading. Each of the other sections is parsed
+    when the first of its keys is accessed or modified.
+
+    The lookup and modification methods first load the deferred sections
+    that the key may belong to. Iteration, ``len()``, comparison, and the
+    methods that return all keys or values load all of them, so the object
+    behaves as if it were loaded in full. These checks are kept out of
+    :py:class:`~ConfDict`, whose lookups do not pay for them.
+
+    Sections are loaded under a lock, and a section is only marked as loaded
+    once all of its keys are stored, so that threads looking up keys while
+    another thread loads their section wait for it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(MappedConfDict, self).__init__(*args, **kwargs)
+        # Reentrant, as storing the keys of a section may load others
+        self._lock = threading.RLock()
+        # Sections being loaded by the thread that holds the lock
+        self._loading = set()
+
+    @classmethod
+    def _eager(cls):
+        for base in cls.__mro__:
+            if not issubclass(base, MappedConfDict):
+                return base
+
+    def __getitem__(self, key):
+        if self._pending:
+            self._load_pending(key)
+        return super(MappedConfDict, self).__getitem__(key)
+
+    def get(self, key, default=None):
+        if self._pending:
+            self._load_pending(key)
+        return super(MappedConfDict, self).get(key, default)
+
+    def __contains__(self, key):
+        if self._pending:
+            self._load_pending(key)
+        return super(MappedConfDict, self).__contains__(key)
+
+    def __setitem__(self, key, value):
+        if self._pending:
+            self._load_pending(key)
+        super(MappedConfDict, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        if self._pending:
+            self._load_pending(key)
+        super(MappedConfDict, self).__delitem__(key)
+
+    def update(self, *args, **kwargs):
+        if self._pending:
+            other = dict(*args, **kwargs)
+            for key in other:
+                self._load_pending(key)
+            args, kwargs = (other,), {}
+        super(MappedConfDict, self).update(*args, **kwargs)
+
+    def setdefault(self, key, default=None):
+        if self._pending:
+            self._load_pending(key)
+        return super(MappedConfDict, self).setdefault(key, default)
+
+    def pop(self, key, *args):
+        if self._pending:
+            self._load_pending(key)
+        return super(MappedConfDict, self).pop(key, *args)
+
+    def clear(self):
+        super(MappedConfDict, self).clear()
+        self._pending = set()
+
+    def __iter__(self):
+        if self._pending:
+            self._load_deferred()
+        return super(MappedConfDict, self).__iter__()
+
+    def __len__(self):
+        if self._pending:
+            self._load_deferred()
+        return super(MappedConfDict, self).__len__()
+
+    def __eq__(self, other):
+        if self._pending:
+            self._load_deferred()
+        if isinstance(other, MappedConfDict) and other._pending:
+            other._load_deferred()
+        return super(MappedConfDict, self).__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def keys(self):
+        if self._pending:
+            self._load_deferred()
+        return super(MappedConfDict, self).keys()
+
+    def items(self):
+        if self._pending:
+            self.resolve()
+        return super(MappedConfDict, self).items()
+
+    def values(self):
+        if self._pending:
+            self.resolve()
+        return super(MappedConfDict, self).values()
+
+    def copy(self):
+        if self._pending:
+            self.resolve()
+        return super(MappedConfDict, self).copy()
+
+    def resolve(self):
+        """
+        Load all deferred sections, and coerce all values whose coercion was
+        deferred by lazy loading. After this method returns, the dict holds
+        the same values as it would have if it were loaded with an eager
+        engine and without the ``lazy`` flag.
+        """
+        if self._pending:
+            self._load_deferred()
+        super(MappedConfDict, self).resolve()
+
+    def _indexed(self, prefix):
+        """
+        Return the keys that start with the dotted prefix. Deferred sections
+        that may hold such keys are loaded first.
+        """
+        if self._pending and prefix:
+            self._load_pending(prefix + '.')
+            for section in self.sections:
+                if (section in self._pending and
+                        section.startswith(prefix + '.')):
+                    self._load_section(section)
+        return super(MappedConfDict, self)._indexed(prefix)
+
+    def match(self, pattern):
+        if self._pending:
+            self._load_deferred()
+        return super(MappedConfDict, self).match(pattern)
+
+    match.__doc__ = ConfDict.match.__doc__
+
+    def setdefaults(self, other):
+        if not self._pending:
+            return super(MappedConfDict, self).setdefaults(other)
+        if isinstance(other, dict):
+            items = dict.items(other)
+        else:
+            items = ((k, other[k]) for k in other)
+        for k, v in items:
+            if k not in self:
+                self[k] = v
+
+    setdefaults.__doc__ = ConfDict.setdefaults.__doc__
+
+    def _process(self):
+        """
+        Parse the special section, the global sections, and the sections with
+        options declared in the schema, and defer the other sections. Files
+        that are not indexed by the ``mmap`` engine are processed in full.
+        """
+        if not isinstance(self.parser, MappedSectionIndex):
+            return super(MappedConfDict, self)._process()
+        self._extensions = []
+        declared = self.schema.sections if self.schema else ()
+        self._pending = set()
+        for section in self.sections:
+            if (section != 'config' and section not in DEFAULT_SECTIONS and
+                    section not in declared):
+                self._pending.add(section)
+                continue
+            exts = self._parse_section(section)
+            self._extensions.extend(exts)
+
+    def _apply(self, fresh):
+        # The sections that are loaded here are loaded in the fresh object
+        # too, so that the diff covers their keys. Sections that are deferred
+        # in both have never been read, so their keys cannot have been seen
+        # to change.
+        if fresh is None:
+            return super(MappedConfDict, self)._apply(fresh)
+        with self._lock:
+            for section in fresh.sections:
+                if (section in fresh._pending and
+                        section not in self._pending):
+                    fresh._load_section(section)
+            lock = self._lock
+            diff = super(MappedConfDict, self)._apply(fresh)
+            self._lock = lock
+            self._loading = set()
+        return diff
+
+    def _clone(self):
+        clone = super(MappedConfDict, self)._clone()
+        clone._lock = threading.RLock()
+        clone._loading = set()
+        return clone
+
+    def _load_pending(self, key):
+        """
+        Load the deferred sections that the compound key may belong to.
+        """
+        try:
+            pos = key.find('.')
+        except AttributeError:
+            return
+        while pos > 0:
+            section = key[:pos]
+            if section in self._pending:
+                self._load_section(section)
+            pos = key.find('.', pos + 1)
+
+    def _load_deferred(self):
+        """
+        Load all deferred sections.
+        """
+        for section in self.sections:
+            if section in self._pending:
+                self._load_section(section)
+
+    def _load_section(self, section):
+        """
+        Load a deferred section, with the same outcome as if it were loaded
+        with the rest of the file. The section remains pending until its keys
+        and extensions are stored.
+        """
+        with self._lock:
+            # The section may have been loaded while waiting for the lock, or
+            # be loading in this thread already
+            if section not in self._pending or section in self._loading:
+                return
+            self._loading.add(section)
+            try:
+                extensions = self._parse_section(section)
+                if self.noextend:
+                    self._extensions.extend(extensions)
+                else:
+                    self._extend(extensions)
+                self._pending.discard(section)
+            finally:
+                self._loading.discard(section)
+
+
+# Subclasses of MappedConfDict and of ConfDict subclasses, by the latter
+_mapped_classes = {}
+
+# Errors reported by ConfDict.from_files() instead of being raised
+LOAD_ERRORS = (ConfigurationError, ParserError, IOError, OSError)
+
+
+def _load_states(cls, paths, options):
+    """
+    Load configurations in a worker process of :py:meth:`ConfDict.from_files`
+    and return a list of ``(path, state, error)`` tuples, holding the encoded
+    state of each loaded object, or the exception raised while loading it.
+    """
+    options = dict(options, cache=True)
+    results = []
+    for path in paths:
+        try:
+            conf = cls.from_file(path, **options)
+        except LOAD_ERRORS as exc:
+            results.append((path, None, exc))
+            continue
+        if conf._pending:
+            conf._load_deferred()
+        state = conf._dump_state()
+        state['sources'] = list(conf.sources.items())
+        try:
+            state = marshal.dumps(state, 2)
+        except ValueError:
+            # Values that are not of a built-in type are pickled as usual
+            pass
+        results.append((path, state, None))
+    return results
+
+
+class Inotify(object):
+    """
+    Minimal binding of the Linux inotify API, used by
+    :py:class:`~ConfigWatcher`. Only directories are watched.
+    """
+    EVENT = struct.Struct('iIII')
+    MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+            IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+            IN_MOVE_SELF | IN_ONLYDIR)
+
+    def __init__(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        # Imported here, as only the watcher needs it
+        try:
+            import ctypes
+            import ctypes.util
+        except ImportError:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._get_errno = ctypes.get_errno
+        self._add_watch = libc.inotify_add_watch
+        self._rm_watch = libc.inotify_rm_watch
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = self._get_errno()
+            raise OSError(err, os.strerror(err))
+        self.paths = {}
+
+    @staticmethod
+    def _encode(path):
+        if isinstance(path, bytes):
+            return path
+        return path.encode(sys.getfilesystemencoding())
+
+    def add(self, path):
+        """
+        Start watching the directory at specified path, and return the watch
+        descriptor. ``OSError`` is raised if the directory cannot be watched.
+        """
+        wd = self._add_watch(self.fd, self._encode(path), self.MASK)
+        if wd < 0:
+            err = self._get_errno()
+            raise OSError(err, os.strerror(err), path)
+        self.paths[wd] = path
+        return wd
+
+    def remove(self, wd):
+        """
+        Stop watching the directory with the specified watch descriptor.
+        """
+        self._rm_watch(self.fd, wd)
+        self.paths.pop(wd, None)
+
+    def read(self):
+        """
+        Return a list of ``(directory, name, mask)`` tuples for the pending
+        events. The name is blank for events concerning the directory itself.
+        """
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as err:
+            if err.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        size = self.EVENT.size
+        offset = 0
+        while offset + size <= len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if not isinstance(name, str):
+                name = name.decode(sys.getfilesystemencoding())
+            if mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+            events.append((self.paths.get(wd), name, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ConfigWatcher(object):
+    """
+    Watches all files that make up a :py:class:`~ConfDict` (the file itself,
+    and all of its defaults and includes), as well as the directories behind
+    the ``[config]`` patterns so that newly added files are noticed.
+
+    When a change is detected, the configuration is reloaded using
+    :py:meth:`ConfDict.reload` and ``callback`` is invoked with the
+    configuration and the :py:class:`~ConfDiff` as arguments, unless the
+    reload did not change any values. If ``reload`` is ``False``, the
+    callback is invoked with ``None`` as diff for every change instead.
+    Errors raised while reloading (e.g., a file was saved in a malformed
+    state) are passed to ``on_error`` if specified, and the configuration
+    remains unchanged.
+
+    Bursts of writes are coalesced: the change is only handled once no events
+    have been seen for ``debounce`` seconds. On Linux, the watcher sleeps on
+    inotify events. On other platforms, or when ``inotify`` is ``False``, it
+    polls file stamps every ``interval`` seconds instead.
+
+    Note that reloading modifies the configuration in place from the watcher
+    thread.
+    """
+
+    def __init__(self, conf, callback=None, reload=True, debounce=0.2,
+                 interval=1.0, on_error=None, inotify=None):
+        self.conf = conf
+        self.callback = callback
+        self.reload = reload
+        self.debounce = debounce
+        self.interval = interval
+        self.on_error = on_error
+        if inotify is None:
+            inotify = sys.platform.startswith('linux')
+        self.use_inotify = inotify
+        self._inotify = None
+        self._wake = None
+        self._watches = {}
+        self._files = set()
+        self._globs = []
+        self._dir_globs = []
+        self._state = None
+        self._thread = None
+        self._stopping = threading.Event()
+
+    @property
+    def files(self):
+        """
+        Sorted list of real paths of the watched files.
+        """
+        return sorted(self.conf.sources)
+
+    @property
+    def patterns(self):
+        """
+        List of watched ``[config]`` patterns, without duplicates.
+        """
+        return list(OrderedDict.fromkeys(
+            pattern for pattern, _ in self.conf.patterns))
+
+    @staticmethod
+    def _real_pattern(pattern):
+        """
+        Return the pattern with its leading part without wildcards replaced
+        by its real path, so that it matches the paths of the events.
+        """
+        base, rest = pattern, ''
+        while glob.has_magic(base):
+            base, name = os.path.split(base)
+            rest = os.path.join(name, rest) if rest else name
+        base = os.path.realpath(base)
+        return os.path.join(base, rest) if rest else base
+
+    def _directory_patterns(self):
+        """
+        Return the directory parts of the watched patterns that contain
+        wildcards, along with their parents that also do. For
+        ``fanout/*/x/*.ini``, these are ``fanout/*/x`` and ``fanout/*``.
+        """
+        dirs = []
+        for pattern in self.patterns:
+            path = os.path.dirname(pattern)
+            while glob.has_magic(path):
+                dirs.append(path)
+                path = os.path.dirname(path)
+        return list(OrderedDict.fromkeys(dirs))
+
+    @property
+    def directories(self):
+        """
+        Sorted list of real paths of the directories that contain the watched
+        files or may contain files matching the watched patterns.
+        """
+        dirs = set(os.path.dirname(path) for path in self.conf.sources)
+        for pattern in self.patterns:
+            path = os.path.dirname(pattern)
+            while glob.has_magic(path):
+                path = os.path.dirname(path)
+            dirs.add(os.path.realpath(path))
+        # Existing directories matching the wildcards, in which files may be
+        # added later
+        for pattern in self._directory_patterns():
+            dirs.update(os.path.realpath(path) for path in glob.glob(pattern)
+                        if os.path.isdir(path))
+        return sorted(dirs)
+
+    def _current_state(self):
+        stamps = tuple((path, file_stamp(path)) for path in self.files)
+        matches = tuple((pattern, tuple(expand_path(pattern)))
+                        for pattern in self.patterns)
+        return stamps, matches
+
+    def _update_watches(self):
+        """
+        Add watches for new directories and remove the ones that are no
+        longer needed. Directories that cannot be watched (e.g., they do not
+        exist yet) are skipped; their parent directories are watched anyway.
+        """
+        wanted = set(self.directories)
+        for path in list(self._watches):
+            if path not in wanted:
+                self._inotify.remove(self._watches.pop(path))
+        for path in wanted:
+            if path not in self._watches:
+                try:
+                    self._watches[path] = self._inotify.add(path)
+                except OSError:
+                    pass
+        self._files = set(self.conf.sources)
+        self._globs = []
+        self._dir_globs = [self._real_pattern(pattern)
+                           for pattern in self._directory_patterns()]
+        for pattern in self.patterns:
+            directory, name = os.path.split(pattern)
+            directory = self._real_pattern(directory)
+            if name:
+                self._globs.append(os.path.join(directory, name))
+            else:
+                # Files that may appear in the listing of a directory
+                self._globs.extend(os.path.join(directory, '*' + suffix)
+                                   for suffix in INCLUDE_SUFFIXES)
+
+    def _is_new_directory(self, directory, name, mask):
+        """
+        Return whether the event is about a directory that was added and may
+        contain files matching the watched patterns, and so should be
+        watched.
+        """
+        if directory is None or not name:
+            return False
+        if not mask & IN_ISDIR or not mask & (IN_CREATE | IN_MOVED_TO):
+            return False
+        path = os.path.join(directory, name)
+        return any(fnmatch.fnmatch(path, pattern)
+                   for pattern in self._dir_globs)
+
+    def _is_relevant(self, directory, name, mask):
+        if directory is None or not name:
+            return True
+        if mask & (IN_Q_OVERFLOW | IN_DELETE_SELF | IN_MOVE_SELF):
+            return True
+        path = os.path.join(directory, name)
+        if path in self._files:
+            return True
+        if any(fnmatch.fnmatch(path, pattern) for pattern in self._globs):
+            return True
+        # Files may have been added to the directory before it was watched
+        return self._is_new_directory(directory, name, mask)
+
+    def check(self):
+        """
+        Check the watched files for changes and handle them. Return ``True``
+        if there were any changes. This method is called by the watcher
+        thread, but can also be used to check manually.
+        """
+        state = self._current_state()
+        if state == self._state:
+            return False
+        self._state = state
+        if not self.reload:
+            if self.callback:
+                self.callback(self.conf, None)
+            return True
+        try:
+            diff = self.conf.reload()
+        except Exception as exc:
+            if self.on_error:
+                self.on_error(exc)
+            return True
+        # Reloading may have changed the set of files
+        self._state = self._current_state()
+        if self._inotify is not None:
+            self._update_watches()
+        if diff and self.callback:
+            self.callback(self.conf, diff)
+        return True
+
+    def _run_inotify(self):
+        fds = [self._inotify.fd, self._wake[0]]
+        deadline = None
+        while not self._stopping.is_set():
+            timeout = None
+            if deadline is not None:
+                timeout = max(0, deadline - _monotonic())
+            ready, _, _ = select.select(fds, [], [], timeout)
+            if self._stopping.is_set():
+                break
+            if self._inotify.fd in ready:
+                events = self._inotify.read()
+                if any(self._is_new_directory(*event) for event in events):
+                    # Watch the new directories before files are added to
+                    # them, rather than after the debounce delay
+                    self._update_watches()
+                if any(self._is_relevant(*event) for event in events):
+                    deadline = _monotonic() + self.debounce
+                continue
+            if deadline is not None and _monotonic() >= deadline:
+                deadline = None
+                self.check()
+
+    def _run_polling(self):
+        while not self._stopping.wait(self.interval):
+            state = self._current_state()
+            if state == self._state:
+                continue
+            # Wait for the files to settle before handling the change
+            while not self._stopping.wait(self.debounce):
+                settled = self._current_state()
+                if settled == state:
+                    break
+                state = settled
+            if not self._stopping.is_set():
+                self.check()
+
+    def start(self):
+        """
+        Start watching in a daemon thread.
+        """
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._state = self._current_state()
+        if self.use_inotify:
+            try:
+                self._inotify = Inotify()
+            except OSError:
+                self._inotify = None
+        if self._inotify is not None:
+            self._wake = os.pipe()
+            self._update_watches()
+            target = self._run_inotify
+        else:
+            target = self._run_polling
+        self._thread = threading.Thread(target=target)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop watching and wait for the watcher thread to finish.
+        """
+        if self._thread is None:
+            return
+        self._stopping.set()
+        if self._wake is not None:
+            os.write(self._wake[1], b'x')
+        self._thread.join()
+        self._thread = None
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+            for fd in self._wake:
+                os.close(fd)
+            self._wake = None
+            self._watches = {}
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def __enter__(self):
+        self.start()
         return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class AtomicConf(object):
+    """
+    Holder of the current generation of a configuration that is read by many
+    threads while it is being reloaded. Each generation is a
+    :py:class:`~FrozenConf` that is built in full before it is published
+    with a single attribute assignment, so readers never take a lock and
+    never see a half-applied configuration.
+
+    Readers look values up in the ``current`` generation. A reader that needs
+    a consistent view of the configuration for the length of a request keeps
+    a reference to the generation it started with::
+
+        conf = holder.current
+        timeout = conf['app.timeout']
+        retries = conf['app.retries']
+
+    Old generations are released as soon as neither the holder nor any of the
+    readers refers to them. The ``generation`` attribute is the number of the
+    current generation, starting at 1.
+
+    The first generation is made of the ``conf`` mapping, as with
+    :py:meth:`~AtomicConf.publish`. Writers are serialized by a lock that
+    readers never take.
+    """
+
+    def __init__(self, conf):
+        self.conf = None
+        self.current = None
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._generations = weakref.WeakValueDictionary()
+        self.publish(conf)
+
+    def __getitem__(self, key):
+        return self.current[key]
+
+    def get(self, key, default=None):
+        return self.current.get(key, default)
+
+    @property
+    def live(self):
+        """
+        Sorted list of the numbers of the generations that are still referenced
+        by the holder or by readers.
+        """
+        return sorted(self._generations.keys())
+
+    def _publish(self, frozen):
+        self._generations[self.generation + 1] = frozen
+        self.current = frozen
+        self.generation += 1
+
+    def publish(self, conf):
+        """
+        Publish the ``conf`` mapping as the next generation, and return the
+        published :py:class:`~FrozenConf`. :py:class:`~ConfDict` and
+        :py:class:`~LayeredConf` objects and other mappings are frozen first,
+        while a :py:class:`~FrozenConf` is published as is. A
+        :py:class:`~ConfDict` also becomes the ``conf`` attribute, which is
+        reloaded by :py:meth:`~AtomicConf.reload`, and other objects clear
+        it.
+        """
+        with self._lock:
+            if isinstance(conf, FrozenConf):
+                frozen = conf
+            elif isinstance(conf, (ConfDict, LayeredConf)):
+                frozen = conf.freeze()
+            else:
+                frozen = FrozenConf((key, freeze_value(value))
+                                    for key, value in conf.items())
+            self.conf = conf if isinstance(conf, ConfDict) else None
+            self._publish(frozen)
+        return frozen
+
+    def reload(self):
+        """
+        Reload the ``conf`` attribute using :py:meth:`ConfDict.reload`, and
+        publish the result as the next generation if any of the values
+        changed. Return the :py:class:`~ConfDiff`. If reloading fails, the
+        exception propagates and the current generation remains published.
+        """
+        with self._lock:
+            if self.conf is None:
+                raise ConfigurationError('Only configurations published as '
+                                         'ConfDict objects can be reloaded')
+            diff = self.conf.reload()
+            if diff:
+                self._publish(self.conf.freeze())
+        return diff
@@ -1,8 +1,19 @@
+import gc
+import os
+import copy
+import time
+import pickle
+
 try:
     from unittest import mock
 except ImportError:
     import mock
 
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
 import pytest
 
 import confloader as mod
@@ -87,6 +98,17 @@ def test_parse_size(conf, val):
     ('\nfoo\nbar', ['foo', 'bar']),
     ('\n1\n2', [1, 2]),
     ('\nyes\nno', [True, False]),
+    ('-0.5kb', -512.0),
+    ('1.5 GB', 1610612736.0),
+    ('2B', '2B'),
+    ('12.3456KB', '12.3456KB'),
+    ('12.', '12.'),
+    ('-', '-'),
+    ('1e3', '1e3'),
+    ('yesterday', 'yesterday'),
+    ('nope', 'nope'),
+    ('Falsey', 'Falsey'),
+    ('\n\n12', ['', 12]),
 ])
 def test_clean_value(conf, val):
     assert mod.parse_value(conf) == val
@@ -232,18 +254,20 @@ def test_get_config_paths_no_return(get_option):
 
 
 @mock.patch.object(mod.ConfDict, '_get_config_paths')
-@mock.patch.object(mod.ConfDict, 'from_file')
+@mock.patch.object(mod.ConfDict, '_load_children')
 @mock.patch.object(mod.ConfDict, 'setdefaults')
-def test_preprocess(setdefaults, from_file, get_config_paths):
+def test_preprocess(setdefaults, load_children, get_config_paths):
     conf = get_mock_conf()
     conf.base_path = 'test'
     get_config_paths.side_effect = [['foo/bar/baz.ini'], ['baz/bar/foo.ini']]
+    defl = mock.Mock()
+    load_children.return_value = [defl]
     conf._preprocess()
     # The defaults and includes are set so they can be accessed later
     assert conf.defaults == ['foo/bar/baz.ini']
     assert conf.include == ['baz/bar/foo.ini']
-    from_file.assert_called_once_with('foo/bar/baz.ini', conf.skip_clean)
-    setdefaults.assert_called_once_with(from_file.return_value)
+    load_children.assert_called_once_with(['foo/bar/baz.ini'])
+    setdefaults.assert_called_once_with(defl)
 
 
 @mock.patch.object(mod.ConfDict, 'setdefaults')
@@ -258,9 +282,9 @@ def test_preprocess_no_config_section(setdefaults):
 
 
 @mock.patch.object(mod.ConfDict, '_get_config_paths')
-@mock.patch.object(mod.ConfDict, 'from_file')
+@mock.patch.object(mod.ConfDict, '_load_child')
 @mock.patch.object(mod.ConfDict, 'setdefaults')
-def test_preprocess_no_keys(setdefaults, file_from, get_config_paths):
+def test_preprocess_no_keys(setdefaults, load_child, get_config_paths):
     conf = get_mock_conf()
     # Only includes are provided in config
     get_config_paths.side_effect = [[], ['baz/bar/foo.ini']]
@@ -315,6 +339,19 @@ def test_process_resets_extensions(sections, parse_sections):
     ]
 
 
+def test_track():
+    conf = mod.ConfDict()
+    conf.sources['/a.ini'] = (1, 2)
+    child = mod.ConfDict()
+    child.sources['/a.ini'] = (3, 4)
+    child.sources['/b.ini'] = (5, 6)
+    child.patterns = [('/b*.ini', ['/b.ini'])]
+    conf._track(child)
+    assert list(conf.sources.items()) == [('/a.ini', (1, 2)),
+                                          ('/b.ini', (5, 6))]
+    assert conf.patterns == [('/b*.ini', ['/b.ini'])]
+
+
 def test_extend():
     conf = mod.ConfDict()
     conf['foo'] = [1, 2, 3]
@@ -374,31 +411,51 @@ def test_postprocess_extends(extend):
 
 
 @mock.patch.object(mod.ConfDict, 'update')
-@mock.patch.object(mod.ConfDict, 'from_file')
-def test_postprocess_include(from_file, update):
+@mock.patch.object(mod.ConfDict, '_load_child')
+def test_postprocess_include(load_child, update):
     conf = mod.ConfDict()
     conf.base_path = 'test'
     conf.include = ['foo/bar/baz.ini']
     conf._postprocess()
-    from_file.assert_called_once_with('foo/bar/baz.ini', conf.skip_clean,
-                                      noextend=True)
-    update.assert_called_once_with(from_file.return_value)
+    load_child.assert_called_once_with('foo/bar/baz.ini', noextend=True)
+    update.assert_called_once_with(load_child.return_value)
 
 
 @mock.patch.object(mod.ConfDict, 'update')
-@mock.patch.object(mod.ConfDict, 'from_file')
-def test_postprocess_with_extension_on_include(from_file, update):
+@mock.patch.object(mod.ConfDict, '_load_child')
+def test_postprocess_with_extension_on_include(load_child, update):
     conf = mod.ConfDict()
     conf.include = ['foo/bar/baz.ini']
     conf['foo'] = [1, 2, 3]
     incl = mod.ConfDict()
     incl.noextend = True
     incl._extensions = [('foo', [4, 5, 6])]
-    from_file.return_value = incl
+    load_child.return_value = incl
     conf._postprocess()
     assert conf['foo'] == [1, 2, 3, 4, 5, 6]
 
 
+@mock.patch.object(mod.ConfDict, '_load_child')
+def test_postprocess_extensions_of_many_includes(load_child):
+    conf = mod.ConfDict()
+    conf.include = ['one.ini', 'two.ini', 'three.ini']
+    base = [1]
+    conf['foo'] = base
+    includes = []
+    for values, extensions in (({}, [('foo', [2]), ('bar', [3])]),
+                               ({'bar': 'x'}, [('foo', [4])]),
+                               ({}, [('bar', [5]), ('foo', [6])])):
+        incl = mod.ConfDict(values)
+        incl._extensions = extensions
+        includes.append(incl)
+    load_child.side_effect = includes
+    conf._postprocess()
+    assert conf['foo'] == [1, 2, 4, 6]
+    # The extension from the first file is overwritten by the second one
+    assert conf['bar'] == ['x', 5]
+    assert base == [1]
+
+
 @mock.patch(MOD + '.ConfigParser', specs=mod.ConfigParser)
 def test_init_parser(ConfigParser):
     mock_parser = ConfigParser.return_value
@@ -408,11 +465,13 @@ def test_init_parser(ConfigParser):
     conf._init_parser()
     assert conf.parser == mock_parser
     mock_parser.read.assert_called_once_with('foo/bar/baz.ini')
+    # Missing file is recorded without a stamp
+    path = os.path.realpath('foo/bar/baz.ini')
+    assert conf.sources == {path: None}
 
 
 @mock.patch(MOD + '.ConfigParser', specs=mod.ConfigParser)
 def test_init_parser_with_fd(ConfigParser):
-    from StringIO import StringIO
     mock_parser = ConfigParser.return_value
     conf = mod.ConfDict()
     buff = StringIO()
@@ -451,7 +510,27 @@ def test_from_file(configure, load):
     ret = mod.ConfDict.from_file('foo/bar/baz.ini', False,
                                  defaults=dict(foo='bar'))
     assert ret['foo'] == 'bar'
-    configure.assert_called_once_with('foo/bar/baz.ini', False, False)
+    configure.assert_called_once_with('foo/bar/baz.ini', False, False,
+                                      lazy=False, cache=False, workers=None,
+                                      engine='parser', schema=None,
+                                      stats=False, compact=False,
+                                      lowmem=False)
+    load.assert_called_once_with()
+
+
+@mock.patch.object(mod.ConfDict, 'load')
+@mock.patch.object(mod.ConfDict, 'configure')
+def test_load_child(configure, load):
+    conf = mod.ConfDict()
+    conf.skip_clean = True
+    conf.lazy = True
+    ret = conf._load_child('foo/bar/baz.ini', noextend=True)
+    assert isinstance(ret, mod.ConfDict)
+    configure.assert_called_once_with('foo/bar/baz.ini', True, True,
+                                      lazy=True, cache=False, workers=None,
+                                      engine='parser', schema=None,
+                                      stats=False, compact=False,
+                                      lowmem=False)
     load.assert_called_once_with()
 
 
@@ -464,3 +543,1619 @@ def test_setdefaults():
     })
     assert conf['foo'] == 'bar'
     assert conf['bar'] == 2
+
+
+def test_lazy_value_coerced_on_access():
+    conf = mod.ConfDict()
+    conf.lazy = True
+    dict.update(conf, {'foo': mod.RawValue('12'), 'bar': mod.RawValue('no')})
+    assert conf['foo'] == 12
+    # The coerced value is cached in place
+    assert dict.__getitem__(conf, 'foo') == 12
+    assert type(dict.__getitem__(conf, 'bar')) is mod.RawValue
+    assert conf.get('bar') is False
+    assert conf.get('missing', 'default') == 'default'
+
+
+def test_lazy_value_coerced_on_iteration():
+    conf = mod.ConfDict()
+    conf.lazy = True
+    dict.update(conf, {'foo': mod.RawValue('\n1\n2'), 'bar': 'yes'})
+    assert sorted(conf.items()) == [('bar', 'yes'), ('foo', [1, 2])]
+    assert [1, 2] in list(conf.values())
+
+
+def test_lazy_pop():
+    conf = mod.ConfDict()
+    dict.update(conf, {'foo': mod.RawValue('1.5')})
+    assert conf.pop('foo') == 1.5
+    assert conf.pop('foo', None) is None
+
+
+def test_resolve():
+    conf = mod.ConfDict()
+    dict.update(conf, {'foo': mod.RawValue('1KB'), 'bar': mod.RawValue('x')})
+    conf.resolve()
+    assert dict(conf) == {'foo': 1024.0, 'bar': 'x'}
+    assert type(dict.__getitem__(conf, 'bar')) is str
+
+
+@mock.patch.object(mod.ConfDict, 'get_section')
+def test_parse_section_lazy(get_section):
+    conf = mod.ConfDict()
+    conf.lazy = True
+    get_section.return_value = [('foo', 'bar'), ('bar', '1'), ('+baz', '\n12')]
+    ret = conf._parse_section('foo')
+    assert type(dict.__getitem__(conf, 'foo.bar')) is mod.RawValue
+    assert conf['foo.bar'] == 1
+    # Extensions are still coerced right away
+    assert ret == [('foo.baz', [12])]
+
+
+@pytest.mark.parametrize('val,typecode,ret', [
+    ('\n1\n-2\n30', mod.INT_TYPECODE, [1, -2, 30]),
+    ('\n1.5\n-0.25', 'd', [1.5, -0.25]),
+    ('\n1KB\n2 mb\n1.5GB', 'd', [1024.0, 2097152.0, 1610612736.0]),
+])
+def test_parse_compact(val, typecode, ret):
+    value = mod.parse_compact(val)
+    assert type(value) is mod.CompactList
+    assert value.typecode == typecode
+    assert value == ret
+    assert value.tolist() == mod.parse_value(val)
+
+
+@pytest.mark.parametrize('val', [
+    '\n1\n2.5',
+    '\n1\nfoo',
+    '\n1\n\n2',
+    '\n1\n%d' % 2 ** 70,
+    '12',
+    'foo',
+])
+def test_parse_compact_fallback(val):
+    value = mod.parse_compact(val)
+    assert type(value) is not mod.CompactList
+    assert value == mod.parse_value(val)
+
+
+def test_compact_list_equality():
+    value = mod.CompactList('d', [1.0, 2.0])
+    assert value == [1.0, 2.0]
+    assert [1.0, 2.0] == value
+    assert value == (1.0, 2.0)
+    assert value != [1.0]
+    assert not value != [1.0, 2.0]
+    assert value != 'foo'
+
+
+@pytest.mark.parametrize('values,compact', [
+    ([3, 4], True),
+    (mod.CompactList(mod.INT_TYPECODE, [3, 4]), True),
+    ([3, 4.5], False),
+    ([3, 'foo'], False),
+    ([3, 2 ** 70], False),
+    (mod.CompactList('d', [3.0]), False),
+])
+def test_extend_compact_list(values, compact):
+    d = {'foo': mod.CompactList(mod.INT_TYPECODE, [1, 2])}
+    mod.extend_key(d, 'foo', values)
+    assert (type(d['foo']) is mod.CompactList) == compact
+    assert d['foo'] == [1, 2] + list(values)
+
+
+def test_compact_load(tmpdir):
+    tmpdir.join('defaults.ini').write('[net]\nports =\n    80\n    443\n'
+                                      'ratios =\n    0.5\n    1.5\n')
+    tmpdir.join('include.ini').write('[net]\n+ports =\n    8080\n'
+                                     '+ratios =\n    none\n')
+    main = tmpdir.join('main.ini')
+    main.write('[config]\ndefaults = defaults.ini\ninclude = include.ini\n\n'
+               '[net]\nsizes =\n    1KB\n    2KB\n+ports =\n    22\n')
+    for lazy in (False, True):
+        conf = mod.ConfDict.from_file(str(main), compact=True, lazy=lazy)
+        assert dict(conf.items()) == {
+            'config.defaults': 'defaults.ini',
+            'config.include': 'include.ini',
+            'net.ports': [80, 443, 22, 8080],
+            'net.ratios': [0.5, 1.5, None],
+            'net.sizes': [1024.0, 2048.0],
+        }
+        assert type(conf['net.ports']) is mod.CompactList
+        assert type(conf['net.ratios']) is list
+        assert type(conf['net.sizes']) is mod.CompactList
+    conf = mod.ConfDict.from_file(str(main))
+    assert type(conf['net.ports']) is list
+
+
+def test_compact_snapshot(tmpdir):
+    main = tmpdir.join('main.ini')
+    main.write('[net]\nports =\n    80\n    443\n')
+    snapshot = str(tmpdir.join('conf.snapshot'))
+    mod.ConfDict.from_file(str(main), compact=True, snapshot=snapshot)
+    with mock.patch.object(mod.ConfDict, 'load') as load:
+        conf = mod.ConfDict.from_file(str(main), compact=True,
+                                      snapshot=snapshot)
+    assert not load.called
+    assert type(conf['net.ports']) is mod.CompactList
+    assert conf['net.ports'] == [80, 443]
+    # Snapshots are made separately for loads without the flag
+    conf = mod.ConfDict.from_file(str(main), snapshot=snapshot)
+    assert type(conf['net.ports']) is list
+
+
+@pytest.mark.parametrize('engine', ['parser', 'stream'])
+def test_lowmem(tmpdir, engine):
+    tmpdir.join('defaults.ini').write('[app]\nname = foo\nport = 80\n')
+    tmpdir.join('include.ini').write('[db]\nhost = localhost\n')
+    main = tmpdir.join('main.ini')
+    main.write('[config]\ndefaults = defaults.ini\ninclude = include.ini\n\n'
+               '[app]\nport = 8080\n')
+    expected = mod.ConfDict.from_file(str(main), engine=engine)
+    conf = mod.ConfDict.from_file(str(main), engine=engine, lowmem=True)
+    assert conf == expected
+    assert type(conf.parser) is mod.SectionIndex
+    child = conf.import_from_file(str(tmpdir.join('include.ini')))
+    assert type(child.parser) is mod.SectionIndex
+    assert conf.sections == expected.sections
+    assert conf.get_section('app') == expected.get_section('app')
+    assert conf.get_option('config', 'include') == 'include.ini'
+    assert conf.get_option('app', 'missing', 1) == 1
+    # The referenced files are not kept for reloads
+    tmpdir.join('include.ini').write('[db]\nhost = remote\n')
+    assert conf.reload() == ([], [], ['db.host'])
+    assert not conf._children
+    assert conf._previous is None
+
+
+def test_lowmem_retained_memory(tmpdir):
+    tracemalloc = pytest.importorskip('tracemalloc')
+    lines = ['[config]', 'defaults = defaults.ini']
+    for i in range(20):
+        lines.append('[section{}]'.format(i))
+        lines.extend('option{} = value {}'.format(j, j) for j in range(50))
+    tmpdir.join('defaults.ini').write('\n'.join(lines[2:]) + '\n')
+    main = tmpdir.join('main.ini')
+    main.write('\n'.join(lines) + '\n')
+    sizes = []
+    for lowmem in (False, True):
+        gc.collect()
+        tracemalloc.start()
+        try:
+            conf = mod.ConfDict.from_file(str(main), lowmem=lowmem)
+            gc.collect()
+            sizes.append(tracemalloc.get_traced_memory()[0])
+        finally:
+            tracemalloc.stop()
+        del conf
+    assert sizes[1] < sizes[0]
+
+
+def test_lowmem_snapshot(tmpdir):
+    main = tmpdir.join('main.ini')
+    main.write('[app]\nport = 8080\n')
+    snapshot = str(tmpdir.join('conf.snapshot'))
+    mod.ConfDict.from_file(str(main), lowmem=True, snapshot=snapshot)
+    with mock.patch.object(mod.ConfDict, 'load') as load:
+        conf = mod.ConfDict.from_file(str(main), lowmem=True,
+                                      snapshot=snapshot)
+    assert not load.called
+    assert type(conf.parser) is mod.SectionIndex
+    assert conf.get_option('app', 'port') == '8080'
+
+
+def test_setdefaults_keeps_raw_values():
+    conf = mod.ConfDict()
+    other = mod.ConfDict()
+    dict.update(other, {'foo': mod.RawValue('1')})
+    conf.setdefaults(other)
+    assert type(dict.__getitem__(other, 'foo')) is mod.RawValue
+    assert conf['foo'] == 1
+
+
+def test_tokenize():
+    lines = StringIO('# comment\n[foo]\nBar = 1\nbaz:\n    a\n\n    b\n'
+                     '    ; comment\n\n[empty]\n[DEFAULT]\nqux = x = y\n')
+    assert list(mod.tokenize(lines)) == [
+        ('foo', None, None),
+        ('foo', 'bar', '1'),
+        ('foo', 'baz', '\na\n\nb'),
+        ('empty', None, None),
+        ('DEFAULT', None, None),
+        ('DEFAULT', 'qux', 'x = y'),
+    ]
+
+
+@pytest.mark.parametrize('text,exc', [
+    ('foo = 1\n', mod.MissingSectionHeaderError),
+    ('[foo]\nbar\n', mod.ParsingError),
+    ('[foo]\n = 1\n', mod.ParsingError),
+])
+def test_tokenize_errors(text, exc):
+    with pytest.raises(exc):
+        list(mod.tokenize(StringIO(text)))
+
+
+@pytest.mark.skipif(mod.DuplicateOptionError is None,
+                    reason='parser is not strict')
+@pytest.mark.parametrize('text', [
+    '[foo]\n[foo]\n',
+    '[foo]\nbar = 1\nBAR = 2\n',
+])
+def test_tokenize_duplicates(text):
+    with pytest.raises((mod.DuplicateSectionError, mod.DuplicateOptionError)):
+        list(mod.tokenize(StringIO(text)))
+
+
+def test_section_index():
+    index = mod.SectionIndex.read(StringIO(
+        '[DEFAULT]\nfoo = 0\nbar = 0\n[one]\nbar = 1\nbaz = 1\n[two]\n'))
+    assert index.sections() == ['one', 'two']
+    assert index.has_section('one')
+    assert not index.has_section('DEFAULT')
+    assert index.items('one') == [('foo', '0'), ('bar', '1'), ('baz', '1')]
+    assert index.items('two') == [('foo', '0'), ('bar', '0')]
+    assert index.get('one', 'BAZ') == '1'
+    assert index.get('two', 'foo') == '0'
+    with pytest.raises(mod.NoOptionError):
+        index.get('two', 'baz')
+    with pytest.raises(mod.NoSectionError):
+        index.items('three')
+
+
+def test_section_index_from_parser(tmpdir):
+    path = tmpdir.join('conf.ini')
+    path.write('[DEFAULT]\nfoo = 0\nbar = 0\n[one]\nbar = 1\nbaz = 1\n'
+               '[two]\nfoo = 0\n')
+    parser = mod.ConfigParser()
+    parser.read(str(path))
+    index = mod.SectionIndex.from_parser(parser)
+    assert index.sections() == parser.sections()
+    assert index.defaults() == parser.defaults()
+    for section in parser.sections():
+        assert index.items(section) == parser.items(section)
+    assert index.get('one', 'FOO') == '0'
+    # Inherited options are not stored again
+    assert index._sections['two'] == ((), ())
+    assert mod.SectionIndex.from_parser(index).items('one') == index.items(
+        'one')
+
+
+def test_section_index_missing_file():
+    index = mod.SectionIndex.read('/this/path/does/not/exist.ini')
+    assert index.sections() == []
+
+
+def test_configure_unknown_engine():
+    conf = mod.ConfDict()
+    with pytest.raises(ValueError):
+        conf.configure('foo.ini', engine='foo')
+
+
+def write_files(tmpdir, files):
+    for name, content in files.items():
+        tmpdir.join(name).write(content, ensure=True)
+    return str(tmpdir.join('main.ini'))
+
+
+SNAPSHOT_FILES = {
+    'main.ini': '[config]\ndefaults = base.ini\ninclude = conf.d/*.ini\n'
+                '[global]\nfoo = 1\n+items =\n    b\n',
+    'base.ini': '[global]\nbar = yes\nitems =\n    a\n',
+    'conf.d/one.ini': '[section]\nbaz = 2KB\n',
+}
+
+
+def test_snapshot_used_when_unchanged(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    snapshot = str(tmpdir.join('conf.snap'))
+    conf = mod.ConfDict.from_file(path, snapshot=snapshot)
+    assert os.path.exists(snapshot)
+    with mock.patch.object(mod.ConfDict, 'load') as load:
+        cached = mod.ConfDict.from_file(path, snapshot=snapshot)
+    assert load.call_count == 0
+    assert cached == conf
+    assert conf['items'] == ['a', 'b']
+    assert conf['section.baz'] == 2048.0
+    assert cached.sources == conf.sources
+    assert cached.get_option('global', 'foo') == '1'
+    assert cached.sections == conf.sections
+
+
+def test_snapshot_lazy(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    snapshot = str(tmpdir.join('conf.snap'))
+    mod.ConfDict.from_file(path, lazy=True, snapshot=snapshot)
+    with mock.patch.object(mod.ConfDict, 'load') as load:
+        conf = mod.ConfDict.from_file(path, lazy=True, snapshot=snapshot)
+    assert load.call_count == 0
+    assert type(dict.__getitem__(conf, 'foo')) is mod.RawValue
+    assert conf['foo'] == 1
+
+
+@pytest.mark.parametrize('change', [
+    {'conf.d/one.ini': '[section]\nbaz = 3KB\n'},
+    {'conf.d/two.ini': '[section]\nbaz = 3KB\n'},
+    {'base.ini': '[global]\nbar = no\nitems =\n    a\n'},
+])
+def test_snapshot_refreshed_on_change(tmpdir, change):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    snapshot = str(tmpdir.join('conf.snap'))
+    mod.ConfDict.from_file(path, snapshot=snapshot)
+    write_files(tmpdir, change)
+    expected = mod.ConfDict.from_file(path)
+    conf = mod.ConfDict.from_file(path, snapshot=snapshot)
+    assert conf == expected
+    # The snapshot is rewritten with the new configuration
+    with mock.patch.object(mod.ConfDict, 'load') as load:
+        cached = mod.ConfDict.from_file(path, snapshot=snapshot)
+    assert load.call_count == 0
+    assert cached == expected
+
+
+def test_snapshot_ignored_with_different_options(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    snapshot = str(tmpdir.join('conf.snap'))
+    mod.ConfDict.from_file(path, snapshot=snapshot)
+    conf = mod.ConfDict.from_file(path, skip_clean=True, snapshot=snapshot)
+    assert conf['foo'] == '1'
+    conf = mod.ConfDict.from_file(path, defaults={'x': 1}, snapshot=snapshot)
+    assert conf['x'] == 1
+
+
+def test_snapshot_corrupted(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    snapshot = tmpdir.join('conf.snap')
+    expected = mod.ConfDict.from_file(path, snapshot=str(snapshot))
+    data = snapshot.read_binary()
+    snapshot.write_binary(data[:-10] + b'\x00' * 10)
+    conf = mod.ConfDict.from_file(path, snapshot=str(snapshot))
+    assert conf == expected
+    snapshot.write_binary(b'garbage')
+    conf = mod.ConfDict.from_file(path, snapshot=str(snapshot))
+    assert conf == expected
+
+
+@mock.patch.object(mod.ConfDict, '_track')
+@mock.patch.object(mod.ConfDict, '_read_child')
+def test_load_children(read_child, track):
+    conf = mod.ConfDict()
+    read_child.side_effect = lambda path, noextend: path.upper()
+    ret = iter(conf._load_children(['a', 'b'], noextend=True))
+    # Each file is loaded only once the previous one has been consumed
+    assert next(ret) == 'A'
+    read_child.assert_called_once_with('a', True)
+    assert list(ret) == ['B']
+    read_child.assert_has_calls([mock.call('a', True), mock.call('b', True)])
+    track.assert_has_calls([mock.call('A'), mock.call('B')])
+
+
+@pytest.mark.skipif(mod._futures() is None,
+                    reason='concurrent.futures not available')
+@mock.patch.object(mod.ConfDict, '_track')
+@mock.patch.object(mod.ConfDict, '_read_child')
+def test_load_children_parallel(read_child, track):
+    conf = mod.ConfDict()
+    conf.workers = 4
+    paths = ['path{}'.format(i) for i in range(20)]
+    read_child.side_effect = lambda path, noextend, pooled: path.upper()
+    ret = conf._load_children(paths, noextend=True)
+    assert ret == [p.upper() for p in paths]
+    # Results are tracked in the original order
+    track.assert_has_calls([mock.call(p.upper()) for p in paths])
+    assert all(c[1]['pooled'] for c in read_child.call_args_list)
+
+
+@mock.patch.object(mod.ConfDict, 'load')
+@mock.patch.object(mod.ConfDict, 'configure')
+def test_read_child_pooled(configure, load):
+    conf = mod.ConfDict()
+    conf.workers = 4
+    conf._read_child('foo/bar/baz.ini', pooled=True)
+    # Files loaded in a pool do not start pools of their own
+    assert configure.call_args[1]['workers'] is None
+
+
+def test_clone():
+    conf = mod.ConfDict(foo=[1, 2], bar='baz')
+    conf.include = ['foo.ini']
+    conf.parser = mock.Mock()
+    clone = conf._clone()
+    assert type(clone) is mod.ConfDict
+    assert clone == conf
+    assert clone['foo'] is not conf['foo']
+    assert clone.include == conf.include
+    assert clone.include is not conf.include
+    assert clone.parser is conf.parser
+
+
+def test_is_stale(tmpdir):
+    path = write_files(tmpdir, {'main.ini': '[global]\nfoo = 1\n'})
+    conf = mod.ConfDict.from_file(path)
+    assert not conf.is_stale()
+    write_files(tmpdir, {'main.ini': '[global]\nfoo = 12\n'})
+    assert conf.is_stale()
+
+
+def test_is_stale_pattern(tmpdir):
+    conf = mod.ConfDict()
+    pattern = str(tmpdir.join('*.ini'))
+    conf.patterns = [(pattern, [])]
+    assert not conf.is_stale()
+    write_files(tmpdir, {'main.ini': '[global]\nfoo = 1\n'})
+    assert conf.is_stale()
+
+
+def test_parse_cache_lru():
+    cache = mod.ParseCache(maxsize=2)
+    for key in 'abc':
+        cache.put(key, mod.ConfDict(key=key))
+    assert cache.keys() == ['b', 'c']
+    assert cache.get('a') is None
+    assert cache.get('b') == {'key': 'b'}
+    # 'b' is now the most recently used entry
+    cache.put('d', mod.ConfDict(key='d'))
+    assert cache.keys() == ['b', 'd']
+    assert cache.info() == mod.CacheInfo(hits=1, misses=1, maxsize=2,
+                                         currsize=2)
+    cache.clear()
+    assert cache.info() == mod.CacheInfo(0, 0, 2, 0)
+
+
+def test_parse_cache_copies():
+    cache = mod.ParseCache()
+    conf = mod.ConfDict(foo=[1, 2])
+    cache.put('a', conf)
+    conf['foo'].append(3)
+    first = cache.get('a')
+    first['foo'].append(4)
+    assert cache.get('a')['foo'] == [1, 2]
+
+
+@mock.patch.object(mod.ConfDict, 'is_stale')
+def test_parse_cache_stale(is_stale):
+    cache = mod.ParseCache()
+    cache.put('a', mod.ConfDict())
+    is_stale.return_value = True
+    assert cache.get('a') is None
+    assert cache.keys() == []
+    assert cache.info().misses == 1
+
+
+def test_shared_files_cached(tmpdir):
+    files = dict(SNAPSHOT_FILES)
+    files['other.ini'] = '[config]\ndefaults = base.ini\n[global]\nfoo = 2\n'
+    path = write_files(tmpdir, files)
+    mod.parse_cache.clear()
+    try:
+        conf = mod.ConfDict.from_file(path, cache=True)
+        other = mod.ConfDict.from_file(str(tmpdir.join('other.ini')),
+                                       cache=True)
+        info = mod.parse_cache.info()
+        assert (info.hits, info.misses) == (1, 2)
+        assert conf['items'] == ['a', 'b']
+        assert other['items'] == ['a']
+        assert other['bar'] is True
+        # Changes to base files are picked up
+        write_files(tmpdir, {'base.ini': '[global]\nbar = no\n'})
+        other = mod.ConfDict.from_file(str(tmpdir.join('other.ini')),
+                                       cache=True)
+        assert other['bar'] is False
+    finally:
+        mod.parse_cache.clear()
+
+
+def test_parallel_load_matches_serial(tmpdir):
+    files = dict(SNAPSHOT_FILES)
+    for i in range(20):
+        files['conf.d/frag{:02}.ini'.format(i)] = (
+            '[section]\nbaz = {}\n+list = \n    {}\n'.format(i, i))
+    path = write_files(tmpdir, files)
+    expected = mod.ConfDict.from_file(path)
+    conf = mod.ConfDict.from_file(path, workers=8)
+    assert conf == expected
+    assert list(conf.sources) == list(expected.sources)
+
+
+def test_conf_diff():
+    old = {'a': 1, 'b': mod.RawValue('2'), 'c': True, 'd': 'x'}
+    new = {'b': 2, 'c': 1, 'd': mod.RawValue('x'), 'e': None}
+    diff = mod.ConfDiff.between(old, new)
+    assert diff == (['e'], ['a'], ['c'])
+    assert diff
+    assert not mod.ConfDiff.between(old, old)
+
+
+def record_reads():
+    read = mod.ConfigParser.read
+    reads = []
+
+    def wrapper(parser, path, *args, **kwargs):
+        reads.append(os.path.basename(path))
+        return read(parser, path, *args, **kwargs)
+    return mock.patch.object(mod.ConfigParser, 'read', wrapper), reads
+
+
+def test_reload_unchanged(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    conf = mod.ConfDict.from_file(path)
+    patcher, reads = record_reads()
+    with patcher:
+        diff = conf.reload()
+    assert not diff
+    assert reads == []
+
+
+def test_reload_reads_changed_files_only(tmpdir):
+    files = dict(SNAPSHOT_FILES)
+    files['conf.d/two.ini'] = '[other]\nfoo = 1\n'
+    path = write_files(tmpdir, files)
+    conf = mod.ConfDict.from_file(path)
+    # Referenced files are only kept once the configuration is reloaded
+    assert not conf._children
+    write_files(tmpdir, {'conf.d/two.ini': '[other]\nfoo = 2\n'})
+    patcher, reads = record_reads()
+    with patcher:
+        conf.reload()
+    # The parser of the file itself is always kept
+    assert sorted(reads) == ['base.ini', 'one.ini', 'two.ini']
+    write_files(tmpdir, {
+        'conf.d/one.ini': '[section]\nbaz = 3KB\nnew = yes\n'
+                          '[global]\n+items =\n    c\n',
+    })
+    patcher, reads = record_reads()
+    with patcher:
+        diff = conf.reload()
+    assert reads == ['one.ini']
+    assert diff == (['section.new'], [], ['items', 'section.baz'])
+    assert conf == mod.ConfDict.from_file(path)
+    assert conf['items'] == ['a', 'b', 'c']
+
+
+def test_reload_new_and_removed_files(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    conf = mod.ConfDict.from_file(path, defaults={'initial': 1})
+    conf['runtime'] = 1
+    tmpdir.join('conf.d', 'one.ini').remove()
+    write_files(tmpdir, {'conf.d/three.ini': '[three]\nfoo = 1\n'})
+    diff = conf.reload()
+    assert diff == (['three.foo'], ['runtime', 'section.baz'], [])
+    assert conf['initial'] == 1
+    assert [os.path.basename(p) for p in conf.sources] == [
+        'main.ini', 'base.ini', 'three.ini']
+
+
+def test_reload_lazy(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    conf = mod.ConfDict.from_file(path, lazy=True)
+    assert conf['foo'] == 1
+    write_files(tmpdir, {'base.ini': '[global]\nbar = yes\nitems =\n    z\n'})
+    diff = conf.reload()
+    assert diff == ([], [], ['items'])
+    assert conf.lazy
+    assert conf['items'] == ['z', 'b']
+
+
+def test_reload_file_object():
+    conf = mod.ConfDict()
+    conf.path = StringIO()
+    with pytest.raises(mod.ConfigurationError):
+        conf.reload()
+
+
+def wait_for(event, timeout=5):
+    assert event.wait(timeout), 'timed out waiting for the watcher'
+
+
+def test_watcher_directories(tmpdir):
+    files = dict(SNAPSHOT_FILES)
+    files['conf.d/two.ini'] = '[other]\nfoo = 1\n'
+    path = write_files(tmpdir, files)
+    conf = mod.ConfDict.from_file(path)
+    watcher = mod.ConfigWatcher(conf)
+    root = os.path.realpath(str(tmpdir))
+    assert watcher.directories == [root, os.path.join(root, 'conf.d')]
+    assert len(watcher.files) == 4
+    assert watcher.patterns == [str(tmpdir.join('base.ini')),
+                                str(tmpdir.join('conf.d', '*.ini'))]
+
+
+def test_watcher_check(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    conf = mod.ConfDict.from_file(path)
+    callback = mock.Mock()
+    watcher = mod.ConfigWatcher(conf, callback)
+    watcher._state = watcher._current_state()
+    assert not watcher.check()
+    write_files(tmpdir, {'conf.d/two.ini': '[other]\nfoo = 1\n'})
+    assert watcher.check()
+    callback.assert_called_once_with(conf, (['other.foo'], [], []))
+    assert conf['other.foo'] == 1
+    assert not watcher.check()
+
+
+def test_watcher_check_without_reload(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    conf = mod.ConfDict.from_file(path)
+    callback = mock.Mock()
+    watcher = mod.ConfigWatcher(conf, callback, reload=False)
+    watcher._state = watcher._current_state()
+    write_files(tmpdir, {'base.ini': '[global]\nbar = no\n'})
+    assert watcher.check()
+    callback.assert_called_once_with(conf, None)
+    assert conf['bar'] is True
+
+
+def test_watcher_reload_error(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    conf = mod.ConfDict.from_file(path)
+    on_error = mock.Mock()
+    watcher = mod.ConfigWatcher(conf, on_error=on_error)
+    watcher._state = watcher._current_state()
+    write_files(tmpdir, {'main.ini': ''})
+    assert watcher.check()
+    assert isinstance(on_error.call_args[0][0], mod.ConfigurationError)
+    assert conf['foo'] == 1
+
+
+FANOUT_FILES = {
+    'main.ini': '[config]\ninclude = fanout/*/*.ini\n[global]\nfoo = 1\n',
+    'fanout/a/one.ini': '[one]\nfoo = 1\n',
+}
+
+
+def test_watcher_new_directory(tmpdir):
+    path = write_files(tmpdir, FANOUT_FILES)
+    conf = mod.ConfDict.from_file(path)
+    watcher = mod.ConfigWatcher(conf)
+    root = os.path.realpath(str(tmpdir))
+    fanout = os.path.join(root, 'fanout')
+    assert watcher.directories == [root, fanout, os.path.join(fanout, 'a')]
+    watcher._inotify = mock.Mock()
+    watcher._update_watches()
+    tmpdir.join('fanout', 'b').ensure(dir=True)
+    created = mod.IN_CREATE | mod.IN_ISDIR
+    assert watcher._is_new_directory(fanout, 'b', created)
+    assert watcher._is_relevant(fanout, 'b', created)
+    assert not watcher._is_new_directory(fanout, 'b', mod.IN_CREATE)
+    assert not watcher._is_new_directory(root, 'b', created)
+    watcher._update_watches()
+    assert os.path.join(fanout, 'b') in watcher._watches
+    assert watcher._is_relevant(os.path.join(fanout, 'b'), 'two.ini', 0)
+
+
+@pytest.mark.skipif(not mod.sys.platform.startswith('linux'),
+                    reason='requires Linux')
+def test_watcher_thread_new_directory(tmpdir):
+    path = write_files(tmpdir, FANOUT_FILES)
+    conf = mod.ConfDict.from_file(path)
+    changed = mod.threading.Event()
+    diffs = []
+
+    def callback(conf, diff):
+        diffs.append(diff)
+        changed.set()
+
+    with conf.watch(callback, debounce=0.05, inotify=True):
+        write_files(tmpdir, {'fanout/b/two.ini': '[two]\nfoo = 1\n'})
+        wait_for(changed)
+        changed.clear()
+        # The file is added after the new directory has been handled
+        tmpdir.join('fanout', 'c').ensure(dir=True)
+        time.sleep(0.2)
+        write_files(tmpdir, {'fanout/c/three.ini': '[three]\nfoo = 1\n'})
+        wait_for(changed)
+    assert diffs == [(['two.foo'], [], []), (['three.foo'], [], [])]
+
+
+@pytest.mark.parametrize('inotify', [
+    False,
+    pytest.param(True, marks=pytest.mark.skipif(
+        not mod.sys.platform.startswith('linux'), reason='requires Linux')),
+])
+def test_watcher_thread(tmpdir, inotify):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    conf = mod.ConfDict.from_file(path)
+    changed = mod.threading.Event()
+    diffs = []
+
+    def callback(conf, diff):
+        diffs.append(diff)
+        changed.set()
+
+    with conf.watch(callback, debounce=0.05, interval=0.05,
+                    inotify=inotify) as watcher:
+        assert watcher.running
+        assert (watcher._inotify is not None) == inotify
+        write_files(tmpdir, {'conf.d/two.ini': '[other]\nfoo = 1\n'})
+        wait_for(changed)
+        changed.clear()
+        write_files(tmpdir, {'base.ini': '[global]\nbar = no\n'})
+        wait_for(changed)
+    assert not watcher.running
+    assert diffs == [(['other.foo'], [], []), ([], [], ['bar', 'items'])]
+
+
+def test_stream_engine(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    expected = mod.ConfDict.from_file(path)
+    conf = mod.ConfDict.from_file(path, engine='stream')
+    assert conf == expected
+    assert isinstance(conf.parser, mod.SectionIndex)
+    assert conf.get_option('global', 'foo') == '1'
+    assert conf.get_option('global', 'missing', 2) == 2
+    # Referenced files are parsed with the same engine
+    base = conf.import_from_file(str(tmpdir.join('base.ini')))
+    assert isinstance(base.parser, mod.SectionIndex)
+
+
+def test_stream_engine_snapshot(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    snapshot = str(tmpdir.join('conf.snap'))
+    conf = mod.ConfDict.from_file(path, snapshot=snapshot, engine='stream')
+    with mock.patch.object(mod.ConfDict, 'load') as load:
+        cached = mod.ConfDict.from_file(path, snapshot=snapshot,
+                                        engine='stream')
+    assert load.call_count == 0
+    assert cached == conf
+    assert isinstance(cached.parser, mod.SectionIndex)
+    assert cached.get_section('global') == [('foo', '1'), ('+items', '\nb')]
+
+
+MMAP_FILES = {
+    'main.ini': '[config]\ndefaults = base.ini\ninclude = extra.ini\n'
+                '[global]\nfoo = 1\n[one]\na = 1\n+items =\n    y\n'
+                '[two]\nb = 2KB\n[three]\nc = yes\n',
+    'base.ini': '[one]\nitems =\n    x\n[two]\nb = 1\nd = 4\n',
+    'extra.ini': '[three]\nc = no\n',
+}
+
+
+def test_mmap_engine(tmpdir):
+    path = write_files(tmpdir, MMAP_FILES)
+    expected = mod.ConfDict.from_file(path)
+    conf = mod.ConfDict.from_file(path, engine='mmap')
+    assert isinstance(conf.parser, mod.MappedSectionIndex)
+    # Sections touched by includes are loaded right away
+    assert conf._pending == set(['one', 'two'])
+    assert conf['foo'] == 1
+    assert conf['one.items'] == ['x', 'y']
+    assert conf._pending == set(['two'])
+    # Values from the defaults do not hide the values of the section
+    assert conf['two.b'] == 2048.0
+    assert conf['three.c'] is False
+    assert not conf._pending
+    assert conf == expected
+
+
+def test_mmap_engine_resolve(tmpdir):
+    path = write_files(tmpdir, MMAP_FILES)
+    expected = mod.ConfDict.from_file(path)
+    conf = mod.ConfDict.from_file(path, engine='mmap')
+    assert dict(conf.items()) == expected
+    assert conf.get_section('two') == expected.get_section('two')
+    assert conf.sections == expected.sections
+
+
+def test_mmap_engine_keeps_changes(tmpdir):
+    path = write_files(tmpdir, MMAP_FILES)
+    conf = mod.ConfDict.from_file(path, engine='mmap')
+    conf['two.b'] = 3
+    assert 'one.a' in conf
+    assert conf.get('two.d') == 4
+    assert conf['two.b'] == 3
+
+
+def test_mmap_engine_whole_dict(tmpdir):
+    path = write_files(tmpdir, MMAP_FILES)
+    expected = mod.ConfDict.from_file(path)
+    conf = mod.ConfDict.from_file(path, engine='mmap')
+    assert len(conf) == len(expected)
+    assert not conf._pending
+    conf = mod.ConfDict.from_file(path, engine='mmap')
+    assert sorted(conf.keys()) == sorted(expected)
+    conf = mod.ConfDict.from_file(path, engine='mmap')
+    assert conf == mod.ConfDict.from_file(path, engine='mmap')
+    assert expected == conf
+    assert not conf != expected
+    conf = mod.ConfDict.from_file(path, engine='mmap')
+    assert dict(conf) == expected
+
+
+def test_mmap_engine_class(tmpdir):
+    class MyConf(mod.ConfDict):
+        pass
+
+    path = write_files(tmpdir, MMAP_FILES)
+    conf = mod.ConfDict.from_file(path, engine='mmap')
+    assert type(conf) is mod.MappedConfDict
+    # Plain objects use the methods of dict for lookups
+    assert mod.ConfDict.__contains__ is dict.__contains__
+    mine = MyConf.from_file(path, engine='mmap')
+    assert isinstance(mine, MyConf)
+    assert isinstance(mine, mod.MappedConfDict)
+    assert type(MyConf.from_file(path, engine='mmap')) is type(mine)
+    assert type(MyConf.from_file(path)) is MyConf
+    child = mine.import_from_file(str(tmpdir.join('base.ini')))
+    assert type(child) is MyConf
+
+
+def test_mmap_engine_reload(tmpdir):
+    path = write_files(tmpdir, MMAP_FILES)
+    conf = mod.ConfDict.from_file(path, engine='mmap')
+    assert conf['two.b'] == 2048.0
+    files = dict(MMAP_FILES)
+    files['main.ini'] = files['main.ini'].replace('2KB', '3KB').replace(
+        'a = 1', 'a = 2')
+    write_files(tmpdir, files)
+    # Sections that have not been loaded are not compared
+    assert conf.reload() == ([], [], ['two.b'])
+    assert conf._pending == set(['one'])
+    assert conf['two.b'] == 3072.0
+    assert conf['one.a'] == 2
+
+
+def test_mmap_engine_changed_file(tmpdir):
+    path = write_files(tmpdir, MMAP_FILES)
+    conf = mod.ConfDict.from_file(path, engine='mmap')
+    write_files(tmpdir, {'main.ini': '[one]\na = 2\n'})
+    with pytest.raises(mod.ConfigurationError):
+        conf['one.a']
+    # The section is still pending, and is loaded from the new file
+    assert 'one' in conf._pending
+    diff = conf.reload()
+    assert diff.added == [] and 'foo' in diff.removed
+    assert conf['one.a'] == 2
+
+
+def test_mmap_engine_threads(tmpdir):
+    path = tmpdir.join('main.ini')
+    path.write('[global]\nfoo = 1\n[big]\n' + ''.join(
+        'k{} = {}\n'.format(i, i) for i in range(20000)))
+    conf = mod.ConfDict.from_file(str(path), engine='mmap')
+    errors = []
+    start = mod.threading.Event()
+
+    def read(key):
+        start.wait()
+        try:
+            conf[key]
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [mod.threading.Thread(target=read, args=('big.k0',)),
+               mod.threading.Thread(target=read, args=('big.k19999',))]
+    for thread in threads:
+        thread.start()
+    start.set()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert not conf._pending
+
+
+def test_mapped_section_index(tmpdir):
+    path = tmpdir.join('main.ini')
+    path.write('; comment\n[DEFAULT]\nx = 0\n[one]\na = 1\n  [b]\n'
+               '[two]\n  [three]\nb = 2\n')
+    index = mod.MappedSectionIndex(str(path))
+    assert index.sections() == ['one', 'two']
+    assert index._sections['one'] is None
+    assert index.items('one') == [('x', '0'), ('a', '1\n[b]')]
+    # Indented section headers are not indexed
+    with pytest.raises(mod.ConfigurationError):
+        index.get('two', 'b')
+
+
+def test_mapped_section_index_empty(tmpdir):
+    path = tmpdir.join('main.ini')
+    path.write('')
+    assert mod.MappedSectionIndex(str(path)).sections() == []
+    with pytest.raises(mod.MissingSectionHeaderError):
+        path.write('foo = 1\n[one]\n')
+        mod.MappedSectionIndex(str(path))
+
+
+def test_key_index():
+    index = mod.KeyIndex(['foo', 'a.b', 'a.c.d', 'x.d'])
+    assert list(index.prefixed('')) == ['foo']
+    assert list(index.prefixed('a')) == ['a.b', 'a.c.d']
+    assert list(index.prefixed('a.c')) == ['a.c.d']
+    assert list(index.candidates('*.d')) == ['a.c.d', 'x.d']
+    assert list(index.candidates('a.c.*')) == ['a.c.d']
+    assert sorted(index.candidates('*')) == ['a.b', 'a.c.d', 'foo', 'x.d']
+    index.discard('a.c.d')
+    assert list(index.prefixed('a')) == ['a.b']
+    assert 'a.c' not in index.prefixes
+    assert list(index.candidates('*.d')) == ['x.d']
+
+
+def test_section_view():
+    conf = mod.ConfDict({'foo': 1, 'db.b': 2, 'db.c.d': mod.RawValue('3'),
+                         'x.d': 4})
+    view = conf.section('db')
+    assert dict(view) == {'b': 2, 'c.d': 3}
+    assert conf.section('db.c')['d'] == 3
+    assert dict(conf.section('global')) == {'foo': 1}
+    assert 'c.d' in view
+    assert 'd' not in view
+    with pytest.raises(KeyError):
+        view['d']
+    conf['db.e'] = 5
+    conf.update({'db.f': 6})
+    conf.setdefaults({'db.g': 7})
+    del conf['db.b']
+    conf.pop('db.c.d')
+    assert dict(view) == {'e': 5, 'f': 6, 'g': 7}
+    merged = conf
+    conf |= {'db.h': 8}
+    assert conf is merged
+    assert dict(view) == {'e': 5, 'f': 6, 'g': 7, 'h': 8}
+    assert conf.match('db.h') == {'db.h': 8}
+    conf.clear()
+    assert len(view) == 0
+
+
+def test_match():
+    conf = mod.ConfDict({'timeout': 1, 'db.timeout': 2, 'db.host': 'x',
+                         'web.timeout': mod.RawValue('3')})
+    assert conf.match('*.timeout') == {'db.timeout': 2, 'web.timeout': 3}
+    assert conf.match('db.*') == {'db.timeout': 2, 'db.host': 'x'}
+    assert conf.match('*timeout') == {'timeout': 1, 'db.timeout': 2,
+                                      'web.timeout': 3}
+    conf['cache.timeout'] = 4
+    assert conf.match('*.timeout')['cache.timeout'] == 4
+
+
+def test_section_view_import_and_reload(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    conf = mod.ConfDict.from_file(path)
+    view = conf.section('section')
+    assert dict(view) == {'baz': 2048.0}
+    write_files(tmpdir, {'extra.ini': '[section]\nqux = 1\n'})
+    conf.import_from_file(str(tmpdir.join('extra.ini')))
+    assert dict(view) == {'baz': 2048.0, 'qux': 1}
+    write_files(tmpdir, {'conf.d/one.ini': '[section]\nbaz = 3KB\nnew = 2\n'})
+    conf.reload()
+    assert dict(view) == {'baz': 3072.0, 'new': 2}
+
+
+def test_section_view_mmap_engine(tmpdir):
+    path = write_files(tmpdir, MMAP_FILES)
+    conf = mod.ConfDict.from_file(path, engine='mmap')
+    assert dict(conf.section('two')) == {'b': 2048.0, 'd': 4}
+    assert conf._pending == set(['one'])
+    assert conf.match('*.a') == {'one.a': 1}
+    assert not conf._pending
+
+
+def test_shared_conf_encode():
+    conf = mod.ConfDict({'foo': 1, 'bar.baz': [1, 'a'], 'none': None,
+                         'lazy': mod.RawValue('2KB')})
+    conf.lazy = True
+    shared = mod.SharedConf(mod.SharedConf.encode(conf))
+    assert shared == {'foo': 1, 'bar.baz': [1, 'a'], 'none': None,
+                      'lazy': 2048.0}
+    assert shared['bar.baz'] == [1, 'a']
+    assert shared.get('missing', 2) == 2
+    assert 'none' in shared
+    assert 'missing' not in shared
+    assert len(shared) == 4
+    assert shared.generation == 1
+    with pytest.raises(mod.ConfigurationFormatError):
+        shared['missing']
+
+
+def test_shared_conf_many_keys():
+    data = dict(('key{}'.format(i), i) for i in range(1000))
+    shared = mod.SharedConf(mod.SharedConf.encode(data))
+    assert all(shared[key] == value for key, value in data.items())
+    assert sorted(shared) == sorted(data)
+
+
+def test_shared_conf_errors():
+    with pytest.raises(ValueError):
+        mod.SharedConf(b'x' * 32)
+    with pytest.raises(ValueError):
+        mod.SharedConf.encode({'foo': object()})
+
+
+def test_publish(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    target = str(tmpdir.join('conf.shared'))
+    conf = mod.ConfDict.from_file(path)
+    assert conf.publish(target) == 1
+    shared = mod.SharedConf.open(target)
+    assert shared == conf
+    assert not shared.refresh()
+    write_files(tmpdir, {'base.ini': '[global]\nbar = no\nitems =\n    a\n'})
+    conf.reload()
+    assert conf.publish(target) == 2
+    # Readers keep the previous generation until refreshed
+    assert shared['bar'] is True
+    assert shared.refresh()
+    assert shared.generation == 2
+    assert shared['bar'] is False
+
+
+def test_shared_conf_shared_memory():
+    shared_memory = pytest.importorskip('multiprocessing.shared_memory')
+    data = mod.SharedConf.encode({'foo': 1})
+    block = shared_memory.SharedMemory(create=True, size=len(data))
+    try:
+        block.buf[:len(data)] = data
+        shared = mod.SharedConf(block.buf)
+        assert shared['foo'] == 1
+        assert list(shared) == ['foo']
+        del shared
+    finally:
+        block.close()
+        block.unlink()
+
+
+def test_option_compile():
+    assert mod.Option(int).compile()('12') == 12
+    assert mod.Option(str).compile()('12') == '12'
+    assert mod.Option().compile()('12') == 12
+    assert mod.Option(bool).compile()('Yes') is True
+    assert mod.Option(mod.parse_size).compile()('2KB') == 2048
+    assert mod.Option(list).compile()('\n1\n2') == ['1', '2']
+    assert mod.Option(list, item=int).compile()('\n1\n2') == [1, 2]
+    assert mod.Option(list, item=bool).compile()('no') == [False]
+    with pytest.raises(ValueError):
+        mod.Option(bool).compile()('1')
+    with pytest.raises(ValueError):
+        mod.Option(int, default=1, required=True)
+
+
+def test_schema():
+    schema = mod.Schema({'foo': int, 'a.b.c': mod.Option(default=1),
+                         'bar': mod.Option(str, required=True)})
+    assert schema.defaults == {'a.b.c': 1}
+    assert schema.required == frozenset(['bar'])
+    assert schema.sections == frozenset(['a', 'a.b'])
+    errors = []
+    assert schema.convert('foo', '1', errors) == 1
+    assert schema.convert('foo', 'x', errors) == 'x'
+    assert errors == ["'foo': invalid int value 'x'"]
+    assert schema.check({'foo': 1}) == ["'bar': required option is missing"]
+
+
+SCHEMA = mod.Schema({
+    'foo': str,
+    'bar': bool,
+    'items': mod.Option(list, item=str),
+    'section.baz': mod.parse_size,
+    'section.qux': mod.Option(int, default=5),
+})
+
+
+def test_from_file_schema(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    conf = mod.ConfDict.from_file(path, schema=SCHEMA, lazy=True)
+    # Declared options are converted right away, and by their type
+    assert dict.__getitem__(conf, 'foo') == '1'
+    assert conf['items'] == ['a', 'b']
+    assert conf['section.baz'] == 2048
+    assert conf['section.qux'] == 5
+
+
+@pytest.mark.parametrize('cls', [mod.ConfDict, mod.LayeredConf])
+@pytest.mark.parametrize('engine', ['parser', 'mmap'])
+def test_schema_defaults_after_load(tmpdir, cls, engine):
+    path = write_files(tmpdir, {
+        'main.ini': '[config]\ndefaults = base.ini\n[server]\nhost = x\n',
+        'base.ini': '[server]\nport = 8080\n',
+    })
+    schema = mod.Schema({'server.port': mod.Option(int, default=80),
+                         'server.timeout': mod.Option(int, default=30)})
+    conf = cls.from_file(path, schema=schema, engine=engine)
+    # The defaults files take precedence over the schema defaults
+    assert conf['server.port'] == 8080
+    assert conf['server.timeout'] == 30
+    conf = cls.from_file(path, schema=schema, engine=engine,
+                         defaults={'server.timeout': 60})
+    assert conf['server.timeout'] == 60
+
+
+def test_schema_defaults_reload(tmpdir):
+    path = write_files(tmpdir, {
+        'main.ini': '[config]\ndefaults = base.ini\n[server]\nhost = x\n',
+        'base.ini': '[server]\nport = 8080\n',
+    })
+    schema = mod.Schema({'server.port': mod.Option(int, default=80)})
+    conf = mod.ConfDict.from_file(path, schema=schema)
+    assert conf._initial == {}
+    write_files(tmpdir, {'base.ini': '[server]\nother = 1\n'})
+    assert conf.reload() == (['server.other'], [], ['server.port'])
+    assert conf['server.port'] == 80
+
+
+def test_from_file_schema_errors(tmpdir):
+    files = dict(SNAPSHOT_FILES)
+    files['conf.d/one.ini'] = '[section]\nbaz = 2XB\nqux = many\n'
+    path = write_files(tmpdir, files)
+    schema = mod.Schema(dict(SCHEMA.options, required=mod.Option(
+        required=True)))
+    with pytest.raises(mod.SchemaError) as exc:
+        mod.ConfDict.from_file(path, schema=schema)
+    assert exc.value.errors == [
+        "'section.baz': invalid size value '2XB'",
+        "'section.qux': invalid int value 'many'",
+        "'required': required option is missing",
+    ]
+
+
+def test_reload_schema_error(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    conf = mod.ConfDict.from_file(path, schema=SCHEMA)
+    write_files(tmpdir, {'conf.d/one.ini': '[section]\nqux = many\n'})
+    with pytest.raises(mod.SchemaError):
+        conf.reload()
+    assert conf['section.baz'] == 2048
+
+
+def test_freeze():
+    conf = mod.ConfDict({'foo': mod.RawValue('1'), 'bar': [1, [2, 3]]})
+    conf.lazy = True
+    frozen = conf.freeze()
+    assert type(frozen) is mod.FrozenConf
+    assert frozen == {'foo': 1, 'bar': (1, (2, 3))}
+    assert frozen['foo'] == 1
+    assert frozen.get('missing') is None
+    with pytest.raises(mod.ConfigurationFormatError):
+        frozen['missing']
+    conf['foo'] = 2
+    assert frozen['foo'] == 1
+
+
+@pytest.mark.parametrize('modify', [
+    lambda d: d.__setitem__('foo', 2),
+    lambda d: d.__delitem__('foo'),
+    lambda d: d.update(foo=2),
+    lambda d: d.setdefault('baz', 2),
+    lambda d: d.pop('foo'),
+    lambda d: d.popitem(),
+    lambda d: d.clear(),
+])
+def test_freeze_read_only(modify):
+    frozen = mod.ConfDict(foo=1).freeze()
+    with pytest.raises(TypeError):
+        modify(frozen)
+    assert frozen == {'foo': 1}
+
+
+def test_freeze_copy():
+    frozen = mod.ConfDict(foo=1).freeze()
+    for clone in (copy.copy(frozen), copy.deepcopy(frozen), frozen.copy(),
+                  pickle.loads(pickle.dumps(frozen))):
+        assert type(clone) is mod.FrozenConf
+        assert clone == frozen
+
+
+def test_atomic_conf(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    conf = mod.ConfDict.from_file(path)
+    holder = mod.AtomicConf(conf)
+    assert holder.generation == 1
+    assert type(holder.current) is mod.FrozenConf
+    assert holder.current == conf.freeze()
+    assert holder['foo'] == 1
+    assert holder.get('missing', 2) == 2
+    pinned = holder.current
+    assert not holder.reload()
+    assert holder.current is pinned
+    write_files(tmpdir, {'main.ini': SNAPSHOT_FILES['main.ini'].replace(
+        'foo = 1', 'foo = 2')})
+    assert holder.reload() == ([], [], ['foo'])
+    assert holder.generation == 2
+    assert holder['foo'] == 2
+    # A pinned generation does not change
+    assert pinned['foo'] == 1
+
+
+def test_atomic_conf_publish():
+    holder = mod.AtomicConf({'foo': [1, 2]})
+    assert holder.current == {'foo': (1, 2)}
+    frozen = mod.ConfDict(foo=3).freeze()
+    assert holder.publish(frozen) is frozen
+    assert holder.current is frozen
+    assert holder.generation == 2
+    with pytest.raises(mod.ConfigurationError):
+        holder.reload()
+
+
+def test_atomic_conf_releases_generations():
+    holder = mod.AtomicConf({'foo': 1})
+    pinned = holder.current
+    holder.publish({'foo': 2})
+    holder.publish({'foo': 3})
+    gc.collect()
+    assert holder.live == [1, 3]
+    del pinned
+    gc.collect()
+    assert holder.live == [3]
+
+
+def test_atomic_conf_threads():
+    holder = mod.AtomicConf({'a.x': 0, 'a.y': 0})
+    stop = mod.threading.Event()
+    errors = []
+
+    def read():
+        while not stop.is_set():
+            conf = holder.current
+            if conf['a.x'] != conf['a.y']:
+                errors.append(conf)
+
+    readers = [mod.threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for i in range(1, 200):
+        holder.publish({'a.x': i, 'a.y': i})
+    stop.set()
+    for reader in readers:
+        reader.join()
+    assert not errors
+    assert holder.generation == 200
+
+
+def run_async(start):
+    asyncio = pytest.importorskip('asyncio')
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(start())
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+@pytest.mark.parametrize('options', [{}, {'lazy': True}, {'workers': None},
+                                     {'engine': 'stream'}])
+def test_from_file_async(tmpdir, options):
+    files = dict(SNAPSHOT_FILES)
+    for i in range(5):
+        files['conf.d/{}.ini'.format(i)] = '[s{0}]\nfoo = {0}\n'.format(i)
+    path = write_files(tmpdir, files)
+    conf = run_async(lambda: mod.ConfDict.from_file_async(
+        path, defaults={'initial': 1}, **options))
+    expected = mod.ConfDict.from_file(path, defaults={'initial': 1},
+                                      **options)
+    assert conf == expected
+    assert conf.sources == expected.sources
+    assert conf['s4.foo'] == 4
+
+
+def test_from_file_async_error(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    with pytest.raises(mod.SchemaError):
+        run_async(lambda: mod.ConfDict.from_file_async(
+            path, schema=mod.Schema({'missing': mod.Option(required=True)})))
+
+
+def test_reload_async(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    conf = mod.ConfDict.from_file(path)
+    assert not run_async(conf.reload_async)
+    write_files(tmpdir, {'conf.d/one.ini': '[section]\nbaz = 3KB\n'})
+    diff = run_async(conf.reload_async)
+    assert diff == ([], [], ['section.baz'])
+    assert conf == mod.ConfDict.from_file(path)
+
+
+def test_reload_async_error(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    conf = mod.ConfDict.from_file(path, schema=SCHEMA)
+    write_files(tmpdir, {'conf.d/one.ini': '[section]\nqux = many\n'})
+    with pytest.raises(mod.SchemaError):
+        run_async(conf.reload_async)
+    assert conf['section.baz'] == 2048
+    conf.path = StringIO()
+    with pytest.raises(mod.ConfigurationError):
+        run_async(conf.reload_async)
+
+
+def test_load_stats(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    assert mod.ConfDict.from_file(path).load_stats is None
+    seen = []
+    conf = mod.ConfDict.from_file(path, stats=seen.append)
+    stats = conf.load_stats
+    assert [os.path.basename(s.path) for s in seen] == [
+        'base.ini', 'one.ini', 'main.ini']
+    assert seen[-1] is stats
+    assert list(stats.phases) == list(mod.PHASES)
+    assert stats.total >= stats.phases['preprocess'] >= stats.phases['glob']
+    assert [(c.role, os.path.basename(c.path)) for c in stats.children] == [
+        ('defaults', 'base.ini'), ('include', 'one.ini')]
+    assert stats.files == 3
+    assert stats.bytes == len(SNAPSHOT_FILES['main.ini'])
+    assert stats.total_bytes == sum(len(c) for c in SNAPSHOT_FILES.values())
+    assert stats.options == 4
+    assert stats.total_options == 7
+    assert stats.as_dict()['children'][1]['options'] == 1
+    assert conf == mod.ConfDict.from_file(path)
+
+
+def test_load_stats_reused(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    conf = mod.ConfDict.from_file(path, stats=True)
+    write_files(tmpdir, {'main.ini': SNAPSHOT_FILES['main.ini'] + 'x = 1\n'})
+    conf.reload()
+    assert not any(c.reused for c in conf.load_stats.walk())
+    write_files(tmpdir, {'main.ini': SNAPSHOT_FILES['main.ini'] + 'x = 2\n'})
+    conf.reload()
+    assert [c.reused for c in conf.load_stats.walk()] == [False, True, True]
+    assert conf.load_stats.options == 5
+
+
+DIRECTORY_FILES = {
+    'main.ini': '[config]\ninclude = conf.d/\n[global]\nfoo = 1\n',
+    'conf.d/20-b.ini': '[global]\nfoo = 3\n',
+    'conf.d/10-a.ini': '[global]\nfoo = 2\nbar = 1\n',
+    'conf.d/30-c.ini.bak': '[global]\nfoo = 4\n',
+    'conf.d/.40-d.ini': '[global]\nfoo = 5\n',
+    'conf.d/sub.ini/ignored.ini': '[global]\nfoo = 6\n',
+}
+
+
+def test_directory_include(tmpdir):
+    path = write_files(tmpdir, DIRECTORY_FILES)
+    conf = mod.ConfDict.from_file(path)
+    directory = os.path.join(str(tmpdir.join('conf.d')), '')
+    assert conf.include == [directory + '10-a.ini', directory + '20-b.ini']
+    assert conf.patterns == [(directory, conf.include)]
+    assert conf['foo'] == 3
+    assert conf['bar'] == 1
+
+
+def test_directory_cache(tmpdir):
+    cache = mod.DirectoryCache()
+    write_files(tmpdir, DIRECTORY_FILES)
+    directory = os.path.join(str(tmpdir.join('conf.d')), '')
+    listing = cache.list(directory)
+    assert [os.path.basename(p) for p in listing] == ['10-a.ini', '20-b.ini']
+    assert cache.list(directory) == listing
+    assert cache.scans == 1
+    write_files(tmpdir, {'conf.d/15-e.ini': ''})
+    # The listing is scanned again once the directory changes
+    os.utime(directory, (0, 0))
+    assert len(cache.list(directory)) == 3
+    assert cache.scans == 2
+    tmpdir.join('conf.d').remove()
+    assert cache.list(directory) == []
+
+
+def test_directory_include_reload(tmpdir):
+    path = write_files(tmpdir, DIRECTORY_FILES)
+    conf = mod.ConfDict.from_file(path)
+    assert not conf.is_stale()
+    write_files(tmpdir, {'conf.d/30-c.ini': '[global]\nfoo = 4\n'})
+    os.utime(str(tmpdir.join('conf.d')), (0, 0))
+    assert conf.is_stale()
+    assert conf.reload() == ([], [], ['foo'])
+    watcher = mod.ConfigWatcher(conf)
+    watcher._inotify = mock.Mock()
+    watcher._update_watches()
+    assert watcher._is_relevant(str(tmpdir.join('conf.d')), '50-f.ini', 0)
+    assert not watcher._is_relevant(str(tmpdir.join('conf.d')), 'x.bak', 0)
+
+
+def test_include_graph_loads_files_once(tmpdir):
+    path = write_files(tmpdir, {
+        'main.ini': '[config]\ndefaults = base.ini\n'
+                    'include =\n    one.ini\n    two.ini\n[global]\nfoo = 1\n',
+        'one.ini': '[config]\ndefaults = base.ini\n[one]\nfoo = 1\n',
+        'two.ini': '[config]\ndefaults = base.ini\n[two]\nfoo = 1\n',
+        'base.ini': '[global]\nbar = 1\n+items =\n    a\n',
+    })
+    patcher, reads = record_reads()
+    with patcher:
+        conf = mod.ConfDict.from_file(path, stats=True)
+    assert sorted(reads) == ['base.ini', 'main.ini', 'one.ini', 'two.ini']
+    assert conf['bar'] == 1
+    assert conf['items'] == ['a']
+    assert conf == mod.ConfDict.from_file(path)
+    reused = [os.path.basename(s.path) for s in conf.load_stats.walk()
+              if s.reused]
+    assert reused == ['base.ini', 'base.ini']
+
+
+@pytest.mark.parametrize('files, cycle', [
+    ({'main.ini': '[config]\ninclude = one.ini\n[global]\nfoo = 1\n',
+      'one.ini': '[config]\ndefaults = two.ini\n[one]\nfoo = 1\n',
+      'two.ini': '[config]\ninclude = one.ini\n[two]\nfoo = 1\n'},
+     ['one.ini', 'two.ini', 'one.ini']),
+    ({'main.ini': '[config]\ninclude = *.ini\n[global]\nfoo = 1\n'},
+     ['main.ini', 'main.ini']),
+])
+def test_include_cycle(tmpdir, files, cycle):
+    path = write_files(tmpdir, files)
+    with pytest.raises(mod.ConfigurationError) as exc:
+        mod.ConfDict.from_file(path)
+    root = os.path.realpath(str(tmpdir))
+    expected = ' -> '.join(os.path.join(root, name) for name in cycle)
+    assert str(exc.value).endswith(expected)
+
+
+def test_layered_conf():
+    conf = mod.LayeredConf([{'foo': 1, 'bar': 2}, {'bar': 3, 'baz': 4}])
+    assert conf['bar'] == 2
+    assert conf.get('missing', 5) == 5
+    assert 'baz' in conf and 'missing' not in conf
+    with pytest.raises(mod.ConfigurationFormatError):
+        conf['missing']
+    assert len(conf) == 3
+    assert sorted(conf) == ['bar', 'baz', 'foo']
+    conf['baz'] = 5
+    assert conf['baz'] == 5
+    assert conf.layers[1] == {'bar': 3, 'baz': 4}
+    del conf['baz']
+    assert conf['baz'] == 4
+    with pytest.raises(KeyError):
+        del conf['baz']
+    frozen = conf.freeze()
+    assert type(frozen) is mod.FrozenConf
+    assert frozen == {'foo': 1, 'bar': 2, 'baz': 4}
+
+
+@pytest.mark.parametrize('options', [
+    {}, {'skip_clean': True}, {'lazy': True}, {'noextend': True},
+    {'schema': mod.Schema({'foo': mod.Option(int, required=True),
+                           'section.baz': mod.Option(mod.parse_size,
+                                                     required=True)})},
+])
+def test_layered_conf_from_file(tmpdir, options):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    expected = mod.ConfDict.from_file(path, defaults={'bar': 0}, **options)
+    conf = mod.LayeredConf.from_file(path, defaults={'bar': 0}, **options)
+    assert dict(conf.items()) == dict(expected.items())
+    assert conf.conf.sources == expected.sources
+
+
+def test_layered_conf_read_methods(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    expected = mod.ConfDict.from_file(path)
+    conf = mod.LayeredConf.from_file(path)
+    assert dict(conf.section('section')) == dict(expected.section('section'))
+    assert dict(conf.section('global')) == dict(expected.section('global'))
+    assert conf.match('*.baz') == expected.match('*.baz')
+    assert conf.match('b*') == expected.match('b*')
+    assert conf.get_section('global') == expected.get_section('global')
+    assert conf.get_option('global', 'foo') == '1'
+    assert conf.get_option('global', 'missing', 2) == 2
+    assert conf.sections == expected.sections
+    derived = conf.derive({'section.baz': 1, 'section.new': 2})
+    assert dict(derived.section('section')) == {'baz': 1, 'new': 2}
+    assert derived.match('*.new') == {'section.new': 2}
+    assert derived.sections == expected.sections
+
+
+def test_derive_read_methods(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    conf = mod.ConfDict.from_file(path)
+    derived = conf.derive({'section.qux': 3}).derive(foo=2)
+    assert dict(derived.section('section')) == {'baz': 2048.0, 'qux': 3}
+    assert derived.match('f*') == {'foo': 2}
+    assert derived.get_section('global') == conf.get_section('global')
+    assert derived.get_option('global', 'foo') == '1'
+    assert derived.sections == conf.sections
+
+
+@pytest.mark.parametrize('noextend', [False, True])
+def test_layered_conf_mmap_engine(tmpdir, noextend):
+    files = dict(MMAP_FILES)
+    files['base.ini'] += '[sec]\nhosts =\n    a\n    b\n'
+    files['main.ini'] += '[sec]\n+hosts = c\n'
+    path = write_files(tmpdir, files)
+    expected = mod.ConfDict.from_file(path, engine='mmap', noextend=noextend)
+    conf = mod.LayeredConf.from_file(path, engine='mmap', noextend=noextend)
+    assert conf['sec.hosts'] == (['a', 'b'] if noextend else ['a', 'b', 'c'])
+    assert conf['one.items'] == expected['one.items']
+    assert dict(conf.items()) == dict(expected.items())
+
+
+def test_layered_conf_required(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    schema = mod.Schema({'missing': mod.Option(int, required=True)})
+    with pytest.raises(mod.SchemaError) as exc:
+        mod.LayeredConf.from_file(path, schema=schema)
+    assert exc.value.errors == ["'missing': required option is missing"]
+
+
+def test_layered_conf_shared(tmpdir):
+    path = write_files(tmpdir, SNAPSHOT_FILES)
+    write_files(tmpdir, {
+        'other.ini': '[config]\ndefaults = base.ini\n[global]\nfoo = 2\n'})
+    other = str(tmpdir.join('other.ini'))
+    shared = {}
+    conf = mod.LayeredConf.from_file(path, shared=shared)
+    conf2 = mod.LayeredConf.from_file(other, shared=shared)
+    assert conf.layers[-1] is conf2.layers[-1]
+    assert conf2['foo'] == 2 and conf2['bar'] is True
+    assert not conf2.is_stale()
+    write_files(tmpdir, {'base.ini': '[global]\nbar = no\n'})
+    assert conf2.is_stale()
+    conf2 = mod.LayeredConf.from_file(other, shared=shared)
+    assert conf2['bar'] is False
+    assert conf['bar'] is True
+
+
+def test_derive():
+    conf = mod.ConfDict({'foo': mod.RawValue('1'), 'hosts': ['a'],
+                         'bar': 'x'})
+    conf.lazy = True
+    derived = conf.derive({'+hosts': ['b'], 'bar': 'y'}, baz=2)
+    assert isinstance(derived, mod.LayeredConf)
+    assert derived.overrides == {'hosts': ['a', 'b'], 'bar': 'y', 'baz': 2}
+    assert derived['foo'] == 1
+    assert conf['hosts'] == ['a']
+    assert conf['bar'] == 'x'
+    conf['qux'] = 3
+    assert derived['qux'] == 3
+    derived['foo'] = 4
+    assert conf['foo'] == 1
+    again = derived.derive({'+hosts': 'c', '+new': ['d']})
+    assert again['hosts'] == ['a', 'b', 'c']
+    assert again['new'] == ['d']
+    assert again['foo'] == 4
+    assert again.layers[0] is derived.overrides
+    assert again.freeze()['hosts'] == ('a', 'b', 'c')
+
+
+@pytest.mark.parametrize('exc', [
+    mod.ConfigurationError('error'),
+    mod.ConfigurationFormatError(KeyError('section.key')),
+    mod.SchemaError(['first', 'second']),
+])
+def test_error_pickle(exc):
+    clone = pickle.loads(pickle.dumps(exc))
+    assert type(clone) is type(exc)
+    assert str(clone) == str(exc)
+
+
+FLEET_FILES = {
+    'base.ini': '[global]\nbar = yes\nitems =\n    a\n',
+    'dev1.ini': '[config]\ndefaults = base.ini\n[global]\nfoo = 1\n',
+    'dev2.ini': '[config]\ndefaults = base.ini\n[global]\nfoo = 2\n'
+                '+items =\n    b\n',
+    'bad.ini': 'foo = 1\n',
+    'empty.ini': '',
+}
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+@pytest.mark.parametrize('option', ['snapshot', 'stats'])
+def test_from_files_unsupported(tmpdir, workers, option):
+    write_files(tmpdir, FLEET_FILES)
+    paths = [str(tmpdir.join('dev1.ini'))]
+    options = {option: str(tmpdir.join('conf.snap'))}
+    with pytest.raises(TypeError):
+        list(mod.ConfDict.from_files(paths, workers=workers, **options))
+    assert not tmpdir.join('conf.snap').exists()
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+@pytest.mark.parametrize('options', [{}, {'lazy': True, 'engine': 'mmap'}])
+def test_from_files(tmpdir, workers, options):
+    write_files(tmpdir, FLEET_FILES)
+    paths = [str(tmpdir.join(name)) for name in sorted(FLEET_FILES)]
+    results = list(mod.ConfDict.from_files(paths, workers=workers,
+                                           defaults={'baz': 3}, **options))
+    assert sorted(r.path for r in results) == paths
+    for result in results:
+        name = os.path.basename(result.path)
+        if name in ('bad.ini', 'empty.ini'):
+            assert result.conf is None
+            assert isinstance(result.error, (mod.ConfigurationError,
+                                             mod.ParserError))
+            continue
+        assert result.error is None
+        expected = mod.ConfDict.from_file(result.path, defaults={'baz': 3},
+                                          **options)
+        assert result.conf == expected
+        assert result.conf.sources == expected.sources
+        assert result.conf.get_section('global') == expected.get_section(
+            'global')
+        assert not result.conf.reload()
@@ -1,5 +1,7 @@
 import os
 
+import pytest
+
 import confloader as mod
 
 
@@ -38,11 +40,45 @@ def test_sample_related():
     assert conf['extend_me'] == ['foo', 'bar', 'baz']
 
 
+def test_sample_sources():
+    conf = mod.ConfDict.from_file(sample_file)
+    names = [os.path.basename(p) for p in conf.sources]
+    assert names == ['sample.ini', 'defaults.ini', 'include1.ini']
+    assert all(stamp is not None for stamp in conf.sources.values())
+
+
 def test_sample_with_defaults():
     conf = mod.ConfDict.from_file(sample_file, defaults=dict(excellent=True))
     assert conf['excellent'] is True
 
 
+def test_sample_lazy():
+    expected = mod.ConfDict.from_file(sample_file)
+    conf = mod.ConfDict.from_file(sample_file, lazy=True)
+    assert conf['int'] == 12
+    assert conf['extend_me'] == ['foo', 'bar', 'baz']
+    assert dict(conf.items()) == expected
+
+
+def test_sample_lazy_without_cleaning():
+    expected = mod.ConfDict.from_file(sample_file, skip_clean=True)
+    conf = mod.ConfDict.from_file(sample_file, skip_clean=True, lazy=True)
+    assert dict(conf) == expected
+
+
+@pytest.mark.parametrize('path', [sample_file, sample_file2])
+@pytest.mark.parametrize('skip_clean', [False, True])
+@pytest.mark.parametrize('engine', ['stream', 'mmap'])
+def test_sample_engines(path, skip_clean, engine):
+    expected = mod.ConfDict.from_file(path, skip_clean=skip_clean)
+    conf = mod.ConfDict.from_file(path, skip_clean=skip_clean, engine=engine)
+    conf.resolve()
+    assert conf == expected
+    assert conf.sections == expected.sections
+    for section in conf.sections:
+        assert conf.get_section(section) == expected.get_section(section)
+
+
 def test_sample_without_cleaning():
     conf = mod.ConfDict.from_file(sample_file, skip_clean=True)
     assert conf['blank'] == ''